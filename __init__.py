@@ -1,11 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, g
 from database import db_helper
 import sqlite3
 import os
 from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash # <--- jiawen added this
-from features.story import story_bp
+from features.story import story_bp, init_moderation
+from moderation import local_verdicts, remote_verdicts
+from uploads import UploadError, remove_upload, save_upload, upload_url
+from achievements import achievement_scheduler
 from features.garden import garden_bp 
 import re
 import random
@@ -21,12 +23,14 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
 init_messaging(socketio)
+init_moderation(socketio)
 # Secret key is required to use 'session' (it encrypts the cookie)
 app.secret_key = 'winx_club_secret'
 
 app.register_blueprint(story_bp)
 app.register_blueprint(garden_bp)
 app.register_blueprint(messaging_bp)
+app.jinja_env.globals["upload_url"] = upload_url
 # Setup upload folder
 UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -34,6 +38,22 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 
+# Notices are buffered per process (NoticeWriter). A request that posted one
+# writes it before answering and remembers its id, so /community on another
+# worker doesn't serve a cached snapshot without it.
+@app.before_request
+def _count_notices():
+    g.notices_added = db_helper.notice_writer.added
+
+
+@app.after_request
+def _flush_request_notices(response):
+    if db_helper.notice_writer.added != g.get("notices_added", db_helper.notice_writer.added):
+        db_helper.notice_writer.flush()
+        session["notice_upto"] = db_helper.notice_writer.last_id
+    return response
+
+
 # ADMIN
 def admin_required(f):
     @wraps(f)
@@ -104,8 +124,11 @@ def signup():
                 "INSERT INTO profiles (user_id, name, region, email, bio) VALUES (?, ?, ?, ?, ?)",
                 (user_id, name, region, email, bio)
             )
+            moved = db_helper.move_region_member(conn, None, None, region, role)
 
             conn.commit()
+            for r in moved:
+                db_helper.community.invalidate(r)
 
             db_helper.add_notice(
                 username=username,
@@ -204,21 +227,27 @@ def edit_profile():
 
             file = request.files.get('profile_image')
 
-            # ✅ Get old region BEFORE updating
-            old_row = conn.execute(
-                "SELECT region FROM profiles WHERE user_id = ?",
-                (session['user_id'],)
-            ).fetchone()
+            # ✅ Get old region (and role, for region_stats) BEFORE updating
+            old_row = conn.execute("""
+                SELECT p.region, u.role, p.profile_pic
+                FROM profiles p
+                JOIN users u ON u.id = p.user_id
+                WHERE p.user_id = ?
+            """, (session['user_id'],)).fetchone()
             old_region = (old_row["region"] if old_row else None) or "Unknown"
 
             # 1) Image Update Logic
+            replaced_pic = None
             if file and file.filename:
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                conn.execute(
-                    "UPDATE profiles SET profile_pic = ? WHERE user_id = ?",
-                    (filename, session['user_id'])
-                )
+                try:
+                    filename = save_upload(file)
+                    replaced_pic = old_row["profile_pic"] if old_row else None
+                    conn.execute(
+                        "UPDATE profiles SET profile_pic = ? WHERE user_id = ?",
+                        (filename, session['user_id'])
+                    )
+                except UploadError as e:
+                    flash(f"Profile picture not saved: {e}")
 
             # 2) Update Profiles Table
             conn.execute(
@@ -231,8 +260,14 @@ def edit_profile():
                 "UPDATE users SET role = ? WHERE id = ?",
                 (new_role, session['user_id'])
             )
+            moved = []
+            if old_row:
+                moved = db_helper.move_region_member(conn, old_row["region"], old_row["role"], new_region, new_role)
 
             conn.commit()
+            for r in moved:
+                db_helper.community.invalidate(r)
+            remove_upload(replaced_pic)
 
             # ✅ Add notices if region changed
             if new_region and old_region != new_region:
@@ -286,10 +321,13 @@ def remove_photo():
 
     conn = db_helper.get_connection()
     try:
+        old = conn.execute("SELECT profile_pic FROM profiles WHERE user_id = ?", (session['user_id'],)).fetchone()
         # Reset to default
         conn.execute("UPDATE profiles SET profile_pic = 'profile_pic.png' WHERE user_id = ?", 
                      (session['user_id'],))
         conn.commit()
+        if old:
+            remove_upload(old["profile_pic"])
         flash("Photo removed successfully!")
     except Exception as e:
         flash(f"Error: {e}")
@@ -342,7 +380,7 @@ def delete_account():
     try:
         # 1) Get username + region BEFORE deleting
         row = conn.execute("""
-            SELECT u.username, p.region
+            SELECT u.username, u.role, p.region, p.profile_pic
             FROM users u
             JOIN profiles p ON u.id = p.user_id
             WHERE u.id = ?
@@ -363,7 +401,14 @@ def delete_account():
         # Delete from all tables to avoid errors for your team
         conn.execute("DELETE FROM profiles WHERE user_id = ?", (uid,))
         conn.execute("DELETE FROM users WHERE id = ?", (uid,))
+        moved = []
+        if row:
+            moved = db_helper.move_region_member(conn, row["region"], row["role"], None, None)
         conn.commit()
+        for r in moved:
+            db_helper.community.invalidate(r)
+        if row:
+            remove_upload(row["profile_pic"])
 
         session.clear()
         flash("Account deleted.")
@@ -717,18 +762,28 @@ def admin_dashboard():
     """).fetchone()[0]
 
     # ----- REPORTED COMMENTS -----      ← ADD THIS BLOCK
+    # (+ comments still 'pending': Sightengine couldn't check them)
     reported_comments = conn.execute("""
         SELECT 
             sc.id,
             sc.content,
+            sc.status,
             u.username,
             s.title AS story_title,
-            cr.reason AS report_reason
+            cr.reason AS report_reason,
+            cr.created_at AS listed_at
         FROM comment_reports cr
         JOIN story_comments sc ON cr.comment_id = sc.id
         JOIN users u ON sc.user_id = u.id
         JOIN stories s ON sc.story_id = s.id
-        ORDER BY cr.created_at DESC
+        UNION ALL
+        SELECT sc.id, sc.content, sc.status, u.username, s.title, NULL, sc.created_at
+        FROM story_comments sc
+        JOIN users u ON sc.user_id = u.id
+        JOIN stories s ON sc.story_id = s.id
+        WHERE sc.status = 'pending'
+          AND NOT EXISTS (SELECT 1 FROM comment_reports WHERE comment_id = sc.id)
+        ORDER BY listed_at DESC
     """).fetchall()
 
     # ----- EVENTS COUNT (SAFE) -----
@@ -765,6 +820,9 @@ def approve_story(story_id):
         SET status = 'approved'
         WHERE id = ?
     """, (story_id,))
+    db_helper.sync_story_activity(conn, story_id)
+    # a story Sightengine couldn't check earns its water now
+    db_helper.pay_story_water(conn, story_id)
 
     conn.execute("""
         DELETE FROM reports
@@ -784,7 +842,9 @@ def approve_story(story_id):
 @admin_required
 def delete_story(story_id):
     conn = db_helper.get_connection()
+    story = conn.execute("SELECT image_path FROM stories WHERE id = ?", (story_id,)).fetchone()
 
+    db_helper.forget_story_activity(conn, story_id)
     conn.execute("DELETE FROM reports WHERE story_id = ?", (story_id,))
     conn.execute("DELETE FROM story_likes WHERE story_id = ?", (story_id,))
     conn.execute("DELETE FROM story_comments WHERE story_id = ?", (story_id,))
@@ -792,6 +852,8 @@ def delete_story(story_id):
 
     conn.commit()
     conn.close()
+    if story:
+        remove_upload(story["image_path"])
 
     flash("Story deleted successfully")
     return redirect(url_for("admin_dashboard"))
@@ -806,6 +868,7 @@ def approve_comment(comment_id):
     conn.execute("DELETE FROM comment_reports WHERE comment_id = ?", (comment_id,))
     conn.commit()
     conn.close()
+    db_helper.set_comment_status(comment_id, "approved")
     flash("Comment approved (report dismissed)")
     return redirect(url_for("admin_dashboard"))
 
@@ -817,12 +880,21 @@ def approve_comment(comment_id):
 def delete_comment_admin(comment_id):
     conn = db_helper.get_connection()
     conn.execute("DELETE FROM comment_reports WHERE comment_id = ?", (comment_id,))
-    conn.execute("DELETE FROM story_comments WHERE id = ?", (comment_id,))
+    db_helper.delete_comment_row(conn, comment_id)
     conn.commit()
     conn.close()
     flash("Comment deleted successfully")
     return redirect(url_for("admin_dashboard"))
 
+# =========================
+# ADMIN – MODERATION CACHE STATS
+# =========================
+@app.route("/admin/moderation-cache")
+@admin_required
+def moderation_cache_stats():
+    # per worker process
+    return jsonify({"local": local_verdicts.stats(), "sightengine": remote_verdicts.stats()})
+
 # =========================
 # ADMIN – EVENTS
 # =========================
@@ -863,9 +935,10 @@ def add_event():
     filename = None
 
     if image_file and image_file.filename:
-        filename = secure_filename(image_file.filename)
-        image_path = os.path.join("static", "uploads", filename)
-        image_file.save(image_path)
+        try:
+            filename = save_upload(image_file)
+        except UploadError as e:
+            flash(f"Event image not saved: {e}")
 
     conn.execute("""
         INSERT INTO events (
@@ -920,11 +993,14 @@ def edit_event(event_id):
 
         image_file = request.files.get("image")
 
+        filename = None
         if image_file and image_file.filename != "":
-            filename = secure_filename(image_file.filename)
-            image_path = os.path.join("static/uploads", filename)
-            image_file.save(image_path)
+            try:
+                filename = save_upload(image_file)
+            except UploadError as e:
+                flash(f"Event image not saved: {e}")
 
+        if filename:
             conn.execute("""
                 UPDATE events
                 SET title=?, event_date=?, short_description=?,
@@ -932,6 +1008,7 @@ def edit_event(event_id):
                 WHERE id=?
             """, (title, event_date, short_description,
                   full_description, status, filename, event_id))
+            replaced_image = event["image_filename"]
         else:
             conn.execute("""
                 UPDATE events
@@ -940,9 +1017,11 @@ def edit_event(event_id):
                 WHERE id=?
             """, (title, event_date, short_description,
                   full_description, status, event_id))
+            replaced_image = None
 
         conn.commit()
         conn.close()
+        remove_upload(replaced_image)
         return redirect(url_for("admin_events"))
 
     conn.close()
@@ -956,9 +1035,12 @@ def edit_event(event_id):
 @admin_required
 def delete_event_admin(event_id):
     conn = db_helper.get_connection()
+    event = conn.execute("SELECT image_filename FROM events WHERE id = ?", (event_id,)).fetchone()
     conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
     conn.commit()
     conn.close()
+    if event:
+        remove_upload(event["image_filename"])
 
     return redirect(url_for("admin_events"))
 
@@ -1013,20 +1095,8 @@ def view_profile(username):
 
         stories = conn.execute("""
             SELECT s.*,
-                   COALESCE(lc.like_count, 0) AS like_count,
-                   COALESCE(cc.comment_count, 0) AS comment_count,
                    CASE WHEN ul.user_id IS NULL THEN 0 ELSE 1 END AS user_liked
             FROM stories s
-            LEFT JOIN (
-                SELECT story_id, COUNT(*) AS like_count
-                FROM story_likes
-                GROUP BY story_id
-            ) lc ON lc.story_id = s.id
-            LEFT JOIN (
-                SELECT story_id, COUNT(*) AS comment_count
-                FROM story_comments
-                GROUP BY story_id
-            ) cc ON cc.story_id = s.id
             LEFT JOIN story_likes ul
                 ON ul.story_id = s.id AND ul.user_id = ?
             WHERE s.user_id = ? AND s.status = 'approved'
@@ -1075,50 +1145,17 @@ def community():
     profile = db_helper.get_profile_by_user_id(current_user_id) or {"region": "Unknown"}
     region_name = profile.get("region", "Unknown")
 
-    youth_members, senior_members, total_members = db_helper.get_region_member_counts(region_name)
-
-    last_notice_update = db_helper.get_latest_notice_timestamp(region_name)
-    notices = db_helper.get_region_notices(region_name, limit=3)
-    latest_notice = notices[0] if notices else None   # keep as dict, no comma
-
     achievement_last_update = get_last_monday()
-    week_start_dt = achievement_last_update
-    week_end_dt = week_start_dt + timedelta(days=7)
-    week_start_str = week_start_dt.strftime("%Y-%m-%d")
+    week_start_str = achievement_last_update.strftime("%Y-%m-%d")
 
-    weekly = db_helper.get_weekly_achievements(week_start_str)
+    # weekly achievements are written by achievement_scheduler in the background;
+    # the region part of the page comes from one cached snapshot, only the profile is read live
+    achievement_scheduler.ensure_running()
+    snap = db_helper.get_community_snapshot(region_name, week_start_str,
+                                            notices_upto=session.get("notice_upto", 0))
 
-    # latest notice this week (any region)
-    latest_notice_this_week = db_helper.get_latest_notice_timestamp_in_range(week_start_dt, week_end_dt)
-
-    trees_harvested, flowers_harvested, community_points = db_helper.get_region_tree_totals(region_name)
-
-    tree_stage = get_tree_stage(community_points)   
-    tree_image = get_tree_image(community_points)
-
-
-    should_recompute = False
-
-    if not weekly:
-        should_recompute = True
-    else:
-        # weekly["generated_at"] is SQLite CURRENT_TIMESTAMP (UTC)
-        gen = weekly.get("generated_at")
-        if gen and latest_notice_this_week:
-            generated_at_dt = datetime.strptime(gen, "%Y-%m-%d %H:%M:%S")
-            # if your notices/generate_at are UTC, compare directly
-            if latest_notice_this_week > generated_at_dt:
-                should_recompute = True
-
-    if should_recompute:
-        most_active, participation, best_harvest = db_helper.compute_weekly_winners(
-                week_start_dt, week_end_dt
-            )
-
-        db_helper.save_weekly_achievements(
-            week_start_str, most_active, participation, best_harvest
-        )
-        weekly = db_helper.get_weekly_achievements(week_start_str)
+    tree_stage = get_tree_stage(snap.community_points)   
+    tree_image = get_tree_image(snap.community_points)
 
 
     # IMPORTANT: pass acceptance flag
@@ -1130,24 +1167,24 @@ def community():
     return render_template(
         'community/community.html',
         profile=profile,
-        youth_members=youth_members,
-        senior_members=senior_members,
-        total_members=total_members,
+        youth_members=snap.youth_members,
+        senior_members=snap.senior_members,
+        total_members=snap.total_members,
 
-        last_notice_update=last_notice_update,
-        notices=notices,
-        latest_notice=latest_notice,
+        last_notice_update=snap.last_notice_update,
+        notices=snap.notices,
+        latest_notice=snap.latest_notice,
 
         achievement_last_update=achievement_last_update,
-        most_active_region=weekly["most_active_region"],
-        best_harvest_region=weekly["best_harvest_region"],
-        participation_region=weekly["participation_region"],
+        most_active_region=snap.weekly["most_active_region"],
+        best_harvest_region=snap.weekly["best_harvest_region"],
+        participation_region=snap.weekly["participation_region"],
             
         guidelines_accepted=guidelines_accepted,
 
-        trees_harvested=trees_harvested,
-        flowers_harvested=flowers_harvested,
-        community_points=community_points,
+        trees_harvested=snap.trees_harvested,
+        flowers_harvested=snap.flowers_harvested,
+        community_points=snap.community_points,
 
         stage=tree_stage,
         tree_image=tree_image,
@@ -1416,25 +1453,6 @@ def get_events_demo_now():
 # DM STREAK PERSISTENCE (SQLite)
 # =========================
 
-def ensure_dm_streak_table():
-    """
-    Creates a small table to persist DM streak state.
-    This prevents streaks resetting when server restarts/reloads.
-    """
-    conn = db_helper.get_connection()
-    try:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS dm_streak_state (
-                room TEXT PRIMARY KEY,
-                streak INTEGER NOT NULL DEFAULT 0,
-                last_day TEXT NOT NULL DEFAULT ''
-            )
-        """)
-        conn.commit()
-    finally:
-        conn.close()
-
-
 def db_get_dm_state(room: str):
     """
     Returns (streak:int, last_day:str) from DB, defaults (0,'') if missing.
@@ -1470,9 +1488,6 @@ def db_set_dm_state(room: str, streak: int, last_day: str):
         conn.close()
 
 
-# ✅ run once on startup
-ensure_dm_streak_table()
-
 print("APP ROOT:", app.root_path)
 print("TEMPLATE FOLDER:", app.template_folder)
 
@@ -1492,23 +1507,6 @@ if os.path.exists(messaging_dir):
 # ✅ DM STREAK PERSISTENCE (SQLite) — prevents reset on reopen
 # ============================================================
 
-def ensure_dm_streak_table():
-    """
-    Create a table to persist DM streak state so it survives reloads/restarts.
-    """
-    conn = db_helper.get_connection()
-    try:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS dm_streak_state (
-                room TEXT PRIMARY KEY,
-                streak INTEGER NOT NULL DEFAULT 0,
-                last_day TEXT NOT NULL DEFAULT ''
-            )
-        """)
-        conn.commit()
-    finally:
-        conn.close()
-
 def db_get_dm_state(room: str):
     """
     Returns (streak:int, last_day:str). Defaults to (0, '') if missing.
@@ -1542,13 +1540,54 @@ def db_set_dm_state(room: str, streak: int, last_day: str):
     finally:
         conn.close()
 
-# run once when file loads
-ensure_dm_streak_table()
 
 
+# =========================
+# MAINTENANCE COMMANDS (flask <command>)
+# =========================
+@app.cli.command("rebuild-story-counters")
+def rebuild_story_counters_command():
+    """Recount stories.like_count / comment_count from story_likes + story_comments."""
+    fixed = db_helper.rebuild_story_counters()
+    print(f"✅ Story counters rebuilt ({fixed} stories corrected).")
+
+
+@app.cli.command("rebuild-conversations")
+def rebuild_conversations_command():
+    """Rebuild the DM sidebar summaries (conversations) from messages."""
+    pairs = db_helper.rebuild_conversations()
+    print(f"✅ Conversations rebuilt ({pairs} DM pairs).")
+
+
+@app.cli.command("rebuild-region-rollups")
+def rebuild_region_rollups_command():
+    """Rebuild the weekly region activity rollups (community awards) from scratch."""
+    rows = db_helper.rebuild_region_rollups()
+    print(f"✅ Region rollups rebuilt ({rows} region-weeks).")
+
+
+@app.cli.command("rebuild-region-stats")
+def rebuild_region_stats_command():
+    """Check region_stats against users/profiles and community_tree_stats, and fix it."""
+    diffs = db_helper.rebuild_region_stats()
+    for region, (old, new) in sorted(diffs.items()):
+        print(f"⚠️ {region}: {old} -> {new}")
+    print(f"✅ Region stats rebuilt ({len(diffs)} regions corrected).")
+
+
+@app.cli.command("refresh-weekly-achievements")
+def refresh_weekly_achievements_command():
+    """Finalize last week's achievements and refresh this week's (same as the scheduler)."""
+    written = achievement_scheduler.refresh()
+    if written is None:
+        print("⚠️ A refresh is already running.")
+    else:
+        print(f"✅ Weekly achievements written for {', '.join(written)}.")
+
 
 # --- 7. START THE SERVER ---
 if __name__ == '__main__':
+    achievement_scheduler.ensure_running()
     socketio.run(app, debug=True)
 
 # =========================
@@ -1675,6 +1714,7 @@ def demo_reset_all():
     conn = db_helper.get_connection()
     try:
         conn.execute("DELETE FROM messages")
+        conn.execute("DELETE FROM conversations")
 
         # ✅ ALSO clear persisted DM streak state
         conn.execute("DELETE FROM dm_streak_state")
@@ -1688,6 +1728,8 @@ def demo_reset_all():
         conn.commit()
     finally:
         conn.close()
+    db_helper.unread.clear()
+    db_helper.rebuild_region_rollups()
 
     dm_streaks.clear()
     dm_sent_today.clear()
@@ -0,0 +1,98 @@
+"""
+Weekly regional achievements (Most Active / Participation / Best Harvest),
+computed in the background instead of inside /community.
+
+WeeklyAchievementScheduler runs in a daemon thread:
+- every ACHIEVEMENTS_REFRESH_SECONDS it refreshes the current week's
+  weekly_achievements row from the region rollups
+- once a week is over (the Monday boundary) it writes that week one last
+  time with finalized = 1; a finalized row is never overwritten
+Only one refresh runs at a time per process; a second caller just skips.
+
+/community only reads weekly_achievements. `flask refresh-weekly-achievements`
+does the same work once, for running from cron with
+ACHIEVEMENTS_SCHEDULER=0.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import db_helper
+
+ACHIEVEMENTS_SCHEDULER = os.getenv("ACHIEVEMENTS_SCHEDULER", "1") == "1"
+ACHIEVEMENTS_REFRESH_SECONDS = float(os.getenv("ACHIEVEMENTS_REFRESH_SECONDS", "300"))
+
+
+def week_start(now=None):
+    """Monday 00:00 of the week `now` is in (local time, like the community page)."""
+    now = now or datetime.now()
+    monday = now - timedelta(days=now.weekday())
+    return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class WeeklyAchievementScheduler:
+    def __init__(self, db, interval=ACHIEVEMENTS_REFRESH_SECONDS):
+        self.db = db
+        self.interval = float(interval)
+        self._lock = threading.Lock()      # single-flight: one refresh at a time
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def refresh(self, now=None):
+        """
+        Finalize last week (if not done yet) and refresh this week.
+        Returns the week_start strings written, or None if another refresh
+        was already running.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            current = week_start(now)
+            previous = current - timedelta(days=7)
+            written = []
+            last_week = self.db.get_weekly_achievements(previous.strftime("%Y-%m-%d"))
+            if not (last_week and last_week.get("finalized")):
+                self._write(previous, finalized=True)
+                written.append(previous.strftime("%Y-%m-%d"))
+            self._write(current, finalized=False)
+            written.append(current.strftime("%Y-%m-%d"))
+            return written
+        finally:
+            self._lock.release()
+
+    def _write(self, start_dt, finalized):
+        most_active, participation, best_harvest = self.db.compute_weekly_winners(start_dt)
+        self.db.save_weekly_achievements(
+            start_dt.strftime("%Y-%m-%d"), most_active, participation, best_harvest,
+            finalized=finalized
+        )
+
+    def ensure_running(self):
+        """Start the thread in this process (again after a fork). Cheap to call often."""
+        if not ACHIEVEMENTS_SCHEDULER or self.interval <= 0:
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="weekly-achievements", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("⚠️ weekly achievements refresh failed:", e)
+            time.sleep(self._seconds_to_next_run())
+
+    def _seconds_to_next_run(self):
+        # wake up right after the Monday boundary even if the interval is long
+        now = datetime.now()
+        to_boundary = (week_start(now) + timedelta(days=7) - now).total_seconds() + 1
+        return max(1.0, min(self.interval, to_boundary))
+
+
+achievement_scheduler = WeeklyAchievementScheduler(db_helper)
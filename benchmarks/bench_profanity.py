@@ -0,0 +1,57 @@
+"""
+Micro-benchmark for the compiled ProfanityMatcher.
+
+    python benchmarks/bench_profanity.py
+
+Times contains_bad_word + contains_bad_content on short comments and long
+stories. That the verdicts match the old per-token loops is checked by
+tests/test_profanity.py.
+"""
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profanity import STRICT_BANNED, ProfanityMatcher, load_banned_words_file  # noqa: E402
+
+WORDS = STRICT_BANNED | load_banned_words_file(os.path.join(ROOT, "banned_words.txt"))
+MATCHER = ProfanityMatcher(WORDS)
+
+
+# ------------------------------------------------------------
+# corpus
+# ------------------------------------------------------------
+CLEAN = (
+    "my grandmother taught me to plant chilli and pandan in the kampong garden "
+    "we would wake up early before school and water everything together "
+    "assignment classic bass cocktail therapist analysis "
+    "i still remember the smell of rain on the zinc roof and the sound of the radio"
+).split()
+
+
+def long_story(n_words, rng):
+    return " ".join(rng.choice(CLEAN) for _ in range(n_words)) + "."
+
+
+def main():
+    rng = random.Random(7)
+
+    def check(text):
+        return MATCHER.contains_bad_word(text) or MATCHER.contains_bad_content(text)
+
+    print(f"{'text':>18} {'ms':>10}")
+    for label, text, number in [
+        ("comment (12 w)", long_story(12, rng), 5000),
+        ("story (300 w)", long_story(300, rng), 500),
+        ("story (3000 w)", long_story(3000, rng), 50),
+        ("story (30000 w)", long_story(30000, rng), 5),
+    ]:
+        t = min(timeit.repeat(lambda: check(text), number=number, repeat=3)) / number * 1000
+        print(f"{label:>18} {t:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
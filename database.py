@@ -1,329 +1,897 @@
 import sqlite3
+import json
+import atexit
 from datetime import datetime, timedelta
 import random
 import string
+import threading
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "legacygarden.db")
-class DatabaseHelper:
-    def __init__(self, db_name='legacygarden.db'):
-        self.db_name = db_name
-        self.init_database()
-
-    def get_connection(self):
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        DB_PATH = os.path.join(BASE_DIR, "legacygarden.db")
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    def init_database(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # 1. CORE USER TABLES
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT,
-                role TEXT,
-                points INTEGER DEFAULT 0
-            )
-        """)
+# DB_PATH points the app (and the tests) at another database file
+DB_PATH = os.getenv("DB_PATH") or os.path.join(BASE_DIR, "legacygarden.db")
+
+# Connection pool tuning (override per environment)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+
+# Storage profile (PRAGMAs applied to every connection), pick with DB_STORAGE_PROFILE
+STORAGE_PROFILES = {
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,            # ms to wait on a locked db instead of failing
+        "mmap_size": 128 * 1024 * 1024,
+        "cache_size": -16000,            # negative = KiB, so ~16 MB per connection
+        "wal_autocheckpoint": 1000,      # pages
+        "journal_size_limit": 64 * 1024 * 1024,
+        "checkpoint_interval": 60,       # seconds between background checkpoints
+        "checkpoint_truncate_bytes": 32 * 1024 * 1024,
+    },
+    "development": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 32 * 1024 * 1024,
+        "cache_size": -4000,
+        "wal_autocheckpoint": 1000,
+        "journal_size_limit": 16 * 1024 * 1024,
+        "checkpoint_interval": 120,
+        "checkpoint_truncate_bytes": 8 * 1024 * 1024,
+    },
+    "test": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "busy_timeout": 2000,
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "wal_autocheckpoint": 1000,
+        "journal_size_limit": 4 * 1024 * 1024,
+        "checkpoint_interval": 0,        # no background thread in tests
+        "checkpoint_truncate_bytes": 0,
+    },
+    # old behaviour: rollback journal, sqlite defaults
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "checkpoint_interval": 0,
+    },
+}
+DB_STORAGE_PROFILE = os.getenv("DB_STORAGE_PROFILE", "production")
+# in-process unread DM counts (UnreadCounts); turn off when running several worker processes
+UNREAD_CACHE = os.getenv("UNREAD_CACHE", "1") == "1"
+# delivered/read receipts are buffered this long and written in one transaction (0 = write-through)
+RECEIPT_FLUSH_MS = float(os.getenv("RECEIPT_FLUSH_MS", "25"))
+RECEIPT_MAX_PENDING = int(os.getenv("RECEIPT_MAX_PENDING", "200"))
+# notice board posts are buffered this long / this many and inserted in one transaction (0 = write-through)
+NOTICE_FLUSH_MS = float(os.getenv("NOTICE_FLUSH_MS", "250"))
+NOTICE_MAX_PENDING = int(os.getenv("NOTICE_MAX_PENDING", "100"))
+# region part of the /community page (CommunitySnapshot), cached per region; 0 = no cache
+COMMUNITY_CACHE_SECONDS = float(os.getenv("COMMUNITY_CACHE_SECONDS", "60"))
+COMMUNITY_NOTICE_LIMIT = 3
+
+# Story feed page size (keyset pagination, see get_story_feed_page)
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 50
+# feed sort -> ORDER BY (each one matches a keyset cursor in get_story_feed_page)
+FEED_SORTS = {
+    "newest": "s.id DESC",
+    "oldest": "s.id ASC",
+    "popular": "s.like_count DESC, s.id DESC",
+}
+
+# DM history page size (keyset pagination, see get_chat_history)
+CHAT_PAGE_SIZE = 50
+CHAT_MAX_PAGE_SIZE = 200
+
+
+def get_storage_profile(name=None):
+    name = (name or DB_STORAGE_PROFILE or "production").strip().lower()
+    if name not in STORAGE_PROFILES:
+        print(f"⚠️ Unknown DB_STORAGE_PROFILE '{name}', using 'production'")
+        name = "production"
+    return name, STORAGE_PROFILES[name]
+
+
+def apply_storage_profile(conn, profile):
+    """Run the profile PRAGMAs on a fresh connection."""
+    for key in ("busy_timeout", "journal_mode", "synchronous", "mmap_size",
+                "cache_size", "wal_autocheckpoint", "journal_size_limit"):
+        if key in profile:
+            conn.execute(f"PRAGMA {key} = {profile[key]}")
+
+
+# =========================
+# CONNECTION POOL
+# =========================
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that goes back to its pool on close().
+    Callers keep using the usual `conn = get_connection() ... conn.close()` pattern.
+    """
+    _pool = None
+    _pid = None  # process that opened it
+    _checked_out = False
+    _released_at = 0.0
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            return super().close()
+        pool.release(self)
+
+    def discard(self):
+        """Really close the underlying sqlite handle."""
+        self._pool = None
         try:
-            cursor.execute("ALTER TABLE users ADD COLUMN points INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
+            super().close()
+        except sqlite3.Error:
             pass
 
 
+class ConnectionPool:
+    """
+    Small sqlite connection pool.
+    - Idle connections sit in a shared LIFO list (at most max_size).
+    - A thread gets back the connection it released last when it is still idle,
+      so repeated helper calls inside one request reuse one handle.
+    - Connections idle longer than idle_timeout seconds are closed.
+    - After a fork (gunicorn workers) the inherited pool is dropped, never shared.
+    """
+
+    def __init__(self, db_path, max_size=DB_POOL_SIZE, idle_timeout=DB_POOL_IDLE_TIMEOUT, profile=None):
+        self.db_path = db_path
+        self.profile = profile or {}
+        self.max_size = max(0, int(max_size))
+        self.idle_timeout = float(idle_timeout)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        timeout = self.profile.get("busy_timeout", 5000) / 1000.0
+        conn = sqlite3.connect(self.db_path, timeout=timeout,
+                               factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        apply_storage_profile(conn, self.profile)
+        conn._pool = self
+        conn._pid = os.getpid()
+        return conn
 
-        # 2B. STORY DRAFTS (NEW)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS story_drafts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                title TEXT,
-                content TEXT,
-                topic TEXT,
-                image_path TEXT,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        draft_alters = [
-            "ALTER TABLE story_drafts ADD COLUMN image_path TEXT",
-            "ALTER TABLE story_drafts ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP",
-            "ALTER TABLE story_drafts ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP",
-        ]
-        for stmt in draft_alters:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
+    def _expired(self, conn, now):
+        return self.idle_timeout > 0 and (now - conn._released_at) > self.idle_timeout
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # connections inherited from the parent process must not be reused
+            self._pid = os.getpid()
+            self._idle = []
+            self._lock = threading.Lock()
+            self._local = threading.local()
+
+    def acquire(self):
+        self._check_fork()
+        now = time.monotonic()
+        mine = getattr(self._local, "last", None)
+        conn = None
 
+        with self._lock:
+            # drop expired connections (oldest are at the front)
+            stale = []
+            while self._idle and self._expired(self._idle[0], now):
+                stale.append(self._idle.pop(0))
+
+            if mine is not None:
+                for i, c in enumerate(self._idle):
+                    if c is mine:
+                        conn = self._idle.pop(i)
+                        break
+            if conn is None and self._idle:
+                conn = self._idle.pop()
+
+        for c in stale:
+            c.discard()
+
+        if conn is None:
+            conn = self._connect()
+        conn._checked_out = True
+        return conn
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS profiles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                name TEXT,
-                region TEXT,
-                email TEXT,
-                bio TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
+    def release(self, conn):
+        if not conn._checked_out:
+            return  # double close()
+        conn._checked_out = False
 
-        # --- SAFE ALTER: add profile_pic column if missing ---
-        try:
-            cursor.execute("ALTER TABLE profiles ADD COLUMN profile_pic TEXT")
-        except sqlite3.OperationalError:
-            pass
+        if conn._pid != os.getpid():
+            # opened by the parent before a fork: never pool it here
+            conn.discard()
+            return
+        self._check_fork()
 
-        # --- SAFE ALTER: add missing columns for profiles (settings + profile pic) ---
-        profile_alters = [
-            "ALTER TABLE profiles ADD COLUMN profile_pic TEXT",
+        # same semantics as sqlite3 close(): uncommitted work is thrown away
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            return
+
+        conn._released_at = time.monotonic()
+        self._local.last = conn
+
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for c in idle:
+            c.discard()
+
+
+class WalCheckpointer:
+    """
+    Background thread that checkpoints the WAL every `interval` seconds.
+    PASSIVE checkpoints never block writers; once the -wal file grows past
+    `truncate_bytes` a TRUNCATE checkpoint shrinks it back to zero.
+    """
+
+    def __init__(self, pool, interval, truncate_bytes=0):
+        self.pool = pool
+        self.interval = float(interval)
+        self.truncate_bytes = int(truncate_bytes or 0)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.pool.db_path + "-wal")
+        except OSError:
+            return 0
+
+    def checkpoint(self):
+        mode = "PASSIVE"
+        if self.truncate_bytes and self.wal_size() > self.truncate_bytes:
+            mode = "TRUNCATE"
+        conn = self.pool.acquire()
+        try:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ WAL checkpoint ({mode}) failed: {e}")
+            return None
+        finally:
+            conn.close()
 
-            "ALTER TABLE profiles ADD COLUMN show_email INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN show_region INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN community_visible INTEGER DEFAULT 1",
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.checkpoint()
+
+
+class UnreadCounts:
+    """
+    receiver_id -> {sender_id: unread DMs}, kept in memory. A receiver's map
+    is loaded from conversations the first time it is asked for (so after a
+    restart it just fills up again) and then kept current by save_message
+    and the read-marking methods, which update it under `lock` together with
+    their commit - a load can never count a message twice or miss one.
+    Every process has its own map, so with several workers set UNREAD_CACHE=0.
+    """
+
+    def __init__(self, enabled=UNREAD_CACHE):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._counts = {}
+
+    def get(self, receiver_id, load):
+        with self.lock:
+            counts = self._counts.get(receiver_id) if self.enabled else None
+            if counts is None:
+                counts = load(receiver_id)
+                if self.enabled:
+                    self._counts[receiver_id] = counts
+            return dict(counts)
+
+    # bump / reset: call with `lock` held
+    def bump(self, receiver_id, sender_id):
+        counts = self._counts.get(receiver_id)
+        if counts is not None:
+            counts[sender_id] = counts.get(sender_id, 0) + 1
+
+    def reset(self, receiver_id, sender_id):
+        counts = self._counts.get(receiver_id)
+        if counts is not None:
+            counts.pop(sender_id, None)
+
+    def set(self, receiver_id, sender_id, n):
+        counts = self._counts.get(receiver_id)
+        if counts is not None:
+            if n:
+                counts[sender_id] = n
+            else:
+                counts.pop(sender_id, None)
+
+    def clear(self):
+        with self.lock:
+            self._counts.clear()
+
+
+class CommunitySnapshot:
+    """Everything /community shows about a region (not about the viewer)."""
+
+    def __init__(self, region, week_start, youth_members, senior_members, total_members,
+                 notices, trees_harvested, flowers_harvested, community_points, weekly,
+                 notices_upto=0):
+        self.region = region
+        self.week_start = week_start
+        self.youth_members = youth_members
+        self.senior_members = senior_members
+        self.total_members = total_members
+        self.notices = notices
+        self.trees_harvested = trees_harvested
+        self.flowers_harvested = flowers_harvested
+        self.community_points = community_points
+        self.weekly = weekly
+        self.notices_upto = notices_upto  # highest notices.id when it was loaded
+
+    @property
+    def latest_notice(self):
+        return self.notices[0] if self.notices else None
+
+    @property
+    def last_notice_update(self):
+        if not self.notices or not self.notices[0].get("timestamp"):
+            return None
+        return datetime.strptime(self.notices[0]["timestamp"], "%Y-%m-%d %H:%M:%S")
+
+
+class CommunitySnapshotCache:
+    """
+    region -> CommunitySnapshot, kept `ttl` seconds. Notices (when
+    NoticeWriter writes them), add_tree_stat, save_weekly_achievements and
+    member moves (signup, region/role change, deleted account - the routes
+    invalidate both regions after commit) drop it, so those show up straight
+    away. Each process has its own cache - with several workers, writes from
+    another worker show up within `ttl`.
+    """
+
+    def __init__(self, ttl=COMMUNITY_CACHE_SECONDS):
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = {}  # region -> (loaded_at, generation, snapshot)
+        self._generation = 0
+
+    def get(self, region, week_start, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(region)
+            generation = self._generation
+        if entry and now - entry[0] < self.ttl and entry[2].week_start == week_start:
+            return entry[2]
+        snapshot = load(region, week_start)
+        with self._lock:
+            # don't keep a snapshot loaded before an invalidation
+            if self.ttl > 0 and generation == self._generation:
+                self._entries[region] = (now, generation, snapshot)
+        return snapshot
+
+    def invalidate(self, region=None):
+        """Drop one region, or every region when region is None."""
+        with self._lock:
+            self._generation += 1
+            if region is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(region, None)
+
+
+class ReceiptWriter:
+    """
+    Buffers DM delivered/read receipts and writes them in one transaction
+    (executemany) after `delay` seconds, as soon as `max_pending` pile up,
+    or at exit - instead of a connection + commit per receipt. Repeats are
+    coalesced: one delivered per message, one read per (sender, receiver)
+    with the highest message id. The socket events don't wait for this.
+
+    A read covers only messages up to the id the reader saw, so a message
+    that arrives while the receipt sits in the buffer stays unread.
+    """
+
+    def __init__(self, helper, delay=RECEIPT_FLUSH_MS / 1000.0, max_pending=RECEIPT_MAX_PENDING):
+        self.helper = helper
+        self.delay = float(delay)
+        self.max_pending = max(1, int(max_pending))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._delivered = {}  # msg_id -> ts
+        self._read = {}       # (sender_id, receiver_id) -> (upto_id, ts)
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def pending(self):
+        with self._lock:
+            return len(self._delivered) + len(self._read)
+
+    def delivered(self, msg_id, ts=None):
+        with self._lock:
+            self._delivered.setdefault(int(msg_id), ts or datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self._queued()
+
+    def read(self, sender_id, receiver_id, upto_id, ts=None):
+        """receiver_id has seen sender_id's messages up to id upto_id."""
+        key = (int(sender_id), int(receiver_id))
+        ts = ts or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            prev = self._read.get(key)
+            self._read[key] = (max(int(upto_id), prev[0] if prev else 0), ts)
+        # badge goes to 0 now; the flush writes the exact count back
+        with self.helper.unread.lock:
+            self.helper.unread.reset(key[1], key[0])
+        self._queued()
+
+    def _queued(self):
+        if self.delay <= 0:
+            self.flush()
+            return
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="receipt-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # let more receipts pile up, unless the buffer is already full
+            deadline = time.monotonic() + self.delay
+            while self.pending() < self.max_pending and time.monotonic() < deadline:
+                time.sleep(min(0.005, self.delay))
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far. Returns how many receipts were written."""
+        with self._flush_lock:
+            with self._lock:
+                delivered, self._delivered = self._delivered, {}
+                read, self._read = self._read, {}
+            if not delivered and not read:
+                return 0
+            try:
+                self._write(delivered, read)
+            except Exception as e:
+                print(f"⚠️ receipt flush failed, will retry: {e}")
+                with self._lock:
+                    for msg_id, ts in delivered.items():
+                        self._delivered.setdefault(msg_id, ts)
+                    for key, (upto, ts) in read.items():
+                        prev = self._read.get(key)
+                        self._read[key] = (max(upto, prev[0] if prev else 0), ts)
+                self._wake.set()
+                return 0
+            return len(delivered) + len(read)
+
+    def _write(self, delivered, read):
+        conn = self.helper.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if delivered:
+                conn.executemany(
+                    "UPDATE messages SET delivered_at = COALESCE(delivered_at, ?) WHERE id = ?",
+                    [(ts, msg_id) for msg_id, ts in delivered.items()]
+                )
+            fresh = []
+            if read:
+                params = [
+                    {"s": s, "r": r, "upto": upto, "ts": ts}
+                    for (s, r), (upto, ts) in read.items()
+                ]
+                conn.executemany("""
+                    UPDATE messages
+                    SET read_at = COALESCE(read_at, :ts),
+                        delivered_at = COALESCE(delivered_at, :ts)
+                    WHERE sender_id = :s AND receiver_id = :r AND read_at IS NULL AND id <= :upto
+                """, params)
+                conn.executemany("""
+                    UPDATE conversations
+                    SET unread_lo = CASE WHEN user_lo = :r THEN (
+                            SELECT COUNT(*) FROM messages
+                            WHERE sender_id = :s AND receiver_id = :r AND read_at IS NULL
+                            AND region_name IS NULL AND sender_id <> receiver_id
+                        ) ELSE unread_lo END,
+                        unread_hi = CASE WHEN user_hi = :r THEN (
+                            SELECT COUNT(*) FROM messages
+                            WHERE sender_id = :s AND receiver_id = :r AND read_at IS NULL
+                            AND region_name IS NULL AND sender_id <> receiver_id
+                        ) ELSE unread_hi END,
+                        read_upto_lo = CASE WHEN user_lo = :r THEN MAX(read_upto_lo, :upto) ELSE read_upto_lo END,
+                        read_upto_hi = CASE WHEN user_hi = :r THEN MAX(read_upto_hi, :upto) ELSE read_upto_hi END
+                    WHERE user_lo = MIN(:s, :r) AND user_hi = MAX(:s, :r)
+                """, params)
+                # we hold the write lock, so nobody can send in between this and the commit
+                for s, r in read:
+                    row = conn.execute("""
+                        SELECT CASE WHEN user_lo = ? THEN unread_lo ELSE unread_hi END AS n
+                        FROM conversations WHERE user_lo = MIN(?, ?) AND user_hi = MAX(?, ?)
+                    """, (r, s, r, s, r)).fetchone()
+                    fresh.append((r, s, row["n"] if row else 0))
+            with self.helper.unread.lock:
+                conn.commit()
+                for r, s, n in fresh:
+                    self.helper.unread.set(r, s, n)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
-            "ALTER TABLE profiles ADD COLUMN notify_messages INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN notify_updates INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN notify_events INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN notify_comm INTEGER DEFAULT 1",
-            "ALTER TABLE profiles ADD COLUMN notify_inapp INTEGER DEFAULT 1",
-        ]
 
-        for stmt in profile_alters:
+class NoticeWriter:
+    """
+    Buffers notice board posts (add_notice) and inserts them with one
+    executemany + commit after `delay` seconds, as soon as `max_pending`
+    pile up, or at exit. Each notice keeps the time it was posted.
+
+    The notice readers call flush() first when something is buffered, so
+    whoever posted a notice sees it on their next page load in this process.
+    For other workers the app flushes at the end of any request that added
+    a notice and keeps `last_id` in the session; /community reloads a
+    cached snapshot older than that (see get_community_snapshot). Notices
+    posted outside a request (socket handlers) are only covered in the
+    process that posted them.
+    """
+
+    def __init__(self, helper, delay=NOTICE_FLUSH_MS / 1000.0, max_pending=NOTICE_MAX_PENDING):
+        self.helper = helper
+        self.delay = float(delay)
+        self.max_pending = max(1, int(max_pending))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []  # (username, message, region, emoji, timestamp)
+        self.added = 0      # notices ever queued in this process
+        self.last_id = 0    # highest notices.id this process has written
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, username, region, message, emoji):
+        # same format/clock as CURRENT_TIMESTAMP (UTC)
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._lock:
+            self._pending.append((username, message, region, emoji, ts))
+            self.added += 1
+            full = len(self._pending) >= self.max_pending
+        if self.delay <= 0 or full:
+            self.flush()
+            return
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="notice-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        """Insert everything buffered so far. Returns how many notices were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
             try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass  # column already exists
+                conn = self.helper.get_connection()
+                try:
+                    conn.executemany("""
+                        INSERT INTO notices (username, message, region, emoji, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, batch)
+                    last_id = conn.execute("SELECT MAX(id) FROM notices").fetchone()[0]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"⚠️ notice flush failed, will retry: {e}")
+                with self._lock:
+                    self._pending[:0] = batch
+                self._wake.set()
+                return 0
+            self.last_id = max(self.last_id, last_id or 0)
+        for region in {n[2] for n in batch}:
+            self.helper.community.invalidate(region)
+        return len(batch)
+
+
+# =========================
+# SCHEMA MIGRATIONS
+# =========================
+# Each step runs once, in order, inside its own transaction and is recorded
+# in schema_version. To change the schema append a new (version, name, fn)
+# to MIGRATIONS - never edit a step that has already shipped.
+
+def _table_columns(cursor, table):
+    return {r[1] for r in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_column(cursor, table, column, decl):
+    """ALTER TABLE ... ADD COLUMN, only when the column is missing."""
+    if column not in _table_columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migration_001_baseline(cursor):
+    """Every table the app had before versioned migrations."""
+    # 1. CORE USER TABLES
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT,
+            points INTEGER DEFAULT 0
+        )
+    """)
 
+    # 2B. STORY DRAFTS
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_drafts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT,
+            content TEXT,
+            topic TEXT,
+            image_path TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT,
+            region TEXT,
+            email TEXT,
+            bio TEXT,
+            profile_pic TEXT,
+            show_email INTEGER DEFAULT 1,
+            show_region INTEGER DEFAULT 1,
+            community_visible INTEGER DEFAULT 1,
+            notify_messages INTEGER DEFAULT 1,
+            notify_updates INTEGER DEFAULT 1,
+            notify_events INTEGER DEFAULT 1,
+            notify_comm INTEGER DEFAULT 1,
+            notify_inapp INTEGER DEFAULT 1,
+            guidelines_accepted INTEGER DEFAULT 0,
+            guidelines_accepted_at TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
 
-        # 2. STORIES
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT,
-                content TEXT,
-                topic TEXT,
-                role_visibility TEXT,
-                image_path TEXT,
-                status TEXT DEFAULT 'approved',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        try:
-            cursor.execute("ALTER TABLE stories ADD COLUMN topic TEXT")
-        except sqlite3.OperationalError:
-            pass
-        # Likes & Comments
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS story_likes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                story_id INTEGER,
-                user_id INTEGER,
-                FOREIGN KEY(story_id) REFERENCES stories(id),
-                FOREIGN KEY(user_id) REFERENCES users(id),
-                UNIQUE(story_id, user_id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS story_comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                story_id INTEGER,
-                user_id INTEGER,
-                content TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(story_id) REFERENCES stories(id),
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        conn.execute("""
-CREATE TABLE IF NOT EXISTS inventory_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    kind TEXT NOT NULL,              -- 'seed_tree' | 'seed_flower' | 'water' | 'points'
-    delta INTEGER NOT NULL,          -- +10, -5, etc
-    source TEXT NOT NULL,            -- 'Watered plant', 'Harvested tree', 'Streak reward', etc
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY(user_id) REFERENCES users(id)
-)
-""")
-        
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS comment_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                comment_id INTEGER NOT NULL,
-                reporter_user_id INTEGER NOT NULL,
-                reason TEXT NOT NULL,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        # --- SAFE ALTER: add missing columns for stories ---
-        story_alters = [
-            "ALTER TABLE stories ADD COLUMN image_path TEXT",
-            "ALTER TABLE stories ADD COLUMN role_visibility TEXT",
-            "ALTER TABLE stories ADD COLUMN topic TEXT",
-            "ALTER TABLE stories ADD COLUMN status TEXT DEFAULT 'approved'",
-            "ALTER TABLE stories ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP"
-        ]
-
-        for stmt in story_alters:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
-        
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                story_id INTEGER,
-                user_id INTEGER,
-                reason TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(story_id) REFERENCES stories(id),
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-        
-    
-        # 3. GARDEN
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                user_id INTEGER PRIMARY KEY,
-                seed_tree INTEGER DEFAULT 3,
-                seed_flower INTEGER DEFAULT 3,
-                water INTEGER DEFAULT 10,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS plots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                plot_number INTEGER NOT NULL,
-                plant_type TEXT,
-                growth_stage INTEGER DEFAULT 0,
-                last_watered_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS rewards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                cost INTEGER NOT NULL,
-                image_filename TEXT NOT NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_rewards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                reward_id INTEGER,
-                redeemed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                used_at TIMESTAMP,
-                qr_code_filename TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (reward_id) REFERENCES rewards(id)
-            )
-        """)
+    # 2. STORIES
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT,
+            content TEXT,
+            topic TEXT,
+            role_visibility TEXT,
+            image_path TEXT,
+            status TEXT DEFAULT 'approved',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    # Likes & Comments
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_likes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            story_id INTEGER,
+            user_id INTEGER,
+            FOREIGN KEY(story_id) REFERENCES stories(id),
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            UNIQUE(story_id, user_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS story_comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            story_id INTEGER,
+            user_id INTEGER,
+            content TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(story_id) REFERENCES stories(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,              -- 'seed_tree' | 'seed_flower' | 'water' | 'points'
+            delta INTEGER NOT NULL,          -- +10, -5, etc
+            source TEXT NOT NULL,            -- 'Watered plant', 'Harvested tree', 'Streak reward', etc
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS comment_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            comment_id INTEGER NOT NULL,
+            reporter_user_id INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            story_id INTEGER,
+            user_id INTEGER,
+            reason TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(story_id) REFERENCES stories(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
 
-        conn.execute("""
+    # 3. GARDEN
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_inventory (
+            user_id INTEGER PRIMARY KEY,
+            seed_tree INTEGER DEFAULT 3,
+            seed_flower INTEGER DEFAULT 3,
+            water INTEGER DEFAULT 10,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS plots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            plot_number INTEGER NOT NULL,
+            plant_type TEXT,
+            growth_stage INTEGER DEFAULT 0,
+            last_watered_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            cost INTEGER NOT NULL,
+            image_filename TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_rewards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            reward_id INTEGER,
+            redeemed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            used_at TIMESTAMP,
+            qr_code_filename TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (reward_id) REFERENCES rewards(id)
+        )
+    """)
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS garden_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        category TEXT NOT NULL,      -- flower / tree / water / points
-        title TEXT NOT NULL,         -- human readable message
-        amount INTEGER DEFAULT 0,    -- + / - change (optional)
-        created_at TEXT DEFAULT (datetime('now','localtime')),
-        FOREIGN KEY(user_id) REFERENCES users(id)
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,      -- flower / tree / water / points
+            title TEXT NOT NULL,         -- human readable message
+            amount INTEGER DEFAULT 0,    -- + / - change (optional)
+            created_at TEXT DEFAULT (datetime('now','localtime')),
+            FOREIGN KEY(user_id) REFERENCES users(id)
         )
-        """)
-
-        conn.execute("""
+    """)
+    cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_garden_history_user_time
         ON garden_history(user_id, created_at)
-        """)
-
-        # Default Rewards
-        if cursor.execute("SELECT count(*) FROM rewards").fetchone()[0] == 0:
-            cursor.execute("INSERT INTO rewards (name, cost, image_filename) VALUES ('FairPrice $5 Voucher', 20, 'rewards_fairprice.jpg')")
-            cursor.execute("INSERT INTO rewards (name, cost, image_filename) VALUES ('Shopee $5 Voucher', 25, 'rewards_shopee.jpg')")
-            cursor.execute("INSERT INTO rewards (name, cost, image_filename) VALUES ('PopMart SG $5 Voucher', 30, 'rewards_popmart.jpg')")
-
-        # 4. MESSAGING & COMMUNITY CHAT (Zhi Ni & Felicia's Modules) 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER,
-                receiver_id INTEGER,
-                region_name TEXT, 
-                message_text TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(sender_id) REFERENCES users(id)
-            )
-        """)
-
-
-        # 5. NOTICES & EVENTS (Felicia & Yi Qian's Modules)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS notices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                message TEXT,
-                region TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        # --- SAFE ALTER: add emoji column to notices ---
-        try:
-            cursor.execute("ALTER TABLE notices ADD COLUMN emoji TEXT")
-        except sqlite3.OperationalError:
-            pass
-
-        # --- SAFE ALTER: community guidelines acceptance (profiles) ---
-        for stmt in [
-            "ALTER TABLE profiles ADD COLUMN guidelines_accepted INTEGER DEFAULT 0",
-            "ALTER TABLE profiles ADD COLUMN guidelines_accepted_at TEXT"
-        ]:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
-            
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS weekly_achievements (
-                week_start TEXT PRIMARY KEY,
-                most_active_region TEXT,
-                participation_region TEXT,
-                best_harvest_region TEXT,
-                generated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        for stmt in [
-            "ALTER TABLE weekly_achievements ADD COLUMN best_harvest_region TEXT",
-        ]:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
-
+    """)
 
+    # 4. MESSAGING & COMMUNITY CHAT (Zhi Ni & Felicia's Modules)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            receiver_id INTEGER,
+            region_name TEXT,
+            message_text TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            message_type TEXT DEFAULT 'text',
+            media_path TEXT,
+            audio_path TEXT,
+            file_name TEXT,
+            delivered_at TEXT,
+            read_at TEXT,
+            FOREIGN KEY(sender_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dm_streak_state (
+            room TEXT PRIMARY KEY,
+            streak INTEGER NOT NULL DEFAULT 0,
+            last_day TEXT NOT NULL DEFAULT ''
+        )
+    """)
 
-        cursor.execute("""
+    # 5. NOTICES & EVENTS (Felicia & Yi Qian's Modules)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            message TEXT,
+            region TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            emoji TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_achievements (
+            week_start TEXT PRIMARY KEY,
+            most_active_region TEXT,
+            participation_region TEXT,
+            best_harvest_region TEXT,
+            generated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS community_tree_stats (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
@@ -333,108 +901,881 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY(user_id) REFERENCES users(id)
         )
-        """)
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            short_description TEXT,
+            full_description TEXT,
+            registration_start TEXT,
+            registration_end TEXT,
+            event_date TEXT,
+            event_time TEXT,
+            venue TEXT,
+            image_filename TEXT,
+            status TEXT DEFAULT 'approved',
+            report_reason TEXT,
+            created_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(created_by) REFERENCES users(id)
+        )
+    """)
 
-        # -- Added yq -- 
+    # 6. EVENTS / GAMES (Yi Qian)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_streaks (
+            user_id INTEGER PRIMARY KEY,
+            daily_game_streak INTEGER DEFAULT 0,
+            winning_streak INTEGER DEFAULT 0,
+            last_play_date TEXT,
+            seed_claimed INTEGER DEFAULT 0,
+            week_start_date TEXT,
+            last_reset_date TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    # Game History Table (tracks who played with whom)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS game_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player1_id INTEGER NOT NULL,
+            player2_id INTEGER NOT NULL,
+            game_type TEXT NOT NULL,
+            winner_id INTEGER,
+            played_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(player1_id) REFERENCES users(id),
+            FOREIGN KEY(player2_id) REFERENCES users(id),
+            FOREIGN KEY(winner_id) REFERENCES users(id)
+        )
+    """)
+
+    # Databases created before this engine may miss columns that used to be
+    # added by the old try/except ALTER loops.
+    for table, column, decl in [
+        ("users", "points", "INTEGER DEFAULT 0"),
+        ("story_drafts", "image_path", "TEXT"),
+        ("story_drafts", "updated_at", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+        ("story_drafts", "created_at", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+        ("profiles", "profile_pic", "TEXT"),
+        ("profiles", "show_email", "INTEGER DEFAULT 1"),
+        ("profiles", "show_region", "INTEGER DEFAULT 1"),
+        ("profiles", "community_visible", "INTEGER DEFAULT 1"),
+        ("profiles", "notify_messages", "INTEGER DEFAULT 1"),
+        ("profiles", "notify_updates", "INTEGER DEFAULT 1"),
+        ("profiles", "notify_events", "INTEGER DEFAULT 1"),
+        ("profiles", "notify_comm", "INTEGER DEFAULT 1"),
+        ("profiles", "notify_inapp", "INTEGER DEFAULT 1"),
+        ("profiles", "guidelines_accepted", "INTEGER DEFAULT 0"),
+        ("profiles", "guidelines_accepted_at", "TEXT"),
+        ("stories", "topic", "TEXT"),
+        ("stories", "image_path", "TEXT"),
+        ("stories", "role_visibility", "TEXT"),
+        ("stories", "status", "TEXT DEFAULT 'approved'"),
+        ("stories", "created_at", "DATETIME DEFAULT CURRENT_TIMESTAMP"),
+        ("messages", "message_type", "TEXT DEFAULT 'text'"),
+        ("messages", "media_path", "TEXT"),
+        ("messages", "audio_path", "TEXT"),
+        ("messages", "file_name", "TEXT"),
+        ("messages", "delivered_at", "TEXT"),
+        ("messages", "read_at", "TEXT"),
+        ("notices", "emoji", "TEXT"),
+        ("weekly_achievements", "best_harvest_region", "TEXT"),
+        ("user_streaks", "week_start_date", "TEXT"),
+        ("user_streaks", "last_reset_date", "TEXT"),
+    ]:
+        _add_column(cursor, table, column, decl)
+
+
+def _migration_002_seed_data(cursor):
+    """Default rewards + the winx_admin account."""
+    if cursor.execute("SELECT count(*) FROM rewards").fetchone()[0] == 0:
+        cursor.executemany(
+            "INSERT INTO rewards (name, cost, image_filename) VALUES (?, ?, ?)",
+            [
+                ("FairPrice $5 Voucher", 20, "rewards_fairprice.jpg"),
+                ("Shopee $5 Voucher", 25, "rewards_shopee.jpg"),
+                ("PopMart SG $5 Voucher", 30, "rewards_popmart.jpg"),
+            ],
+        )
+
+    admin = cursor.execute("SELECT id FROM users WHERE username = ?", ("winx_admin",)).fetchone()
+    if not admin:
         cursor.execute("""
-    CREATE TABLE IF NOT EXISTS events (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        short_description TEXT,
-        full_description TEXT,
-        registration_start TEXT,
-        registration_end TEXT,
-        event_date TEXT,
-        event_time TEXT,
-        venue TEXT,
-        image_filename TEXT,
-        status TEXT DEFAULT 'approved',
-        report_reason TEXT,
-        created_by INTEGER,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(created_by) REFERENCES users(id)
-    )
+            INSERT INTO users (username, password, role)
+            VALUES (?, ?, ?)
+        """, ("winx_admin", generate_password_hash("Password123"), "admin"))
+        print("✅ winx_admin admin created.")
+    else:
+        # Force role to admin if already exists
+        cursor.execute("UPDATE users SET role = 'Admin' WHERE username = ?", ("winx_admin",))
+
+
+def _migration_003_hot_path_indexes(cursor):
+    """Secondary indexes for the queries that run on every page view."""
+    for stmt in [
+        # DMs: unread / read-marking / chat history by pair
+        "CREATE INDEX IF NOT EXISTS idx_messages_pair_read ON messages(sender_id, receiver_id, read_at)",
+        # region chat + weekly community message counts
+        "CREATE INDEX IF NOT EXISTS idx_messages_region_time ON messages(region_name, receiver_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_time ON messages(receiver_id, timestamp)",
+        # likes / comments per story, "did I like it" per user
+        "CREATE INDEX IF NOT EXISTS idx_story_likes_story_user ON story_likes(story_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_story_likes_user ON story_likes(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_story_comments_story_user ON story_comments(story_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_story_comments_created ON story_comments(created_at)",
+        # feed, manage page, admin queue
+        "CREATE INDEX IF NOT EXISTS idx_stories_status_created ON stories(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stories_user_created ON stories(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_story_drafts_user_updated ON story_drafts(user_id, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reports_story ON reports(story_id)",
+        "CREATE INDEX IF NOT EXISTS idx_comment_reports_comment ON comment_reports(comment_id)",
+        # profiles are looked up by user, region (member counts) and email
+        "CREATE INDEX IF NOT EXISTS idx_profiles_user ON profiles(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_profiles_region ON profiles(region)",
+        "CREATE INDEX IF NOT EXISTS idx_profiles_email ON profiles(email)",
+        # community dashboard
+        "CREATE INDEX IF NOT EXISTS idx_notices_region_time ON notices(region, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_notices_time ON notices(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_tree_stats_region_time ON community_tree_stats(region, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tree_stats_time ON community_tree_stats(created_at)",
+        # games
+        "CREATE INDEX IF NOT EXISTS idx_game_history_p1_time ON game_history(player1_id, played_at)",
+        "CREATE INDEX IF NOT EXISTS idx_game_history_p2_time ON game_history(player2_id, played_at)",
+        "CREATE INDEX IF NOT EXISTS idx_game_history_time ON game_history(played_at)",
+        # garden
+        "CREATE INDEX IF NOT EXISTS idx_plots_user_number ON plots(user_id, plot_number)",
+        "CREATE INDEX IF NOT EXISTS idx_user_rewards_user ON user_rewards(user_id)",
+    ]:
+        cursor.execute(stmt)
+
+
+def _migration_004_feed_keyset_index(cursor):
+    """Feed pages walk approved stories by id (keyset pagination)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stories_status_id ON stories(status, id)")
+
+
+def rebuild_story_counters(cursor):
+    """
+    Recount stories.like_count / comment_count from story_likes and
+    story_comments (approved comments only, once comments are moderated).
+    Only rows that drifted are rewritten; returns how many.
+    """
+    comments = "SELECT COUNT(*) FROM story_comments WHERE story_id = stories.id"
+    if "status" in _table_columns(cursor, "story_comments"):
+        comments += " AND status = 'approved'"
+    return cursor.execute(f"""
+        UPDATE stories
+        SET like_count = (SELECT COUNT(*) FROM story_likes WHERE story_id = stories.id),
+            comment_count = ({comments})
+        WHERE like_count != (SELECT COUNT(*) FROM story_likes WHERE story_id = stories.id)
+           OR comment_count != ({comments})
+    """).rowcount
+
+
+def _migration_005_story_counters(cursor):
+    """Denormalized like/comment counts on stories, backfilled from the source tables."""
+    _add_column(cursor, "stories", "like_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "stories", "comment_count", "INTEGER NOT NULL DEFAULT 0")
+    rebuild_story_counters(cursor)
+
+
+def _migration_006_unique_story_likes(cursor):
+    """One like per (story, user): drop duplicate rows, then enforce it."""
+    cursor.execute("""
+        DELETE FROM story_likes
+        WHERE id NOT IN (SELECT MIN(id) FROM story_likes GROUP BY story_id, user_id)
     """)
+    # the unique index replaces the plain one from migration 003
+    cursor.execute("DROP INDEX IF EXISTS idx_story_likes_story_user")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_story_likes_story_user ON story_likes(story_id, user_id)")
+    rebuild_story_counters(cursor)
 
 
-        # 6. JUST ADDED EVENT YI QIAN 
+def _migration_007_comment_status(cursor):
+    """Comments are stored 'pending' until the moderation queue approves them."""
+    _add_column(cursor, "story_comments", "status", "TEXT NOT NULL DEFAULT 'approved'")
+
+
+def _migration_008_moderation_cache(cursor):
+    """Second tier of the moderation verdict cache (keyed by content hash)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS moderation_cache (
+            key TEXT PRIMARY KEY,
+            verdict TEXT,
+            expires_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_moderation_cache_expires ON moderation_cache(expires_at)")
+
+
+def _migration_009_upload_blobs(cursor):
+    """Content-addressed uploads (see uploads.py); variants is a JSON {name: path}."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS upload_blobs (
+            sha256 TEXT PRIMARY KEY,
+            rel_path TEXT NOT NULL,
+            ext TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            variants TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _migration_010_dm_history_index(cursor):
+    """DM history pages walk one direction of a pair by id (keyset pagination)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_pair_id ON messages(sender_id, receiver_id, id)")
+
+
+# sidebar preview of a messages row (used in SQL so the backfill and the
+# per-message upsert build it the same way)
+_DM_PREVIEW_SQL = """
+    CASE message_type
+        WHEN 'image' THEN '📷 Photo'
+        WHEN 'audio' THEN '🎤 Voice message'
+        ELSE substr(COALESCE(message_text, ''), 1, 80)
+    END
+"""
+
+
+def rebuild_conversations(cursor):
+    """
+    Rebuild the conversations table (one row per DM pair, user_lo < user_hi
+    or both equal for a chat with yourself) from messages. unread_lo is what
+    user_lo hasn't read yet, unread_hi likewise; read_upto_lo is the newest
+    message id user_lo has read (once that column exists). Returns how many pairs.
+    """
+    cols, exprs = "", ""
+    if "read_upto_lo" in _table_columns(cursor, "conversations"):
+        cols, exprs = ", read_upto_lo, read_upto_hi", ", g.read_upto_lo, g.read_upto_hi"
+    cursor.execute("DELETE FROM conversations")
+    return cursor.execute(f"""
+        INSERT INTO conversations (
+            user_lo, user_hi, last_message_id, last_sender_id, last_at, last_preview, unread_lo, unread_hi{cols}
+        )
+        SELECT g.lo, g.hi, m.id, m.sender_id, m.timestamp, {_DM_PREVIEW_SQL}, g.unread_lo, g.unread_hi{exprs}
+        FROM (
+            SELECT MIN(sender_id, receiver_id) AS lo, MAX(sender_id, receiver_id) AS hi,
+                   MAX(id) AS last_id,
+                   SUM(read_at IS NULL AND receiver_id < sender_id) AS unread_lo,
+                   SUM(read_at IS NULL AND receiver_id > sender_id) AS unread_hi,
+                   COALESCE(MAX(CASE WHEN read_at IS NOT NULL AND receiver_id < sender_id THEN id END), 0)
+                       AS read_upto_lo,
+                   COALESCE(MAX(CASE WHEN read_at IS NOT NULL AND receiver_id > sender_id THEN id END), 0)
+                       AS read_upto_hi
+            FROM messages
+            WHERE region_name IS NULL AND receiver_id IS NOT NULL
+            GROUP BY lo, hi
+        ) g
+        JOIN messages m ON m.id = g.last_id
+    """).rowcount
+
+
+def _migration_011_conversations(cursor):
+    """Per-pair DM summary for the messaging sidebar, backfilled from messages."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_lo INTEGER NOT NULL,
+            user_hi INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_sender_id INTEGER,
+            last_at TEXT,
+            last_preview TEXT,
+            unread_lo INTEGER NOT NULL DEFAULT 0,
+            unread_hi INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_lo, user_hi)
+        )
+    """)
+    # sidebar lists people of the other role; roles are stored in mixed case
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_role_norm ON users(LOWER(TRIM(role)))")
+    rebuild_conversations(cursor)
+
+
+def _migration_012_conversations_user_hi(cursor):
+    """Unread badges look a user up on either side of the pair."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_hi ON conversations(user_hi, user_lo)")
+
+
+def _migration_013_read_watermarks(cursor):
+    """'Read up to message id N' per side of a conversation, backfilled from messages.read_at."""
+    _add_column(cursor, "conversations", "read_upto_lo", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "conversations", "read_upto_hi", "INTEGER NOT NULL DEFAULT 0")
+    rebuild_conversations(cursor)
+
+
+def _migration_014_presence(cursor):
+    """Socket sessions per worker for presence.SQLitePresenceBackend."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS presence_workers (
+            worker TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS presence_sessions (
+            worker TEXT NOT NULL,
+            sid TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            connected_at REAL,
+            PRIMARY KEY (worker, sid)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_presence_sessions_user ON presence_sessions(user_id, worker)")
+
+
+# ---- weekly region activity rollups ----
+# Every activity (approved story, approved comment, game played - once per
+# player, garden action, community chat message) adds 1 to the row of the
+# region the user was in when it happened, for the week (Monday,
+# 'YYYY-MM-DD') of the activity's own timestamp. That region is stored on
+# the activity row (stories/story_comments.activity_region,
+# game_history.player1/2_region, community_tree_stats.region,
+# messages.region_name), so moving region later doesn't move old activity.
+# Stories and comments count while they are approved (activity_counted):
+# un-approving or deleting one takes it back out. region_week_users counts
+# actions per user, so unique_users goes down when someone's last activity
+# in a week is taken back. The weekly awards read region_week_activity
+# only: one row per region.
+_WEEK_OF_SQL = "date({}, '-6 days', 'weekday 1')"
+HARVEST_ACTIONS = ("harvest_tree", "harvest_flower")
+
+
+def record_region_activity(cursor, user_id, region, ts=None, harvest=False, delta=1):
+    """
+    Add (delta=1) or take back (delta=-1) one activity in the weekly
+    rollups. When adding, region=None uses the user's profile region;
+    ts=None means now. Returns the region it was counted in, None if it
+    wasn't (activities without a region are not counted).
+    """
+    if user_id is None:
+        return None
+    if region is None and delta > 0:
+        row = cursor.execute("SELECT region FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        region = row[0] if row else None
+    if not region:
+        return None
+    week = cursor.execute(
+        f"SELECT {_WEEK_OF_SQL.format('COALESCE(?, CURRENT_TIMESTAMP)')}", (ts,)
+    ).fetchone()[0]
+    if not week:
+        return None
+    if delta > 0:
+        actions = cursor.execute("""
+            INSERT INTO region_week_users (week_start, region, user_id, actions) VALUES (?, ?, ?, 1)
+            ON CONFLICT(week_start, region, user_id) DO UPDATE SET actions = actions + 1
+            RETURNING actions
+        """, (week, region, user_id)).fetchone()[0]
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_streaks (
-                user_id INTEGER PRIMARY KEY,
-                daily_game_streak INTEGER DEFAULT 0,
-                winning_streak INTEGER DEFAULT 0,
-                last_play_date TEXT,
-                seed_claimed INTEGER DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
+            INSERT INTO region_week_activity (week_start, region, actions, unique_users, harvests)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(week_start, region) DO UPDATE SET
+                actions = actions + 1,
+                unique_users = unique_users + excluded.unique_users,
+                harvests = harvests + excluded.harvests
+        """, (week, region, 1 if actions == 1 else 0, 1 if harvest else 0))
+        return region
+
+    row = cursor.execute("""
+        UPDATE region_week_users SET actions = actions - 1
+        WHERE week_start = ? AND region = ? AND user_id = ?
+        RETURNING actions
+    """, (week, region, user_id)).fetchone()
+    if row is None:
+        return None
+    gone = row[0] <= 0
+    if gone:
+        cursor.execute(
+            "DELETE FROM region_week_users WHERE week_start = ? AND region = ? AND user_id = ?",
+            (week, region, user_id)
+        )
+    cursor.execute("""
+        UPDATE region_week_activity SET
+            actions = MAX(actions - 1, 0),
+            unique_users = MAX(unique_users - ?, 0),
+            harvests = MAX(harvests - ?, 0)
+        WHERE week_start = ? AND region = ?
+    """, (1 if gone else 0, 1 if harvest else 0, week, region))
+    return region
+
+
+# tables whose rows count while status = 'approved' (activity_counted/activity_region)
+MODERATED_ACTIVITY_TABLES = ("stories", "story_comments")
+
+
+def uncount_activity(cursor, table, where, params=()):
+    """Take the counted rows of `table` matching `where` back out of the rollups."""
+    rows = cursor.execute(f"""
+        UPDATE {table} SET activity_counted = 0
+        WHERE activity_counted = 1 AND {where}
+        RETURNING user_id, created_at, activity_region
+    """, params).fetchall()
+    for user_id, created_at, region in rows:
+        record_region_activity(cursor, user_id, region, created_at, delta=-1)
+
+
+def sync_activity(cursor, table, row_id):
+    """
+    Count a story/comment in the rollups if it is approved and isn't yet,
+    take it back out if it is counted and no longer approved.
+    """
+    uncount_activity(cursor, table, "id = ? AND status != 'approved'", (row_id,))
+    row = cursor.execute(f"""
+        UPDATE {table} SET activity_counted = 1
+        WHERE id = ? AND status = 'approved' AND activity_counted = 0
+        RETURNING user_id, created_at
+    """, (row_id,)).fetchone()
+    if row:
+        region = record_region_activity(cursor, row[0], None, row[1])
+        cursor.execute(f"UPDATE {table} SET activity_region = ? WHERE id = ?", (region, row_id))
+
+
+def rebuild_region_rollups(cursor):
+    """
+    Recompute both rollup tables from the activity rows and the regions
+    stored on them. Returns (week, region) rows.
+    """
+    harvest = ", ".join(f"'{a}'" for a in HARVEST_ACTIONS)
+    activity = f"""
+        WITH acts(week_start, region, user_id, harvest) AS (
+            SELECT {_WEEK_OF_SQL.format('created_at')}, activity_region, user_id, 0
+            FROM stories WHERE activity_counted = 1
+            UNION ALL
+            SELECT {_WEEK_OF_SQL.format('created_at')}, activity_region, user_id, 0
+            FROM story_comments WHERE activity_counted = 1
+            UNION ALL
+            SELECT {_WEEK_OF_SQL.format('played_at')}, player1_region, player1_id, 0
+            FROM game_history
+            UNION ALL
+            SELECT {_WEEK_OF_SQL.format('played_at')}, player2_region, player2_id, 0
+            FROM game_history
+            UNION ALL
+            SELECT {_WEEK_OF_SQL.format('created_at')}, region, user_id, action IN ({harvest})
+            FROM community_tree_stats
+            UNION ALL
+            SELECT {_WEEK_OF_SQL.format('timestamp')}, region_name, sender_id, 0
+            FROM messages WHERE receiver_id IS NULL
+        )
+    """
+    valid = "WHERE week_start IS NOT NULL AND region IS NOT NULL AND region != '' AND user_id IS NOT NULL"
+    cursor.execute("DELETE FROM region_week_users")
+    cursor.execute("DELETE FROM region_week_activity")
+    cursor.execute(f"""
+        {activity}
+        INSERT INTO region_week_users (week_start, region, user_id, actions)
+        SELECT week_start, region, user_id, COUNT(*) FROM acts {valid}
+        GROUP BY week_start, region, user_id
+    """)
+    return cursor.execute(f"""
+        {activity}
+        INSERT INTO region_week_activity (week_start, region, actions, unique_users, harvests)
+        SELECT week_start, region, COUNT(*), COUNT(DISTINCT user_id), SUM(harvest)
+        FROM acts {valid}
+        GROUP BY week_start, region
+    """).rowcount
+
+
+def _migration_015_region_rollups(cursor):
+    """Per-region, per-week activity counters for the community awards, backfilled."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS region_week_activity (
+            week_start TEXT NOT NULL,
+            region TEXT NOT NULL,
+            actions INTEGER NOT NULL DEFAULT 0,
+            unique_users INTEGER NOT NULL DEFAULT 0,
+            harvests INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (week_start, region)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS region_week_users (
+            week_start TEXT NOT NULL,
+            region TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (week_start, region, user_id)
+        ) WITHOUT ROWID
+    """)
+    # stories count while they are approved (backfilled by 020)
+    _add_column(cursor, "stories", "activity_counted", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _migration_016_weekly_finalized(cursor):
+    """A week's achievements are written one last time after it ends, then left alone."""
+    _add_column(cursor, "weekly_achievements", "finalized", "INTEGER NOT NULL DEFAULT 0")
+
+
+# ---- region_stats: running member counts and tree totals per region ----
+# Same numbers get_region_member_counts / get_region_tree_totals used to
+# aggregate on every /community view. A member is a user with a profile in
+# that region; youth/senior go by LOWER(users.role). Kept up to date by
+# signup, edit_profile, delete_account (move_region_member) and
+# add_tree_stat; `flask rebuild-region-stats` checks them against the raw tables.
+def bump_region_members(cursor, region, role, delta):
+    """Add (delta=1) or remove (delta=-1) one member with `role` in `region`."""
+    if region is None or not delta:
+        return
+    role = (role or "").lower()
+    cursor.execute("""
+        INSERT INTO region_stats (region, youth_members, senior_members, total_members)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(region) DO UPDATE SET
+            youth_members = youth_members + excluded.youth_members,
+            senior_members = senior_members + excluded.senior_members,
+            total_members = total_members + excluded.total_members
+    """, (region, delta * (role == "youth"), delta * (role == "senior"), delta))
+
+
+def bump_region_tree(cursor, region, action, points):
+    if region is None:
+        return
+    cursor.execute("""
+        INSERT INTO region_stats (region, trees, flowers, points)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(region) DO UPDATE SET
+            trees = trees + excluded.trees,
+            flowers = flowers + excluded.flowers,
+            points = points + excluded.points
+    """, (region, int(action == "harvest_tree"), int(action == "harvest_flower"), int(points or 0)))
+
+
+_REGION_STATS_COLUMNS = ("youth_members", "senior_members", "total_members", "trees", "flowers", "points")
+
+
+def rebuild_region_stats(cursor):
+    """
+    Recompute region_stats from users/profiles and community_tree_stats.
+    Returns {region: (old, new)} for every region whose row was wrong.
+    """
+    cols = ", ".join(_REGION_STATS_COLUMNS)
+    old = {r[0]: tuple(r[1:]) for r in cursor.execute(f"SELECT region, {cols} FROM region_stats")}
+    cursor.execute("DELETE FROM region_stats")
+    cursor.execute(f"""
+        INSERT INTO region_stats (region, {cols})
+        SELECT region, SUM(youth), SUM(senior), SUM(total), SUM(trees), SUM(flowers), SUM(points)
+        FROM (
+            SELECT p.region AS region,
+                   LOWER(u.role) = 'youth' AS youth, LOWER(u.role) = 'senior' AS senior, 1 AS total,
+                   0 AS trees, 0 AS flowers, 0 AS points
+            FROM users u JOIN profiles p ON u.id = p.user_id
+            WHERE p.region IS NOT NULL
+            UNION ALL
+            SELECT region, 0, 0, 0,
+                   action = 'harvest_tree', action = 'harvest_flower', COALESCE(points, 0)
+            FROM community_tree_stats
+            WHERE region IS NOT NULL
+        )
+        GROUP BY region
+    """)
+    new = {r[0]: tuple(r[1:]) for r in cursor.execute(f"SELECT region, {cols} FROM region_stats")}
+    zero = (0,) * len(_REGION_STATS_COLUMNS)
+    return {
+        region: (old.get(region, zero), new.get(region, zero))
+        for region in set(old) | set(new)
+        if old.get(region, zero) != new.get(region, zero)
+    }
+
+
+def _migration_017_region_stats(cursor):
+    """Running per-region member counts and tree totals, backfilled."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS region_stats (
+            region TEXT PRIMARY KEY,
+            youth_members INTEGER NOT NULL DEFAULT 0,
+            senior_members INTEGER NOT NULL DEFAULT 0,
+            total_members INTEGER NOT NULL DEFAULT 0,
+            trees INTEGER NOT NULL DEFAULT 0,
+            flowers INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    rebuild_region_stats(cursor)
+
+
+# every column that can hold a stored upload name (uploads.py), with the
+# prefix it is stored under
+UPLOAD_REFERENCES = [
+    ("stories", "image_path", ""),
+    ("story_drafts", "image_path", ""),
+    ("profiles", "profile_pic", ""),
+    ("events", "image_filename", ""),
+    ("messages", "media_path", "uploads/"),
+]
+
+
+def _migration_018_upload_reference_indexes(cursor):
+    """Releasing a blob looks up whether anything still points at it."""
+    for table, column, _prefix in UPLOAD_REFERENCES:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table}({column}) WHERE {column} IS NOT NULL"
+        )
+
+
+def count_upload_references(conn, rel_path):
+    """How many rows point at a stored upload name."""
+    total = 0
+    for table, column, prefix in UPLOAD_REFERENCES:
+        total += conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {column} = ?", (prefix + rel_path,)
+        ).fetchone()[0]
+    return total
+
+
+def _migration_019_feed_popular_index(cursor):
+    """The "most popular" feed sort walks approved stories by like_count, id."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stories_status_likes ON stories(status, like_count, id)")
+
+
+def _migration_020_activity_regions(cursor):
+    """
+    Store the region each activity was counted in, count comments once
+    like stories, and count actions per user so activity can be taken back.
+    Existing rows get the user's current region, then the rollups are rebuilt.
+    """
+    _add_column(cursor, "stories", "activity_region", "TEXT")
+    _add_column(cursor, "story_comments", "activity_counted", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "story_comments", "activity_region", "TEXT")
+    _add_column(cursor, "game_history", "player1_region", "TEXT")
+    _add_column(cursor, "game_history", "player2_region", "TEXT")
+    _add_column(cursor, "region_week_users", "actions", "INTEGER NOT NULL DEFAULT 0")
+    for table in MODERATED_ACTIVITY_TABLES:
+        cursor.execute(f"""
+            UPDATE {table} SET
+                activity_counted = (status = 'approved'),
+                activity_region = CASE WHEN status = 'approved'
+                    THEN (SELECT region FROM profiles WHERE user_id = {table}.user_id) END
         """)
+    cursor.execute("""
+        UPDATE game_history SET
+            player1_region = (SELECT region FROM profiles WHERE user_id = game_history.player1_id),
+            player2_region = (SELECT region FROM profiles WHERE user_id = game_history.player2_id)
+    """)
+    rebuild_region_rollups(cursor)
+
+
+def _migration_021_admin_review(cursor):
+    """
+    Content Sightengine couldn't check waits for an admin: the water a story
+    earns once approved, and an index for the admin's pending comments list.
+    """
+    _add_column(cursor, "stories", "water_owed", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_story_comments_pending ON story_comments(created_at) "
+        "WHERE status = 'pending'"
+    )
 
-         # --- Add weekly tracking columns (safe ALTER) ---
-        for stmt in [
-            "ALTER TABLE user_streaks ADD COLUMN week_start_date TEXT",
-            "ALTER TABLE user_streaks ADD COLUMN last_reset_date TEXT"
-        ]:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
 
-                # ✅ ADDED: Game History Table (tracks who played with whom)
-        # This table records every game match between players
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS game_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                player1_id INTEGER NOT NULL,
-                player2_id INTEGER NOT NULL,
-                game_type TEXT NOT NULL,
-                winner_id INTEGER,
-                played_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(player1_id) REFERENCES users(id),
-                FOREIGN KEY(player2_id) REFERENCES users(id),
-                FOREIGN KEY(winner_id) REFERENCES users(id)
+MIGRATIONS = [
+    (1, "baseline schema", _migration_001_baseline),
+    (2, "default rewards and admin account", _migration_002_seed_data),
+    (3, "hot path indexes", _migration_003_hot_path_indexes),
+    (4, "story feed keyset index", _migration_004_feed_keyset_index),
+    (5, "story like/comment counters", _migration_005_story_counters),
+    (6, "unique story likes", _migration_006_unique_story_likes),
+    (7, "comment moderation status", _migration_007_comment_status),
+    (8, "moderation verdict cache", _migration_008_moderation_cache),
+    (9, "upload blobs", _migration_009_upload_blobs),
+    (10, "dm history keyset index", _migration_010_dm_history_index),
+    (11, "dm conversation summaries", _migration_011_conversations),
+    (12, "conversations by second user", _migration_012_conversations_user_hi),
+    (13, "dm read watermarks", _migration_013_read_watermarks),
+    (14, "shared presence registry", _migration_014_presence),
+    (15, "weekly region activity rollups", _migration_015_region_rollups),
+    (16, "finalized weekly achievements", _migration_016_weekly_finalized),
+    (17, "region stats counters", _migration_017_region_stats),
+    (18, "upload reference indexes", _migration_018_upload_reference_indexes),
+    (19, "story feed popular index", _migration_019_feed_popular_index),
+    (20, "activity regions", _migration_020_activity_regions),
+    (21, "admin review of unchecked content", _migration_021_admin_review),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn):
+    """
+    Apply every pending migration. Each one runs under BEGIN IMMEDIATE so
+    several gunicorn workers booting at once apply it exactly once.
+    Returns the list of versions applied by this call.
+    """
+    applied = []
+    for version, name, step in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            done = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if not done:
+                step(conn.cursor())
+                conn.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                    (version, name)
+                )
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not done:
+            print(f"🛠️ Applied migration {version:03d}: {name}")
+    return applied
+
+
+class DatabaseHelper:
+    def __init__(self, db_name='legacygarden.db', pool_size=None, idle_timeout=None, storage_profile=None,
+                 db_path=None):
+        self.db_name = db_name
+        self.storage_profile_name, profile = get_storage_profile(storage_profile)
+        self.pool = ConnectionPool(
+            db_path or DB_PATH,
+            max_size=DB_POOL_SIZE if pool_size is None else pool_size,
+            idle_timeout=DB_POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout,
+            profile=profile,
+        )
+        self.unread = UnreadCounts()
+        self.community = CommunitySnapshotCache()
+        self.notice_writer = NoticeWriter(self)
+        self.receipts = ReceiptWriter(self)
+        self.checkpointer = None
+        if str(profile.get("journal_mode", "")).upper() == "WAL":
+            self.checkpointer = WalCheckpointer(
+                self.pool,
+                profile.get("checkpoint_interval", 0),
+                profile.get("checkpoint_truncate_bytes", 0),
             )
-        """)
+        self.init_database()
 
-        # =========================
-        # DEFAULT ADMIN ACCOUNT
-        # =========================
-        cursor.execute("SELECT * FROM users WHERE username = ?", ("winx_admin",))
-        admin = cursor.fetchone()
+    def get_connection(self):
+        """Borrow a pooled connection. conn.close() returns it to the pool."""
+        if self.checkpointer is not None:
+            # (re)starts lazily so forked workers get their own thread
+            self.checkpointer.start()
+        return self.pool.acquire()
+
+    def get_schema_version(self, conn=None):
+        own = conn is None
+        conn = conn or self.get_connection()
+        try:
+            return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0  # brand new (or pre-migration) database
+        finally:
+            if own:
+                conn.close()
 
-        if not admin:
-            hashed_pw = generate_password_hash("Password123")
-            cursor.execute("""
-                INSERT INTO users (username, password, role)
-                VALUES (?, ?, ?)
-            """, ("winx_admin", hashed_pw, "admin"))
-            print("✅ winx_admin admin created.")
-        else:
-            # Force role to admin if already exists
-            cursor.execute("""
-                UPDATE users
-                SET role = 'Admin'
-                WHERE username = ?
-            """, ("winx_admin",))
-
-        # --- SAFE ALTER: add DM status columns + optional media fields ---
-        msg_alters = [
-            "ALTER TABLE messages ADD COLUMN message_type TEXT DEFAULT 'text'",
-            "ALTER TABLE messages ADD COLUMN media_path TEXT",
-            "ALTER TABLE messages ADD COLUMN audio_path TEXT",
-            "ALTER TABLE messages ADD COLUMN file_name TEXT",
-            "ALTER TABLE messages ADD COLUMN delivered_at TEXT",
-            "ALTER TABLE messages ADD COLUMN read_at TEXT",
-            
-        ]
-        for stmt in msg_alters:
-            try:
-                cursor.execute(stmt)
-            except sqlite3.OperationalError:
-                pass
+    def init_database(self):
+        """
+        Bring the schema up to date. On a warm start this is a single
+        SELECT on schema_version.
+        """
+        conn = self.get_connection()
+        try:
+            if self.get_schema_version(conn) >= LATEST_SCHEMA_VERSION:
+                return
+            if run_migrations(conn):
+                print("Legacy Garden Database fully initialized for the whole team.")
+        finally:
+            conn.close()
 
-        conn.commit()
-        conn.close()
-        print("Legacy Garden Database fully initialized for the whole team.")
+    def rebuild_story_counters(self):
+        """Reconcile stories.like_count / comment_count. Returns rows fixed."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            fixed = rebuild_story_counters(conn)
+            conn.commit()
+            return fixed
+        finally:
+            conn.close()
+
+    # --- MODERATION VERDICT CACHE (second tier for moderation.VerdictCache) ---
+    def get_cached_verdict(self, key, now):
+        """(verdict, expires_at) for a live entry, else None."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute(
+                "SELECT verdict, expires_at FROM moderation_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            return (row["verdict"], row["expires_at"]) if row else None
+        finally:
+            conn.close()
+
+    def put_cached_verdict(self, key, verdict, expires_at):
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO moderation_cache (key, verdict, expires_at) VALUES (?, ?, ?)",
+                (key, verdict, expires_at)
+            )
+            # piggy-back cleanup of expired rows (cheap: indexed on expires_at)
+            conn.execute("DELETE FROM moderation_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # --- UPLOAD BLOBS (uploads.py) ---
+    def record_upload_blob(self, sha256, rel_path, ext, size):
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO upload_blobs (sha256, rel_path, ext, size) VALUES (?, ?, ?, ?)",
+                (sha256, rel_path, ext, size)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def release_upload(self, sha256, rel_path, delete_files, force=False):
+        """
+        Forget an upload once no row points at it any more (force=True: even
+        if some still do). delete_files([original, *variants]) runs while
+        the write lock is held, so an upload of the same bytes can't slip in
+        between the check and the delete. sha256 is None for legacy file
+        names. Returns True if it was released.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if not force and count_upload_references(conn, rel_path):
+                conn.rollback()
+                return False
+            row = conn.execute("SELECT rel_path, variants FROM upload_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            files = [rel_path]
+            if row:
+                variants = json.loads(row["variants"]) if row["variants"] else {}
+                files = [row["rel_path"], *variants.values()]
+                conn.execute("DELETE FROM upload_blobs WHERE sha256 = ?", (sha256,))
+            delete_files(files)
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_upload_variants(self, sha256):
+        """{variant: rel_path} for a blob ({} if none were made yet)."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("SELECT variants FROM upload_blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            return json.loads(row["variants"]) if row and row["variants"] else {}
+        finally:
+            conn.close()
+
+    def set_upload_variants(self, sha256, variants):
+        conn = self.get_connection()
+        try:
+            conn.execute("UPDATE upload_blobs SET variants = ? WHERE sha256 = ?", (json.dumps(variants), sha256))
+            conn.commit()
+        finally:
+            conn.close()
 
     def get_user_by_login(self, login_input):
         conn = self.get_connection()
@@ -484,29 +1825,46 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         finally:
             conn.close()
     def get_region_member_counts(self, region_name):
+        """(youth, senior, total) members of a region, from region_stats."""
         conn = self.get_connection()
         try:
-            # Count youth/senior based on users.role, filtered by profiles.region
-            query = """
-                SELECT
-                    SUM(CASE WHEN LOWER(u.role) = 'youth' THEN 1 ELSE 0 END) AS youth_count,
-                    SUM(CASE WHEN LOWER(u.role) = 'senior' THEN 1 ELSE 0 END) AS senior_count,
-                    COUNT(*) AS total_count
-                FROM users u
-                JOIN profiles p ON u.id = p.user_id
-                WHERE p.region = ?
-            """
-            row = conn.execute(query, (region_name,)).fetchone()
+            row = conn.execute("""
+                SELECT youth_members, senior_members, total_members
+                FROM region_stats
+                WHERE region = ?
+            """, (region_name,)).fetchone()
+            if not row:
+                return 0, 0, 0
+            return row["youth_members"], row["senior_members"], row["total_members"]
+        finally:
+            conn.close()
+
+    def move_region_member(self, conn, old_region, old_role, new_region, new_role):
+        """
+        Keep region_stats in step with a signup (old_* None), a region/role
+        change, or a deleted account (new_* None). Caller commits, then
+        invalidates self.community for each region returned.
+        """
+        if old_region == new_region and (old_role or "").lower() == (new_role or "").lower():
+            return []
+        bump_region_members(conn, old_region, old_role, -1)
+        bump_region_members(conn, new_region, new_role, 1)
+        return [r for r in dict.fromkeys((old_region, new_region)) if r]
 
-            youth = row["youth_count"] or 0
-            senior = row["senior_count"] or 0
-            total = row["total_count"] or 0
-            return youth, senior, total
+    def rebuild_region_stats(self):
+        """Recompute region_stats from the raw tables. Returns the regions that were off."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            diffs = rebuild_region_stats(conn)
+            conn.commit()
+            return diffs
         finally:
             conn.close()
 
     def get_latest_notice_timestamp(self, region_name):
         """Return latest notice timestamp for a region (as datetime), or None."""
+        self._flush_notices()
         conn = self.get_connection()
         try:
             row = conn.execute(
@@ -523,6 +1881,7 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             conn.close()
 
     def get_region_notices(self, region_name, limit=10):
+        self._flush_notices()
         conn = self.get_connection()
         try:
             rows = conn.execute(
@@ -547,19 +1906,63 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
 
 
     def add_notice(self, username, region, message, emoji="ℹ️"):
-        conn = self.get_connection()
-        try:
-            conn.execute(
-                """
-                INSERT INTO notices (username, message, region, emoji)
-                VALUES (?, ?, ?, ?)
-                """,
-                (username, message, region, emoji)
-            )
-            conn.commit()
+        """Queued and inserted in a batch by NoticeWriter (shows up for readers straight away)."""
+        self.notice_writer.add(username, region, message, emoji)
+
+    def _flush_notices(self):
+        # read-your-writes for buffered notices
+        if self.notice_writer.pending():
+            self.notice_writer.flush()
+
+    def get_community_snapshot(self, region_name, week_start, notices_upto=0):
+        """
+        The region part of /community (cached, see CommunitySnapshotCache).
+        notices_upto: a notice id the viewer must see if it's in this region
+        (written by another worker) - an older cached snapshot is reloaded.
+        """
+        self._flush_notices()
+        snap = self.community.get(region_name, week_start, self._load_community_snapshot)
+        if notices_upto and snap.notices_upto < notices_upto:
+            self.community.invalidate(region_name)
+            snap = self.community.get(region_name, week_start, self._load_community_snapshot)
+        return snap
+
+    def _load_community_snapshot(self, region_name, week_start):
+        """region_stats and the week's achievements in one query, then the notices."""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("""
+                SELECT s.youth_members, s.senior_members, s.total_members,
+                       s.trees, s.flowers, s.points,
+                       w.most_active_region, w.participation_region, w.best_harvest_region,
+                       (SELECT MAX(id) FROM notices) AS notices_upto
+                FROM (SELECT 1)
+                LEFT JOIN region_stats s ON s.region = ?
+                LEFT JOIN weekly_achievements w ON w.week_start = ?
+            """, (region_name, week_start)).fetchone()
+            notices = conn.execute("""
+                SELECT id, username, message, region, emoji, timestamp
+                FROM notices
+                WHERE region = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (region_name, COMMUNITY_NOTICE_LIMIT)).fetchall()
         finally:
             conn.close()
 
+        weekly = {
+            "most_active_region": row["most_active_region"] or "—",
+            "participation_region": row["participation_region"] or "—",
+            "best_harvest_region": row["best_harvest_region"] or "—",
+        }
+        return CommunitySnapshot(
+            region_name, week_start,
+            int(row["youth_members"] or 0), int(row["senior_members"] or 0), int(row["total_members"] or 0),
+            [dict(n) for n in notices],
+            int(row["trees"] or 0), int(row["flowers"] or 0), int(row["points"] or 0),
+            weekly, int(row["notices_upto"] or 0),
+        )
+
 
     def get_weekly_achievements(self, week_start: str):
         conn = self.get_connection()
@@ -569,7 +1972,8 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                     most_active_region,
                     participation_region,
                     best_harvest_region,
-                    generated_at
+                    generated_at,
+                    finalized
                 FROM weekly_achievements
                 WHERE week_start = ?
             """, (week_start,)).fetchone()
@@ -579,6 +1983,7 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             
 
     def get_latest_notice_timestamp_in_range(self, start_dt, end_dt):
+        self._flush_notices()
         conn = self.get_connection()
         try:
             start_str = start_dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -623,181 +2028,81 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             conn.close()
 
 
-    def save_weekly_achievements(self, week_start, most_active, participation, best_harvest):
+    def save_weekly_achievements(self, week_start, most_active, participation, best_harvest, finalized=False):
+        """Upsert a week's winners. A row already finalized is left as it is."""
         conn = self.get_connection()
         try:
             conn.execute("""
-                INSERT OR REPLACE INTO weekly_achievements
-                (week_start, most_active_region, participation_region, best_harvest_region, generated_at)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, (week_start, most_active, participation, best_harvest))
+                INSERT INTO weekly_achievements
+                (week_start, most_active_region, participation_region, best_harvest_region, generated_at, finalized)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+                ON CONFLICT(week_start) DO UPDATE SET
+                    most_active_region = excluded.most_active_region,
+                    participation_region = excluded.participation_region,
+                    best_harvest_region = excluded.best_harvest_region,
+                    generated_at = excluded.generated_at,
+                    finalized = excluded.finalized
+                WHERE weekly_achievements.finalized = 0
+            """, (week_start, most_active, participation, best_harvest, 1 if finalized else 0))
             conn.commit()
         finally:
             conn.close()
+        self.community.invalidate()
 
 
 
-    def compute_weekly_winners(self, week_start_dt, week_end_dt):
+    def compute_weekly_winners(self, week_start_dt):
         """
         Most Active Region = highest total activity count
         Participation Award = highest unique users count
+        Best Harvest = most garden harvests
 
-        Activity sources:
-        - stories
-        - comments
-        - game_history
-        - community_tree_stats
-        ✅ + community region chat messages (messages where receiver_id IS NULL)
+        Read from region_week_activity (kept up to date by
+        record_region_activity as stories, comments, games, garden actions
+        and community chat messages are written) - one row per region.
+        week_start_dt is the Monday the week starts on.
         """
-        ws = week_start_dt.strftime("%Y-%m-%d %H:%M:%S")
-        we = week_end_dt.strftime("%Y-%m-%d %H:%M:%S")
-
+        week = week_start_dt.strftime("%Y-%m-%d")
         conn = self.get_connection()
         try:
-            # ---------- MOST ACTIVE REGION (TOTAL ACTIONS) ----------
-            row_active = conn.execute("""
-                SELECT region, COUNT(*) AS total_actions
-                FROM (
-                    -- Stories posted
-                    SELECT p.region AS region, s.user_id AS user_id
-                    FROM stories s
-                    JOIN profiles p ON p.user_id = s.user_id
-                    WHERE s.created_at >= ? AND s.created_at < ?
-                    AND s.status = 'approved'
-
-                    UNION ALL
-
-                    -- Comments made
-                    SELECT p.region AS region, c.user_id AS user_id
-                    FROM story_comments c
-                    JOIN profiles p ON p.user_id = c.user_id
-                    WHERE c.created_at >= ? AND c.created_at < ?
-
-                    UNION ALL
-
-                    -- Games played (count each match as 1 action per player)
-                    SELECT p1.region AS region, gh.player1_id AS user_id
-                    FROM game_history gh
-                    JOIN profiles p1 ON p1.user_id = gh.player1_id
-                    WHERE gh.played_at >= ? AND gh.played_at < ?
-
-                    UNION ALL
-
-                    SELECT p2.region AS region, gh.player2_id AS user_id
-                    FROM game_history gh
-                    JOIN profiles p2 ON p2.user_id = gh.player2_id
-                    WHERE gh.played_at >= ? AND gh.played_at < ?
-
-                    UNION ALL
-
-                    -- Garden harvest stats (tree/flower)
-                    SELECT cts.region AS region, cts.user_id AS user_id
-                    FROM community_tree_stats cts
-                    WHERE cts.created_at >= ? AND cts.created_at < ?
-
-                    UNION ALL
-
-                    -- ✅ Community messages (region chat)
-                    SELECT m.region_name AS region, m.sender_id AS user_id
-                    FROM messages m
-                    WHERE m.receiver_id IS NULL
-                    AND m.timestamp >= ? AND m.timestamp < ?
-                )
-                WHERE region IS NOT NULL AND region != ''
-                GROUP BY region
-                ORDER BY total_actions DESC
-                LIMIT 1
-            """, (ws, we, ws, we, ws, we, ws, we, ws, we, ws, we)).fetchone()
-
-            most_active = (row_active["region"] + " Region") if row_active else "—"
-
-            # ---------- PARTICIPATION AWARD (UNIQUE USERS) ----------
-            row_participation = conn.execute("""
-                SELECT region, COUNT(DISTINCT user_id) AS unique_users
-                FROM (
-                    SELECT p.region AS region, s.user_id AS user_id
-                    FROM stories s
-                    JOIN profiles p ON p.user_id = s.user_id
-                    WHERE s.created_at >= ? AND s.created_at < ?
-                    AND s.status = 'approved'
-
-                    UNION
-
-                    SELECT p.region AS region, c.user_id AS user_id
-                    FROM story_comments c
-                    JOIN profiles p ON p.user_id = c.user_id
-                    WHERE c.created_at >= ? AND c.created_at < ?
-
-                    UNION
-
-                    SELECT p1.region AS region, gh.player1_id AS user_id
-                    FROM game_history gh
-                    JOIN profiles p1 ON p1.user_id = gh.player1_id
-                    WHERE gh.played_at >= ? AND gh.played_at < ?
-
-                    UNION
-
-                    SELECT p2.region AS region, gh.player2_id AS user_id
-                    FROM game_history gh
-                    JOIN profiles p2 ON p2.user_id = gh.player2_id
-                    WHERE gh.played_at >= ? AND gh.played_at < ?
-
-                    UNION
-
-                    SELECT cts.region AS region, cts.user_id AS user_id
-                    FROM community_tree_stats cts
-                    WHERE cts.created_at >= ? AND cts.created_at < ?
-
-                    UNION
-
-                    -- ✅ Community messages (unique senders in region chat)
-                    SELECT m.region_name AS region, m.sender_id AS user_id
-                    FROM messages m
-                    WHERE m.receiver_id IS NULL
-                    AND m.timestamp >= ? AND m.timestamp < ?
-                )
-                WHERE region IS NOT NULL AND region != ''
-                GROUP BY region
-                ORDER BY unique_users DESC
-                LIMIT 1
-            """, (ws, we, ws, we, ws, we, ws, we, ws, we, ws, we)).fetchone()
-
-            participation = (row_participation["region"] + " Region") if row_participation else "—"
-
-            # ---------- BEST HARVEST REGION ----------
-            row_harvest = conn.execute("""
-                SELECT region, COUNT(*) AS harvest_actions
-                FROM community_tree_stats
-                WHERE created_at >= ? AND created_at < ?
-                AND action IN ('harvest_tree', 'harvest_flower')
-                GROUP BY region
-                ORDER BY harvest_actions DESC
-                LIMIT 1
-            """, (ws, we)).fetchone()
-
-            best_harvest = (row_harvest["region"] + " Region") if row_harvest else "—"
+            rows = conn.execute("""
+                SELECT region, actions, unique_users, harvests
+                FROM region_week_activity
+                WHERE week_start = ?
+            """, (week,)).fetchall()
+        finally:
+            conn.close()
 
-            # If you still want best flower region:
-            row_flower = conn.execute("""
-                SELECT region, COUNT(*) AS flower_actions
-                FROM community_tree_stats
-                WHERE created_at >= ? AND created_at < ?
-                AND action = 'harvest_flower'
-                GROUP BY region
-                ORDER BY flower_actions DESC
-                LIMIT 1
-            """, (ws, we)).fetchone()
+        def top(col):
+            best = max((r for r in rows if r[col] > 0), key=lambda r: r[col], default=None)
+            return (best["region"] + " Region") if best else "—"
 
+        return top("actions"), top("unique_users"), top("harvests")
 
+    def sync_story_activity(self, conn, story_id):
+        """
+        Count a story in the weekly rollups while it is approved, take it
+        back out when it isn't any more. Call after changing its status;
+        the caller commits.
+        """
+        sync_activity(conn, "stories", story_id)
 
-            return most_active, participation, best_harvest
+    def forget_story_activity(self, conn, story_id):
+        """Take a story and its comments out of the rollups - call before deleting it."""
+        uncount_activity(conn, "story_comments", "story_id = ?", (story_id,))
+        uncount_activity(conn, "stories", "id = ?", (story_id,))
 
+    def rebuild_region_rollups(self):
+        """Recompute the weekly region rollups from scratch. Returns (week, region) rows."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = rebuild_region_rollups(conn)
+            conn.commit()
+            return rows
         finally:
             conn.close()
 
-
-
-
     def add_tree_stat(self, user_id, region, action, points):
         conn = self.get_connection()
         try:
@@ -805,28 +2110,26 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                 INSERT INTO community_tree_stats (user_id, region, action, points)
                 VALUES (?, ?, ?, ?)
             """, (user_id, region, action, int(points or 0)))
+            record_region_activity(conn, user_id, region, harvest=action in HARVEST_ACTIONS)
+            bump_region_tree(conn, region, action, points)
             conn.commit()
         finally:
             conn.close()
+        self.community.invalidate(region)
 
     def get_region_tree_totals(self, region_name):
+        """(trees, flowers, points) harvested by a region, from region_stats."""
         conn = self.get_connection()
         try:
-            row = conn.execute("""
-                SELECT
-                SUM(CASE WHEN action='harvest_tree' THEN 1 ELSE 0 END) AS trees,
-                SUM(CASE WHEN action='harvest_flower' THEN 1 ELSE 0 END) AS flowers,
-                SUM(COALESCE(points,0)) AS points
-                FROM community_tree_stats
-                WHERE region = ?
-            """, (region_name,)).fetchone()
-
-            return int(row["trees"] or 0), int(row["flowers"] or 0), int(row["points"] or 0)
+            row = conn.execute(
+                "SELECT trees, flowers, points FROM region_stats WHERE region = ?", (region_name,)
+            ).fetchone()
+            if not row:
+                return 0, 0, 0
+            return row["trees"], row["flowers"], row["points"]
         finally:
             conn.close()
 
-    
-
 
 
     # yq added for event
@@ -1061,20 +2364,6 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
 
 
 # added vivion
-    def ensure_columns_exist(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(users)")
-        cols = [r['name'] for r in cursor.fetchall()]
-        if 'points' not in cols:
-            cursor.execute("ALTER TABLE users ADD COLUMN points INTEGER DEFAULT 0")
-        
-        cursor.execute("PRAGMA table_info(stories)")
-        story_cols = [r['name'] for r in cursor.fetchall()]
-        if 'status' not in story_cols:
-            cursor.execute("ALTER TABLE stories ADD COLUMN status TEXT DEFAULT 'approved'")
-        conn.commit()
-        conn.close()
     def report_story(self, story_id, user_id, reason):
             conn = self.get_connection()
             try:
@@ -1085,6 +2374,7 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                 # 2. HIDE THE STORY (Set status to 'pending')
                 # This removes it from the public feed immediately.
                 conn.execute("UPDATE stories SET status = 'pending' WHERE id = ?", (story_id,))
+                self.sync_story_activity(conn, story_id)
                 
                 conn.commit()
                 print(f"⚠️ Story {story_id} reported by User {user_id}. Status -> Pending.")
@@ -1101,22 +2391,64 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         conn.close()
         return u
 
-    def get_stories_for_pov(self, my_role, my_uid):
-        conn = self.get_connection()
-
+    def get_story_feed_page(self, my_role, my_uid, cursor=None, limit=FEED_PAGE_SIZE,
+                            search="", topic="", sort="newest"):
+        """
+        One page of the story feed (other generation's approved stories + my own).
+        Keyset pagination, so page N costs the same as page 1 no matter how big
+        the table gets:
+          newest  - id descending, cursor is the last id
+          oldest  - id ascending, cursor is the last id
+          popular - like_count then id descending, cursor is "<like_count>:<id>"
+        search matches title or content (case-insensitive), topic is exact.
+
+        Returns (stories, next_cursor). Pass next_cursor back (with the same
+        search/topic/sort) to get the following page; it is None on the last page.
+        """
         my_role = (my_role or "").strip().lower()
+        limit = max(1, min(int(limit or FEED_PAGE_SIZE), FEED_MAX_PAGE_SIZE))
+        sort = sort if sort in FEED_SORTS else "newest"
+
+        where = ["s.status = 'approved'", "(TRIM(LOWER(u.role)) != ? OR s.user_id = ?)"]
+        params = [my_uid, my_role, my_uid]
+        if topic:
+            where.append("s.topic = ?")
+            params.append(topic)
+        if search:
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(s.title LIKE ? ESCAPE '\\' OR s.content LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        if cursor:
+            if sort == "popular":
+                likes, last_id = (int(x) for x in str(cursor).split(":"))
+                where.append("(s.like_count, s.id) < (?, ?)")
+                params += [likes, last_id]
+            else:
+                where.append("s.id > ?" if sort == "oldest" else "s.id < ?")
+                params.append(int(cursor))
 
-        s = conn.execute("""
-            SELECT s.*, u.username, u.role
-            FROM stories s
-            JOIN users u ON s.user_id = u.id
-            WHERE (TRIM(LOWER(u.role)) != ? OR s.user_id = ?)
-            AND s.status = 'approved'
-            ORDER BY s.created_at DESC
-        """, (my_role, my_uid)).fetchall()
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT s.*, u.username, u.role,
+                    EXISTS(SELECT 1 FROM story_likes WHERE story_id = s.id AND user_id = ?) AS user_liked
+                FROM stories s
+                JOIN users u ON s.user_id = u.id
+                WHERE {" AND ".join(where)}
+                ORDER BY {FEED_SORTS[sort]}
+                LIMIT ?
+            """, (*params, limit + 1)).fetchall()
+        finally:
+            conn.close()
 
-        conn.close()
-        return [dict(r) for r in s]
+        stories = [dict(r) for r in rows[:limit]]
+        for st in stories:
+            st["user_liked"] = bool(st["user_liked"])
+        next_cursor = None
+        if len(rows) > limit:
+            last = stories[-1]
+            next_cursor = f"{last['like_count']}:{last['id']}" if sort == "popular" else last["id"]
+        return stories, next_cursor
 
     def log_garden_history(self, user_id, category, title, amount=0):
             conn = self.get_connection()
@@ -1176,7 +2508,8 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         conn.close()
         return s
 
-    def get_story_comments(self, story_id):
+    def get_story_comments(self, story_id, viewer_id=None):
+        # approved comments, plus the viewer's own ones still in moderation
         conn = self.get_connection()
         rows = conn.execute("""
             SELECT
@@ -1185,12 +2518,14 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                 sc.user_id,         
                 sc.content,
                 sc.created_at,
+                sc.status,
                 u.username
             FROM story_comments sc
             JOIN users u ON u.id = sc.user_id
             WHERE sc.story_id = ?
+            AND (sc.status = 'approved' OR sc.user_id = ?)
             ORDER BY sc.id DESC
-        """, (story_id,)).fetchall()
+        """, (story_id, viewer_id)).fetchall()
         conn.close()
         return [dict(r) for r in rows]
 
@@ -1215,13 +2550,89 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             if requester_user_id not in (comment_owner_id, story_owner_id):
                 return False
 
-            conn.execute("DELETE FROM story_comments WHERE id = ?", (comment_id,))
+            self.delete_comment_row(conn, comment_id)
             conn.commit()
             return True
         finally:
             conn.close()
 
+    def delete_comment_row(self, conn, comment_id):
+        """
+        Delete one comment and keep stories.comment_count in step, on the
+        caller's connection (the caller commits).
+        """
+        row = conn.execute("SELECT story_id, status FROM story_comments WHERE id = ?", (comment_id,)).fetchone()
+        if not row:
+            return False
+        uncount_activity(conn, "story_comments", "id = ?", (comment_id,))
+        conn.execute("DELETE FROM story_comments WHERE id = ?", (comment_id,))
+        if row["status"] == "approved":
+            conn.execute(
+                "UPDATE stories SET comment_count = MAX(comment_count - 1, 0) WHERE id = ?",
+                (row["story_id"],)
+            )
+        return True
+
+    def set_comment_status(self, comment_id, status):
+        """
+        Moderation verdict for a comment. comment_count only counts approved
+        comments, so it moves when a comment enters or leaves 'approved'.
+        Returns the comment row (before the change) or None.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, story_id, user_id, status FROM story_comments WHERE id = ?", (comment_id,)
+            ).fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            conn.execute("UPDATE story_comments SET status = ? WHERE id = ?", (status, comment_id))
+            delta = (status == "approved") - (row["status"] == "approved")
+            if delta:
+                conn.execute(
+                    "UPDATE stories SET comment_count = MAX(comment_count + ?, 0) WHERE id = ?",
+                    (delta, row["story_id"])
+                )
+            sync_activity(conn, "story_comments", comment_id)
+            conn.commit()
+            return dict(row)
+        finally:
+            conn.close()
+
+    def toggle_like(self, story_id, user_id):
+        """
+        Like / unlike a story for one user in one transaction. The insert is
+        an upsert against UNIQUE(story_id, user_id), so a double-click can't
+        create a second like; if nothing was inserted the like already
+        existed and gets deleted instead. like_count moves with it and comes
+        back via RETURNING - no COUNT(*) rescan.
+        Returns (liked_now, like_count).
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            liked_now = conn.execute(
+                "INSERT INTO story_likes (story_id, user_id) VALUES (?, ?) "
+                "ON CONFLICT(story_id, user_id) DO NOTHING",
+                (story_id, user_id)
+            ).rowcount == 1
+
+            if not liked_now:
+                conn.execute(
+                    "DELETE FROM story_likes WHERE story_id = ? AND user_id = ?",
+                    (story_id, user_id)
+                )
 
+            row = conn.execute(
+                "UPDATE stories SET like_count = MAX(like_count + ?, 0) WHERE id = ? RETURNING like_count",
+                (1 if liked_now else -1, story_id)
+            ).fetchone()
+            conn.commit()
+            return liked_now, (row["like_count"] if row else 0)
+        finally:
+            conn.close()
 
     def report_comment(self, comment_id, reporter_user_id, reason):
         conn = self.get_connection()
@@ -1240,12 +2651,60 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
 
     def create_story(self, uid, title, content, topic, role, img, status='approved'):
         conn = self.get_connection()
-        conn.execute("""
+        cur = conn.execute("""
             INSERT INTO stories (user_id, title, content, topic, role_visibility, image_path, status)
             VALUES (?,?,?,?,?,?,?)
         """, (uid, title, content, topic, role, img, status))
+        if status == 'approved':
+            self.sync_story_activity(conn, cur.lastrowid)
         conn.commit()
         conn.close()
+        return cur.lastrowid
+
+    def set_story_moderation(self, story_id, status, clear_image=False):
+        """Moderation verdict for a story; clear_image drops a rejected photo."""
+        conn = self.get_connection()
+        try:
+            if clear_image:
+                conn.execute("UPDATE stories SET status = ?, image_path = NULL WHERE id = ?", (status, story_id))
+            else:
+                conn.execute("UPDATE stories SET status = ? WHERE id = ?", (status, story_id))
+            self.sync_story_activity(conn, story_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def hold_story_water(self, story_id, water):
+        """A story left for admin review: remember the water it will earn."""
+        conn = self.get_connection()
+        try:
+            conn.execute("UPDATE stories SET water_owed = ? WHERE id = ? AND status = 'pending'",
+                         (int(water), story_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def pay_story_water(self, conn, story_id):
+        """
+        Give the author the water held for a story (hold_story_water), once.
+        Runs on the caller's connection, inside its approve transaction.
+        Returns the water paid (0 if nothing was owed).
+        """
+        row = conn.execute("SELECT user_id, title, water_owed FROM stories WHERE id = ?", (story_id,)).fetchone()
+        if not row or not row["water_owed"]:
+            return 0
+        cur = conn.execute("UPDATE stories SET water_owed = 0 WHERE id = ? AND water_owed = ?",
+                           (story_id, row["water_owed"]))
+        if not cur.rowcount:
+            return 0
+        water = int(row["water_owed"])
+        conn.execute("INSERT OR IGNORE INTO user_inventory (user_id) VALUES (?)", (row["user_id"],))
+        conn.execute("UPDATE user_inventory SET water = water + ? WHERE user_id = ?", (water, row["user_id"]))
+        conn.execute(
+            "INSERT INTO garden_history (user_id, category, title, amount) VALUES (?, 'water', ?, ?)",
+            (row["user_id"], f'Earned water from story "{row["title"]}" (+{water} water)', water)
+        )
+        return water
 
     def add_water_reward(self, uid, amt=1):
         conn = self.get_connection()
@@ -1433,14 +2892,18 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         conn.close()
         return False
     
-    def add_comment(self, story_id, user_id, content):
+    def add_comment(self, story_id, user_id, content, status='approved'):
         conn = self.get_connection()
         try:
-            conn.execute("INSERT INTO story_comments (story_id, user_id, content) VALUES (?,?,?)", 
-                         (story_id, user_id, content))
+            cur = conn.execute("INSERT INTO story_comments (story_id, user_id, content, status) VALUES (?,?,?,?)", 
+                         (story_id, user_id, content, status))
             # Optional: Add points for commenting?
-            # conn.execute("UPDATE stories SET comment_count = comment_count + 1 WHERE id=?", (story_id,))
+            # pending comments are counted when moderation approves them
+            if status == 'approved':
+                conn.execute("UPDATE stories SET comment_count = comment_count + 1 WHERE id=?", (story_id,))
+                sync_activity(conn, "story_comments", cur.lastrowid)
             conn.commit()
+            return cur.lastrowid
         except Exception as e:
             print(f"Error adding comment: {e}")
         finally:
@@ -1453,8 +2916,10 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             conn = self.get_connection() 
             cursor = conn.cursor()
             
-            # 1. Delete comments first (to avoid database errors)
+            # 1. Delete comments + likes first (to avoid database errors)
+            self.forget_story_activity(cursor, story_id)
             cursor.execute("DELETE FROM story_comments WHERE story_id = ?", (story_id,))
+            cursor.execute("DELETE FROM story_likes WHERE story_id = ?", (story_id,))
 
             # 2. Delete the story
             cursor.execute("DELETE FROM stories WHERE id = ?", (story_id,))
@@ -1499,25 +2964,14 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
 
     def approve_story(self, story_id):
         """
-        Sets a story's status to 'approved' so it appears on the home feed.
+        Sets a story's status to 'approved' so it appears on the home feed,
+        and pays any water it was held back (pay_story_water).
         """
         conn = self.get_connection()
         try:
             conn.execute("UPDATE stories SET status = 'approved' WHERE id = ?", (story_id,))
-            conn.commit()
-            print(f"✅ Story {story_id} approved.")
-            return True
-        except Exception as e:
-            print(f"❌ Error approving story: {e}")
-            return False
-        finally:
-            conn.close()
-
-
-    def approve_story(self, story_id):
-        conn = self.get_connection()
-        try:
-            conn.execute("UPDATE stories SET status = 'approved' WHERE id = ?", (story_id,))
+            self.sync_story_activity(conn, story_id)
+            self.pay_story_water(conn, story_id)
             conn.commit()
             print(f"✅ Story {story_id} Approved!")
             return True
@@ -1585,23 +3039,6 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         finally:
             conn.close()
 
-    def get_stories_for_pov(self, my_role, my_uid):
-        conn = self.get_connection()
-        # Add a subquery to check if the specific logged-in user liked each story
-        s = conn.execute("""
-            SELECT s.*, u.username, u.role,
-                (SELECT COUNT(*) FROM story_likes WHERE story_id = s.id) as like_count,
-                (SELECT COUNT(*) FROM story_comments WHERE story_id = s.id) as comment_count,
-                (SELECT COUNT(*) FROM story_likes WHERE story_id = s.id AND user_id = ?) as is_liked_by_me
-            FROM stories s
-            JOIN users u ON s.user_id = u.id
-            WHERE (TRIM(LOWER(u.role)) != ? OR s.user_id = ?)
-            AND s.status = 'approved'
-            ORDER BY s.created_at DESC
-        """, (my_uid, my_role, my_uid)).fetchall()
-        conn.close()
-        return [dict(r) for r in s]
-    
      # ✅ ADDED: Game History Helper Methods
     # These methods track and retrieve game match history between players
     
@@ -1612,10 +3049,18 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         """
         conn = self.get_connection()
         try:
-            conn.execute("""
+            cur = conn.execute("""
                 INSERT INTO game_history (player1_id, player2_id, game_type, winner_id)
                 VALUES (?, ?, ?, ?)
             """, (player1_id, player2_id, game_type, winner_id))
+            played_at = conn.execute(
+                "SELECT played_at FROM game_history WHERE id = ?", (cur.lastrowid,)
+            ).fetchone()[0]
+            conn.execute(
+                "UPDATE game_history SET player1_region = ?, player2_region = ? WHERE id = ?",
+                (record_region_activity(conn, player1_id, None, played_at),
+                 record_region_activity(conn, player2_id, None, played_at), cur.lastrowid)
+            )
             conn.commit()
             return True
         except Exception as e:
@@ -1668,10 +3113,12 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
     def save_region_message(self, sender_id, region_name, message_text):
         conn = self.get_connection()
         try:
-            conn.execute("""
+            cur = conn.execute("""
                 INSERT INTO messages (sender_id, receiver_id, region_name, message_text)
                 VALUES (?, NULL, ?, ?)
+                RETURNING timestamp
             """, (sender_id, region_name, message_text))
+            record_region_activity(conn, sender_id, region_name, cur.fetchone()[0])
             conn.commit()
         finally:
             conn.close()
@@ -1713,30 +3160,279 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                 message_type, message_text, media_path, audio_path, file_name,
                 timestamp
             ))
+            msg_id = cur.lastrowid
+            if region_name is not None and receiver_id is None:
+                ts = cur.execute("SELECT timestamp FROM messages WHERE id = ?", (msg_id,)).fetchone()[0]
+                record_region_activity(cur, sender_id, region_name, ts)
+            if region_name is None and receiver_id is not None:
+                self._touch_conversation(cur, msg_id)
+                with self.unread.lock:
+                    conn.commit()
+                    if receiver_id != sender_id:
+                        self.unread.bump(receiver_id, sender_id)
+            else:
+                conn.commit()
+            return msg_id
+        finally:
+            conn.close()
+
+    def _touch_conversation(self, cur, msg_id):
+        """Point the pair's conversations row at a new DM and bump the receiver's unread."""
+        cur.execute(f"""
+            INSERT INTO conversations (
+                user_lo, user_hi, last_message_id, last_sender_id, last_at, last_preview, unread_lo, unread_hi
+            )
+            SELECT MIN(sender_id, receiver_id), MAX(sender_id, receiver_id), id, sender_id, timestamp,
+                   {_DM_PREVIEW_SQL}, receiver_id < sender_id, receiver_id > sender_id
+            FROM messages WHERE id = ?
+            ON CONFLICT(user_lo, user_hi) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_sender_id = excluded.last_sender_id,
+                last_at = excluded.last_at,
+                last_preview = excluded.last_preview,
+                unread_lo = unread_lo + excluded.unread_lo,
+                unread_hi = unread_hi + excluded.unread_hi
+        """, (msg_id,))
+
+    def _clear_conversation_unread(self, conn, sender_id, receiver_id):
+        """
+        receiver_id has read everything from sender_id: zero their unread
+        count and move their read watermark up to the pair's last message.
+        """
+        conn.execute("""
+            UPDATE conversations
+            SET unread_lo = CASE WHEN user_lo = ? THEN 0 ELSE unread_lo END,
+                unread_hi = CASE WHEN user_hi = ? THEN 0 ELSE unread_hi END,
+                read_upto_lo = CASE WHEN user_lo = ? THEN MAX(read_upto_lo, last_message_id) ELSE read_upto_lo END,
+                read_upto_hi = CASE WHEN user_hi = ? THEN MAX(read_upto_hi, last_message_id) ELSE read_upto_hi END
+            WHERE user_lo = MIN(?, ?) AND user_hi = MAX(?, ?)
+        """, (receiver_id, receiver_id, receiver_id, receiver_id,
+              sender_id, receiver_id, sender_id, receiver_id))
+
+    def get_read_upto(self, reader_id, other_id):
+        """
+        Newest message id reader_id has read in their DM with other_id (0 if
+        none). Every message other_id sent with an id up to this is read.
+        """
+        conn = self.get_connection()
+        try:
+            row = conn.execute("""
+                SELECT CASE WHEN user_lo = ? THEN read_upto_lo ELSE read_upto_hi END AS upto
+                FROM conversations
+                WHERE user_lo = MIN(?, ?) AND user_hi = MAX(?, ?)
+            """, (reader_id, reader_id, other_id, reader_id, other_id)).fetchone()
+            return int(row["upto"]) if row else 0
+        finally:
+            conn.close()
+
+    # --- PRESENCE (presence.SQLitePresenceBackend) ---
+    # A session counts only while its worker's seen_at is after `alive_after`.
+    _PRESENCE_LIVE_SQL = """
+        SELECT 1 FROM presence_sessions s
+        JOIN presence_workers w ON w.worker = s.worker
+        WHERE s.user_id = ? AND w.seen_at > ?
+    """
+
+    def presence_register_worker(self, worker, now):
+        conn = self.get_connection()
+        try:
+            conn.execute("INSERT OR REPLACE INTO presence_workers (worker, seen_at) VALUES (?, ?)", (worker, now))
+            # leftovers of an earlier process with the same host:pid
+            conn.execute("DELETE FROM presence_sessions WHERE worker = ?", (worker,))
             conn.commit()
-            return cur.lastrowid
         finally:
             conn.close()
 
-    def get_chat_history(self, user1_id, user2_id):
+    def presence_heartbeat(self, worker, now, purge_before):
+        conn = self.get_connection()
+        try:
+            conn.execute("INSERT OR REPLACE INTO presence_workers (worker, seen_at) VALUES (?, ?)", (worker, now))
+            conn.execute("""
+                DELETE FROM presence_sessions
+                WHERE worker IN (SELECT worker FROM presence_workers WHERE seen_at < ?)
+            """, (purge_before,))
+            conn.execute("DELETE FROM presence_workers WHERE seen_at < ?", (purge_before,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def presence_add(self, worker, user_id, sid, alive_after):
+        """Returns True if the user had no live session before this one."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            was_online = conn.execute(self._PRESENCE_LIVE_SQL + " LIMIT 1", (user_id, alive_after)).fetchone()
+            conn.execute("""
+                INSERT OR REPLACE INTO presence_sessions (worker, sid, user_id, connected_at)
+                VALUES (?, ?, ?, ?)
+            """, (worker, sid, user_id, time.time()))
+            conn.commit()
+            return was_online is None
+        finally:
+            conn.close()
+
+    def presence_remove(self, worker, sid, alive_after):
+        """(user_id, was_last_live_session); (None, False) for an unknown sid."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "DELETE FROM presence_sessions WHERE worker = ? AND sid = ? RETURNING user_id",
+                (worker, sid)
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None, False
+            still = conn.execute(self._PRESENCE_LIVE_SQL + " LIMIT 1", (row["user_id"], alive_after)).fetchone()
+            conn.commit()
+            return row["user_id"], still is None
+        finally:
+            conn.close()
+
+    def presence_is_online(self, user_id, alive_after):
+        conn = self.get_connection()
+        try:
+            return conn.execute(self._PRESENCE_LIVE_SQL + " LIMIT 1", (user_id, alive_after)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def presence_sids(self, user_id, alive_after):
         conn = self.get_connection()
         try:
             rows = conn.execute("""
-                SELECT
-                    id, sender_id, receiver_id, region_name,
-                    message_type, message_text, media_path, audio_path, file_name,
-                    timestamp, delivered_at, read_at
-                FROM messages
-                WHERE
-                    ((sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?))
-                    AND region_name IS NULL
-                ORDER BY id ASC
-            """, (user1_id, user2_id, user2_id, user1_id)).fetchall()
+                SELECT s.sid FROM presence_sessions s
+                JOIN presence_workers w ON w.worker = s.worker
+                WHERE s.user_id = ? AND w.seen_at > ?
+            """, (user_id, alive_after)).fetchall()
+            return [r["sid"] for r in rows]
+        finally:
+            conn.close()
+
+    def presence_online_ids(self, alive_after):
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("""
+                SELECT DISTINCT s.user_id FROM presence_sessions s
+                JOIN presence_workers w ON w.worker = s.worker
+                WHERE w.seen_at > ?
+            """, (alive_after,)).fetchall()
+            return [r["user_id"] for r in rows]
+        finally:
+            conn.close()
+
+    def get_dm_partner_ids(self, user_id):
+        """Everyone user_id has a DM conversation with."""
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("""
+                SELECT user_hi AS other_id FROM conversations WHERE user_lo = ? AND user_hi <> user_lo
+                UNION
+                SELECT user_lo FROM conversations WHERE user_hi = ? AND user_hi <> user_lo
+            """, (user_id, user_id)).fetchall()
+            return [r["other_id"] for r in rows]
+        finally:
+            conn.close()
+
+    def get_region_user_ids(self, region_name):
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("SELECT user_id FROM profiles WHERE region = ?", (region_name,)).fetchall()
+            return [r["user_id"] for r in rows]
+        finally:
+            conn.close()
+
+    def get_unread_counts(self, receiver_id):
+        """{sender_id: unread DMs} for the sidebar badges (senders with none left out)."""
+        return self.unread.get(int(receiver_id), self._load_unread_counts)
 
+    def get_unread_count(self, receiver_id, sender_id):
+        return self.get_unread_counts(receiver_id).get(int(sender_id), 0)
+
+    def _load_unread_counts(self, receiver_id):
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("""
+                SELECT user_hi AS other_id, unread_lo AS unread FROM conversations
+                WHERE user_lo = ? AND unread_lo > 0
+                UNION ALL
+                SELECT user_lo, unread_hi FROM conversations
+                WHERE user_hi = ? AND unread_hi > 0
+            """, (receiver_id, receiver_id)).fetchall()
+            return {r["other_id"]: r["unread"] for r in rows}
+        finally:
+            conn.close()
+
+    def get_dm_sidebar(self, me_id, partner_role):
+        """
+        Everyone with role `partner_role` (lowercase) except me, with our
+        conversation's last message time / preview, most recent chat first.
+        """
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("""
+                SELECT u.id, u.username, u.role,
+                       COALESCE(p.profile_pic, 'profile_pic.png') AS pfp,
+                       c.last_at AS last_msg, c.last_preview, c.last_sender_id
+                FROM users u
+                LEFT JOIN profiles p ON p.user_id = u.id
+                LEFT JOIN conversations c ON c.user_lo = MIN(u.id, ?) AND c.user_hi = MAX(u.id, ?)
+                WHERE LOWER(TRIM(u.role)) = ? AND u.id != ?
+                ORDER BY last_msg DESC, u.username ASC
+            """, (me_id, me_id, partner_role, me_id)).fetchall()
             return [dict(r) for r in rows]
         finally:
             conn.close()
 
+    def rebuild_conversations(self):
+        """Rebuild the DM conversation summaries from messages. Returns pairs."""
+        conn = self.get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            pairs = rebuild_conversations(conn)
+            conn.commit()
+            return pairs
+        finally:
+            conn.close()
+
+    def get_chat_history(self, user1_id, user2_id, before_id=None, limit=CHAT_PAGE_SIZE):
+        """
+        The `limit` newest DMs between two users with id < before_id (the
+        newest overall when before_id is None), oldest first for rendering.
+        Each direction of the pair is its own walk down idx_messages_pair_id,
+        read newest-first and cut at `limit`, so a page costs the same
+        however long the history is. Pass the first message's id as
+        before_id to get the page before it.
+        """
+        limit = max(1, min(int(limit), CHAT_MAX_PAGE_SIZE))
+        before_id = int(before_id) if before_id else 2 ** 63 - 1
+        cols = """
+            id, sender_id, receiver_id, region_name,
+            message_type, message_text, media_path, audio_path, file_name,
+            timestamp, delivered_at, read_at
+        """
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT * FROM (
+                    SELECT {cols} FROM messages
+                    WHERE sender_id = ? AND receiver_id = ? AND id < ? AND region_name IS NULL
+                    ORDER BY id DESC LIMIT ?
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT {cols} FROM messages
+                    WHERE sender_id = ? AND receiver_id = ? AND id < ? AND region_name IS NULL
+                    AND sender_id <> receiver_id  -- a chat with yourself is all in the first half
+                    ORDER BY id DESC LIMIT ?
+                )
+                ORDER BY id DESC LIMIT ?
+            """, (user1_id, user2_id, before_id, limit,
+                  user2_id, user1_id, before_id, limit, limit)).fetchall()
+
+            return [dict(r) for r in reversed(rows)]
+        finally:
+            conn.close()
+
     def get_region_messages(self, region_name):
         conn = self.get_connection()
         try:
@@ -1751,13 +3447,6 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
         finally:
             conn.close()
 
-    import sqlite3
-
-    def get_connection(self):
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
-
     def mark_delivered(self, msg_id, ts=None):
         conn = self.get_connection()
         try:
@@ -1790,7 +3479,10 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
                     delivered_at = COALESCE(delivered_at, COALESCE(?, CURRENT_TIMESTAMP))
                 WHERE sender_id=? AND receiver_id=? AND read_at IS NULL
             """, (ts, ts, sender_id, receiver_id))
-            conn.commit()
+            self._clear_conversation_unread(conn, sender_id, receiver_id)
+            with self.unread.lock:
+                conn.commit()
+                self.unread.reset(receiver_id, sender_id)
         finally:
             conn.close()
 
@@ -1847,7 +3539,10 @@ CREATE TABLE IF NOT EXISTS inventory_logs (
             AND receiver_id = ?
             AND read_at IS NULL
         """, (sender_id, receiver_id))
-        conn.commit()
+        self._clear_conversation_unread(conn, sender_id, receiver_id)
+        with self.unread.lock:
+            conn.commit()
+            self.unread.reset(receiver_id, sender_id)
         conn.close()
 
     
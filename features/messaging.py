@@ -6,38 +6,70 @@ from flask import Blueprint, render_template, request, session, jsonify
 from werkzeug.utils import secure_filename
 from flask_socketio import join_room, emit
 
-from database import db_helper
+from database import db_helper, CHAT_PAGE_SIZE
+from uploads import UploadError, save_upload, upload_url
+from presence import presence, PresenceBroadcaster
 
 
 # =========================
 # Socket helpers / presence
 # =========================
 
-online_users = {}  # user_id -> sid
-
 def dm_room(a: int, b: int) -> str:
     return f"dm_{min(a,b)}_{max(a,b)}"
 
+def user_room(uid: int) -> str:
+    # every socket of one user (all tabs) - used for personal notifications
+    return f"user_{int(uid)}"
+
+def region_room(region: str) -> str:
+    # everyone online in a community region (presence of region members)
+    return f"region_{region}"
+
+def _presence_rooms(uid: int):
+    """Who may see uid come online / go offline: DM partners + their region."""
+    rooms = [user_room(p) for p in db_helper.get_dm_partner_ids(uid)]
+    region = db_helper.get_user_region(uid)
+    if region and region != "Unknown":
+        rooms.append(region_room(region))
+    return rooms
+
+def _visible_online_ids(uid: int):
+    """Online users that uid is allowed to see (same audience as above)."""
+    visible = set(db_helper.get_dm_partner_ids(uid))
+    region = db_helper.get_user_region(uid)
+    if region and region != "Unknown":
+        visible.update(db_helper.get_region_user_ids(region))
+    visible.discard(uid)
+    return [u for u in presence.online_ids() if u in visible]
+
 def init_messaging(socketio):
+    broadcaster = PresenceBroadcaster(
+        _presence_rooms,
+        lambda room, delta: socketio.emit("presence_delta", delta, to=room),
+    )
 
     @socketio.on("presence_join")
     def presence_join(_data=None):
         if "user_id" not in session:
             return
         uid = int(session["user_id"])
-        online_users[uid] = request.sid
-        socketio.emit("online_list", list(online_users.keys()))
+        came_online = presence.connect(uid, request.sid)
+        join_room(user_room(uid))
+        region = db_helper.get_user_region(uid)
+        if region and region != "Unknown":
+            join_room(region_room(region))
+        # full list once for this socket (only people it may see), then
+        # debounced deltas to the rooms that can see each change
+        emit("online_list", _visible_online_ids(uid), room=request.sid)
+        if came_online:
+            broadcaster.changed(uid, True)
 
     @socketio.on("disconnect")
     def on_disconnect():
-        dead = None
-        for uid, sid in list(online_users.items()):
-            if sid == request.sid:
-                dead = uid
-                break
-        if dead is not None:
-            online_users.pop(dead, None)
-            socketio.emit("online_list", list(online_users.keys()))
+        gone = presence.disconnect(request.sid)
+        if gone is not None:
+            broadcaster.changed(gone, False)
 
     @socketio.on("dm_join")
     def dm_join(data):
@@ -53,23 +85,16 @@ def init_messaging(socketio):
 
         # mark messages from other -> me as READ when I open chat
         try:
-            unread_ids = db_helper.get_unread_ids(other, me)
-            if unread_ids:
+            unread = db_helper.get_unread_count(me, other)
+            if unread:
                 db_helper.mark_read_for_chat(other, me)
-            # Notify the sender of ALL their messages that are now read
-            # (includes previously-read ones so old grey ticks on sender's screen update)
-            conn = db_helper.get_connection()
-            try:
-                all_read_ids = [r["id"] for r in conn.execute("""
-                    SELECT id FROM messages
-                    WHERE sender_id=? AND receiver_id=?
-                    AND region_name IS NULL AND read_at IS NOT NULL
-                """, (other, me)).fetchall()]
-            finally:
-                conn.close()
-            if all_read_ids:
-                emit("dm_read", {"ids": all_read_ids}, room=dm_room(me, other))
-            if unread_ids:
+            # Tell the sender how far I've read. dm_read is always
+            # {reader_id, upto}: every message of theirs with id <= upto
+            # gets read ticks (covers older ones too, one number)
+            upto = db_helper.get_read_upto(me, other)
+            if upto:
+                emit("dm_read", {"reader_id": me, "upto": upto}, room=dm_room(me, other))
+            if unread:
                 # Clear my own badge for this sender
                 emit("badge_update", {"from_id": other, "count": 0}, room=request.sid)
         except Exception:
@@ -82,17 +107,42 @@ def init_messaging(socketio):
             return
         me = int(session["user_id"])
         sender_id = int((data or {}).get("sender_id") or 0)
-        msg_id = (data or {}).get("msg_id")
+        msg_id = int((data or {}).get("msg_id") or 0)
         if not sender_id or not msg_id:
             return
         try:
             ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            db_helper.mark_read_for_chat(sender_id, me, ts)
-            emit("dm_read", {"ids": [msg_id]}, room=dm_room(me, sender_id))
+            # written by the receipt writer in a few ms, batched with others
+            db_helper.receipts.read(sender_id, me, msg_id, ts)
+            emit("dm_read", {"reader_id": me, "upto": msg_id}, room=dm_room(me, sender_id))
             emit("badge_update", {"from_id": sender_id, "count": 0}, room=request.sid)
         except Exception:
             pass
 
+    @socketio.on("dm_load_older")
+    def dm_load_older(data):
+        """
+        Client scrolled to the top of a DM: send the page before `before_id`
+        (the oldest message it has) back to this socket only.
+        """
+        if "user_id" not in session:
+            return
+        me = int(session["user_id"])
+        other = int((data or {}).get("other_id") or 0)
+        before_id = int((data or {}).get("before_id") or 0)
+        if not other or not before_id:
+            return
+        try:
+            msgs = db_helper.get_chat_history(me, other, before_id=before_id, limit=CHAT_PAGE_SIZE)
+        except Exception:
+            msgs = []
+        emit("dm_older_messages", {
+            "other_id": other,
+            "before_id": before_id,
+            "messages": _with_media_urls(msgs),
+            "has_more": len(msgs) == CHAT_PAGE_SIZE,
+        }, room=request.sid)
+
     @socketio.on("dm_send_message")
     def dm_send_message(data):
         if "user_id" not in session:
@@ -145,27 +195,25 @@ def init_messaging(socketio):
             "read_at": None,
             "_tempKey": temp_key
         }
+        _with_media_urls([payload])
 
         emit("dm_receive_message", payload, room=dm_room(sender_id, receiver_id))
 
         # ✅ delivered if receiver online
-        if receiver_id in online_users:
+        if presence.is_online(receiver_id):
             try:
-                db_helper.mark_delivered(msg_id, ts)
+                db_helper.receipts.delivered(msg_id, ts)
                 emit("dm_delivered", {"id": msg_id, "delivered_at": ts}, room=dm_room(sender_id, receiver_id))
             except Exception:
                 pass
 
         # 🔔 push badge count update to the receiver so their sidebar updates live
         try:
-            receiver_sid = online_users.get(receiver_id)
-            if receiver_sid:
-                # count unread from this sender for the receiver
-                unread_ids = db_helper.get_unread_ids(sender_id, receiver_id)
+            if presence.is_online(receiver_id):
                 socketio.emit("badge_update", {
                     "from_id": sender_id,
-                    "count": len(unread_ids)
-                }, to=receiver_sid)
+                    "count": db_helper.get_unread_count(receiver_id, sender_id)
+                }, to=user_room(receiver_id))
         except Exception:
             pass
 
@@ -184,6 +232,15 @@ ALLOWED_IMG = {"png", "jpg", "jpeg", "webp", "gif"}
 ALLOWED_AUDIO = {"mp3", "wav", "m4a", "ogg", "webm"}
 
 
+def _with_media_urls(msgs):
+    """Chat images are shown at card size: add media_url (the variant once it exists)."""
+    for m in msgs:
+        path = m.get("media_path") or ""
+        if path.startswith("uploads/"):
+            m["media_url"] = upload_url(path[len("uploads/"):], "card")
+    return msgs
+
+
 def _ext_ok(filename, allowed):
     if not filename or "." not in filename:
         return False
@@ -220,38 +277,16 @@ def _get_user_basic(uid: int):
 
 
 def _get_people_for_sidebar(me_id: int, my_role: str):
-    conn = db_helper.get_connection()
-    try:
-        rows = conn.execute("""
-            SELECT u.id, u.username, u.role,
-                   COALESCE(p.profile_pic, 'profile_pic.png') AS pfp,
-                   MAX(m.timestamp) AS last_msg
-            FROM users u
-            LEFT JOIN profiles p ON p.user_id = u.id
-            LEFT JOIN messages m
-                ON m.region_name IS NULL
-                AND (
-                    (m.sender_id = u.id   AND m.receiver_id = ?)
-                 OR (m.sender_id = ?     AND m.receiver_id = u.id)
-                )
-            WHERE u.id != ?
-            GROUP BY u.id
-            ORDER BY last_msg DESC, u.username ASC
-        """, (me_id, me_id, me_id)).fetchall()
-    finally:
-        conn.close()
-
-    people = []
-    my_role = (my_role or "").lower().strip()
-
-    for r in rows:
-        role = (r["role"] or "").lower().strip()
-        if my_role == "youth" and role == "senior":
-            people.append({"id": r["id"], "username": r["username"], "role": role, "pfp": r["pfp"]})
-        elif my_role == "senior" and role == "youth":
-            people.append({"id": r["id"], "username": r["username"], "role": role, "pfp": r["pfp"]})
-
-    return people
+    # youth chat with seniors and the other way round; nobody else has a sidebar
+    partner_role = {"youth": "senior", "senior": "youth"}.get((my_role or "").lower().strip())
+    if not partner_role:
+        return []
+
+    return [
+        {"id": r["id"], "username": r["username"], "role": partner_role, "pfp": r["pfp"],
+         "last_msg": r["last_msg"], "last_preview": r["last_preview"]}
+        for r in db_helper.get_dm_sidebar(me_id, partner_role)
+    ]
 
 
 @messaging_bp.route("/")
@@ -293,10 +328,10 @@ def chat(other_id):
         # active chat partner already marked read above
         p["unread"] = unread_counts.get(p["id"], 0) if p["id"] != other_id else 0
 
-    # Load conversation
+    # Load the newest page; older pages come over the socket (dm_load_older)
     messages = []
     try:
-        messages = db_helper.get_chat_history(uid, other_id)
+        messages = _with_media_urls(db_helper.get_chat_history(uid, other_id, limit=CHAT_PAGE_SIZE))
     except Exception:
         messages = []
 
@@ -307,6 +342,7 @@ def chat(other_id):
         current_user_id=uid,
         other_user=other,
         messages=messages,
+        has_older=len(messages) == CHAT_PAGE_SIZE,
         active_id=other_id,
     )
 
@@ -320,13 +356,16 @@ def upload_image():
     if not _ext_ok(f.filename, ALLOWED_IMG):
         return jsonify({"ok": False, "error": "Invalid image type"}), 400
 
-    filename = secure_filename(f.filename)
-    unique = f"{uuid.uuid4().hex}_{filename}"
-    save_path = os.path.join(UPLOAD_IMG_FOLDER, unique)
-    f.save(save_path)
-
-    rel = f"uploads/chat_images/{unique}"
-    return jsonify({"ok": True, "media_path": rel})
+    try:
+        # variants built now, so the card-size URL below is ready to send
+        name = save_upload(f, ALLOWED_IMG, wait_for_variants=True)
+    except UploadError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    # deduped blob (uploads.py); media_path stays relative to static/ and
+    # is what gets stored, media_url is the card variant to display
+    rel = f"uploads/{name}"
+    return jsonify({"ok": True, "media_path": rel, "media_url": upload_url(name, "card")})
 
 
 @messaging_bp.route("/upload/audio", methods=["POST"])
@@ -1,12 +1,18 @@
 import os
 import re
 import requests
-from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify, flash, Response
 from flask import request 
-from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 from database import db_helper
+from profanity import STRICT_BANNED, BannedWordsDictionary
+from moderation import (
+    moderation_queue, sightengine_text_check, sightengine_text_check_many, sightengine_image_check,
+    content_key, local_verdicts
+)
+from features.messaging import user_room
+from uploads import UploadError, stage_upload, commit_upload, save_upload, remove_upload, upload_path
 
 load_dotenv()
 
@@ -14,8 +20,6 @@ load_dotenv()
 # 0) CONFIG
 # ============================================================
 os.environ.setdefault("KMP_DUPLICATE_LIB_OK", "TRUE")
-SIGHTENGINE_USER = os.getenv("SIGHTENGINE_API_USER")
-SIGHTENGINE_SECRET = os.getenv("SIGHTENGINE_API_SECRET")
 
 story_bp = Blueprint("story", __name__, url_prefix="/story")
 UPLOAD_FOLDER = "static/uploads"
@@ -24,112 +28,23 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # ============================================================
 # 1) VALIDATION (SMARTER & SAFER)
 # ============================================================
-# 1. BANNED WORDS (Strict list)
-STRICT_BANNED = {
-    "fk", "fuk", "fck",
-    "fuck", "shit", "bitch", "asshole", "dick", "pussy", "cunt",
-    "nigger", "faggot",
-    "cb", "knn", "ccb", "kanina",
-    "ass", "sex", "porn", "bastard", "ccb", "knnn","kns", "ccbknn",
-    "stupid", "dumb"
-}
-
+# 1. BANNED WORDS (Strict list) - word lists + compiled matcher live in profanity.py
 #banned words
 BANNED_WORDS_FILE = os.getenv("BANNED_WORDS_FILE", "banned_words.txt")
+BANNED_WORDS_RELOAD_SECONDS = float(os.getenv("BANNED_WORDS_RELOAD_SECONDS", "2"))
 
-def load_banned_words_file(path: str):
-    """
-    Loads extra banned words from a txt file.
-    - Ignores empty lines and lines starting with #.
-    - Returns a set of lowercase words.
-    """
-    out = set()
-    try:
-        if not path or not os.path.exists(path):
-            return out
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                w = (line or "").strip().lower()
-                if not w or w.startswith("#"):
-                    continue
-                out.add(w)
-    except Exception as e:
-        print("⚠️ banned words file load error:", e)
-    return out
-
-# merge words into STRICT_BANNED
-STRICT_BANNED |= load_banned_words_file(BANNED_WORDS_FILE)
+# STRICT_BANNED + the txt file, rebuilt in the background whenever the file
+# changes (no restart needed). Always read BANNED_WORDS.matcher per call.
+BANNED_WORDS = BannedWordsDictionary(
+    BANNED_WORDS_FILE, STRICT_BANNED, check_interval=BANNED_WORDS_RELOAD_SECONDS
+)
 
 # 2. KEYBOARD SMASH PATTERNS (The "Random String" Logic)
 SMASH_PATTERNS = ["qwerty", "asdfgh", "zxcvbn", "poiuy", "mnbvc", "123456", "hjkl"]
 
-# --- EXTRA PROFANITY / HARASSMENT DETECTION (handles obfuscation like fking, f*ck, fucckk) ---
-LEET_MAP = str.maketrans({
-    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t",
-    "@": "a", "$": "s"
-})
-
-BAD_PHRASE_PATTERNS = [
-    r"\bgo\s+and\s+die\b",
-    r"\bkill\s+yourself\b",
-    r"\bkys\b",
-    r"\bgo\s+die\b",
-]
-
-BAD_ROOTS = {
-    "fuck", "shit", "bitch", "asshole", "dick", "pussy", "cunt",
-    "nigger", "faggot",
-    "kanina", "knn", "ccb", "cb",
-    "porn", "sex" , "fucking", "fking", "fk" , 
-}
-
-def _tokenize_normalized(text: str):
-    """Lowercase, leetspeak normalize, remove non-alnum, return tokens."""
-    if not text:
-        return []
-    lowered = text.lower().translate(LEET_MAP)
-    tokens = re.split(r"[^a-z0-9]+", lowered)
-    return [t for t in tokens if t]
-
 def contains_bad_content(text: str) -> bool:
     """Catches profanities/harassment even when obfuscated."""
-    if not text:
-        return False
-
-    low = text.lower()
-
-    # 1) Harmful phrases
-    for pat in BAD_PHRASE_PATTERNS:
-        if re.search(pat, low):
-            return True
-
-    # 2) Token-based detection
-    toks = _tokenize_normalized(text)
-
-    for t in toks:
-        # allow 'ass' only as standalone
-        if t == "ass":
-            return True
-
-        if t in BAD_ROOTS:
-            return True
-
-        # common obfuscations: fking/fkng/fck/fuk/fucckk/fuuuck
-        if re.fullmatch(r"f+u*c+k+(i+n+g+)?", t):
-            return True
-        if re.fullmatch(r"f+k+(i+n+g+)?", t):
-            return True
-        if re.fullmatch(r"sh+i+t+", t):
-            return True
-        if re.fullmatch(r"bi+t+ch+", t):
-            return True
-
-        # containment (e.g., 'fuuuckyou')
-        for root in BAD_ROOTS:
-            if root in t and len(t) <= 30:
-                return True
-
-    return False
+    return BANNED_WORDS.matcher.contains_bad_content(text)
 
 def looks_like_gibberish(text: str) -> bool:
     """
@@ -164,16 +79,18 @@ def contains_bad_word(text: str) -> bool:
     Checks for whole words only. 
     'Assignment' -> Safe. 'You are an ass' -> Caught.
     """
-    
-    tokens = re.split(r'[^a-zA-Z0-9]+', text.lower())
-    
-    for t in tokens:
-        if t in STRICT_BANNED:
-            return True
-    return False
+    return BANNED_WORDS.matcher.contains_bad_word(text)
 
 def check_local_validation(text: str, min_len: int):
+    """
+    Cached per (dictionary version, min_len, stripped text) - live validation
+    re-sends the same text on every keystroke and again on publish.
+    """
     if not text or not text.strip(): return "Required."
+    key = content_key(f"local:{BANNED_WORDS.current().version}:{min_len}", text.strip())
+    return local_verdicts.get_or_compute(key, lambda: _check_local_validation(text, min_len))
+
+def _check_local_validation(text: str, min_len: int):
     if len(text.strip()) < min_len: return f"Too short (min {min_len} chars)."
     
     if contains_bad_word(text) or contains_bad_content(text):
@@ -184,69 +101,166 @@ def check_local_validation(text: str, min_len: int):
         
     return None
 
+MODERATE_BATCH_MAX_FIELDS = 10
+
+def moderate_many(fields, remote=True):
+    """
+    Moderate several fields together.
+    fields: {name: (text, min_len)}
+    Local checks run per field (cached); every field that passes goes to
+    Sightengine in ONE combined call. Returns, in the same order:
+      {name: {"ok": True, "status": "approved"}}
+      {name: {"ok": False, "status": "warning" | "rejected", "msg": "..."}}
+    """
+    results = dict.fromkeys(fields)
+    passed = []
+    for name, (text, min_len) in fields.items():
+        err = check_local_validation(text, min_len=min_len)
+        if err:
+            status = "warning" if "Warning:" in err else "rejected"
+            results[name] = {"ok": False, "status": status, "msg": err}
+        else:
+            passed.append(name)
+
+    if remote and passed:
+        verdicts = sightengine_text_check_many([fields[n][0] for n in passed])
+    else:
+        verdicts = ["approved"] * len(passed)
+
+    for name, verdict in zip(passed, verdicts):
+        if verdict == "rejected":
+            results[name] = {"ok": False, "status": "rejected", "msg": "Explicit content detected, please change."}
+        else:
+            results[name] = {"ok": True, "status": "approved"}
+    return results
+
 # ============================================================
-# 2) SIGHTENGINE API (FAIL-OPEN FOR DEMO)
+# 2) SIGHTENGINE API - see moderation.py
 # ============================================================
-def sightengine_text_check(text: str) -> str:
-    # If keys missing → pending (NOT approved)
-    if not SIGHTENGINE_USER or not SIGHTENGINE_SECRET:
-        print("⚠️ No API Keys -> Pending Admin Review")
-        return "pending"
+# Remote checks run on the moderation queue, off the request path. Each job
+# flips the content's status and tells the author on their socket room.
+# One policy for stories and comments: 'rejected' hides it, 'approved' or
+# 'unchecked' (no API keys) publishes it, 'pending' (no answer after the
+# retries) leaves it for an admin. Reports go to the admins either way, so
+# only a rejected reason stops one.
+
+def init_moderation(socketio):
+    """Send moderation results to the author's personal room (user_<id>)."""
+    moderation_queue.notifier = lambda uid, event, payload: socketio.emit(event, payload, to=user_room(uid))
+
+
+def _moderate_story(story_id, uid, title, content, img_name, draft_id=None):
+    # title + content in one API call
+    statuses = moderation_queue.call(sightengine_text_check_many, [title, content], fallback=["pending", "pending"])
+    if "rejected" in statuses:
+        db_helper.set_story_moderation(story_id, "rejected")
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "story", "id": story_id, "status": "rejected",
+            "msg": "Explicit content detected, please change."
+        })
+        return
+    # photo rejected -> story stays up, text only (3 water instead of 5)
+    water = 3
+    clear_image = False
+    image_status = None
+    if img_name and "pending" not in statuses:
+        image_status = moderation_queue.call(sightengine_image_check, upload_path(img_name))
+        if image_status == "rejected":
+            clear_image = True
+        else:
+            water = 5
+
+    if "pending" in statuses or image_status == "pending":
+        # Sightengine kept failing: leave it for the admin queue, the water
+        # is paid when an admin approves it (pay_story_water)
+        db_helper.hold_story_water(story_id, 5 if img_name else 3)
+        _forget_draft(draft_id, uid)
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "story", "id": story_id, "status": "pending",
+            "msg": "Your story is waiting for an admin to review it. You'll get your water once it's approved."
+        })
+        return
+
+    db_helper.set_story_moderation(story_id, "approved", clear_image=clear_image)
+    if clear_image:
+        # rejected: gone from the blob store even if someone else uploaded it too
+        remove_upload(img_name, force=True)
 
+    db_helper.add_water_reward(uid, water)
+    # ✅ Log water earned (shows in Water History)
     try:
-        r = requests.post(
-            "https://api.sightengine.com/1.0/text/check.json",
-            data={
-                "text": text,
-                "lang": "en",
-                "mode": "standard",
-                "api_user": SIGHTENGINE_USER,
-                "api_secret": SIGHTENGINE_SECRET
-            },
-            timeout=3
+        db_helper.log_garden_history(
+            user_id=uid,
+            category="water",
+            title=f'Earned water from story "{title}" (+{water} water)',
+            amount=int(water)
         )
-        data = r.json()
+    except Exception:
+        pass
 
-        # If API returns failure/quota/etc → pending (NOT approved)
-        if data.get("status") == "failure":
-            print(f"⚠️ API failure ({data.get('error')}) -> Pending Admin Review")
-            return "pending"
+    _forget_draft(draft_id, uid)
 
-        # Reject if clearly bad
-        if data.get("sexual", 0) > 0.8 or data.get("hate", 0) > 0.8 or data.get("profanity", 0) > 0.9:
-            return "rejected"
+    moderation_queue.notify(uid, "moderation_result", {
+        "kind": "story", "id": story_id, "status": "approved",
+        "water": water, "image_removed": clear_image
+    })
 
-        return "approved"
 
+def _forget_draft(draft_id, uid):
+    """The draft a story was published from, deleted once the story is in."""
+    if not draft_id:
+        return
+    try:
+        draft = db_helper.get_draft_by_id(int(draft_id))
+        if db_helper.delete_draft(int(draft_id), uid) and draft:
+            remove_upload(draft["image_path"])
     except Exception as e:
-        # Timeout/connection error → pending (NOT approved)
-        print(f"⚠️ Text API exception -> Pending Admin Review: {e}")
-        return "pending"
+        print("Draft delete failed:", e)
 
-def sightengine_image_check(path: str) -> str:
-    if not SIGHTENGINE_USER or not SIGHTENGINE_SECRET:
-        return "approved" 
-    try:
-        with open(path, "rb") as f:
-            r = requests.post(
-                "https://api.sightengine.com/1.0/check.json",
-                files={"media": f},
-                data={ "models": "nudity,wad", "api_user": SIGHTENGINE_USER, "api_secret": SIGHTENGINE_SECRET },
-                timeout=5
-            )
-        data = r.json()
-        
-        if data.get("status") == "failure": return "approved"
-        
-        nudity = data.get("nudity", {})
-        if (float(nudity.get("raw", 0)) > 0.6 or 
-            float(nudity.get("partial", 0)) > 0.7 or 
-            float(nudity.get("sexual_activity", 0)) > 0.6):
-            return "rejected"
-            
-        return "approved"
-    except:
-        return "approved"
+
+def _moderate_comment(comment_id, uid, content):
+    verdict = moderation_queue.call(sightengine_text_check, content)
+    if verdict == "pending":
+        # no answer from Sightengine: stays 'pending' for the admin dashboard
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "comment", "id": comment_id, "status": "pending",
+            "msg": "Your comment is waiting for an admin to review it."
+        })
+        return
+    status = "rejected" if verdict == "rejected" else "approved"
+    row = db_helper.set_comment_status(comment_id, status)
+    if row:
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "comment", "id": comment_id, "story_id": row["story_id"], "status": status
+        })
+
+
+def _moderate_story_report(story_id, uid, reason):
+    # the report only counts (and hides the story) once its reason passes
+    if moderation_queue.call(sightengine_text_check, reason) == "rejected":
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "story_report", "id": story_id, "status": "rejected",
+            "msg": "Please keep the report reason professional."
+        })
+        return
+    ok = db_helper.report_story(story_id, uid, reason)
+    moderation_queue.notify(uid, "moderation_result", {
+        "kind": "story_report", "id": story_id, "status": "approved" if ok else "failed"
+    })
+
+
+def _moderate_comment_report(comment_id, uid, reason):
+    if moderation_queue.call(sightengine_text_check, reason) == "rejected":
+        moderation_queue.notify(uid, "moderation_result", {
+            "kind": "comment_report", "id": comment_id, "status": "rejected",
+            "msg": "Please keep the report reason professional."
+        })
+        return
+    result = db_helper.report_comment(comment_id, uid, reason)
+    ok = result[0] if isinstance(result, tuple) else bool(result)
+    moderation_queue.notify(uid, "moderation_result", {
+        "kind": "comment_report", "id": comment_id, "status": "approved" if ok else "failed"
+    })
 
 # sightengine api
 @story_bp.route("/api/moderate-text", methods=["POST"])
@@ -279,6 +293,33 @@ def api_moderate_text():
 
     return jsonify({"ok": True, "status": "approved"})
 
+@story_bp.route("/api/moderate-batch", methods=["POST"])
+def api_moderate_batch():
+    """
+    Live validation for several fields in one request.
+    Body: { fields: { title: {text, min_len}, content: {text, min_len}, ... } }
+    Returns { ok, fields: { name: {ok, status, msg?} } } - ok is True only
+    when every field passed. One Sightengine call covers all fields.
+    """
+    data = request.get_json(silent=True) or {}
+    raw = data.get("fields") or {}
+    if not isinstance(raw, dict) or not raw:
+        return jsonify({"ok": False, "msg": "No fields."}), 400
+    if len(raw) > MODERATE_BATCH_MAX_FIELDS:
+        return jsonify({"ok": False, "msg": "Too many fields."}), 400
+
+    fields = {}
+    for name, spec in raw.items():
+        spec = spec if isinstance(spec, dict) else {"text": spec}
+        try:
+            min_len = int(spec.get("min_len") or 2)
+        except (TypeError, ValueError):
+            min_len = 2
+        fields[str(name)] = ((str(spec.get("text") or "")).strip(), min_len)
+
+    results = moderate_many(fields)
+    return jsonify({"ok": all(r["ok"] for r in results.values()), "fields": results})
+
 # ============================================================
 # 3) ROUTES
 # ============================================================
@@ -296,38 +337,49 @@ def index():
     except Exception:
         role = "youth"
 
-    stories = db_helper.get_stories_for_pov(role, uid)
-    stories = sorted(stories, key=lambda s: s.get("id", 0), reverse=True)
+    # first page only; the rest streams in through /api/feed (infinite scroll)
+    stories, next_cursor = db_helper.get_story_feed_page(role, uid)
+
+    return render_template(
+        "story/index.html",
+        stories=stories,
+        next_cursor=next_cursor,
+        success=success,
+        water=water
+    )
+
+
+@story_bp.route("/api/feed")
+def api_feed():
+    """
+    A page of the feed, filtered and sorted on the server.
+    GET /story/api/feed?cursor=<next_cursor>&search=<text>&topic=<topic>&sort=newest|oldest|popular
+    No cursor = first page (the page reloads the list when a filter changes).
+    Returns { ok, html, count, next_cursor } - html is the rendered story cards.
+    """
+    uid = session.get("user_id", 1)
+    me = db_helper.get_user_by_id(uid)
 
-   
-    conn = db_helper.get_connection()
     try:
-      
-        liked_rows = conn.execute(
-            "SELECT story_id FROM story_likes WHERE user_id = ?",
-            (uid,)
-        ).fetchall()
-        liked_ids = {row["story_id"] if hasattr(row, "keys") else row[0] for row in liked_rows}
-
-        count_rows = conn.execute(
-            "SELECT story_id, COUNT(*) AS c FROM story_likes GROUP BY story_id"
-        ).fetchall()
-        like_map = {}
-        for r in count_rows:
-            story_id = r["story_id"] if hasattr(r, "keys") else r[0]
-            c = r["c"] if hasattr(r, "keys") else r[1]
-            like_map[story_id] = c
-    finally:
-        conn.close()
+        role = (me["role"] or "youth").lower()
+    except Exception:
+        role = "youth"
+
+    search = (request.args.get("search") or "").strip()[:100]
+    topic = (request.args.get("topic") or "").strip()
+    sort = request.args.get("sort") or "newest"
+    cursor = request.args.get("cursor") or request.args.get("before_id") or None
 
-    for s in stories:
-        sid = s.get("id")
-        s["user_liked"] = sid in liked_ids
-        s["like_count"] = int(like_map.get(sid, 0))   
-        if s.get("comment_count") is None:
-            s["comment_count"] = 0
+    try:
+        limit = int(request.args.get("limit") or 0) or None
+        stories, next_cursor = db_helper.get_story_feed_page(
+            role, uid, cursor=cursor, limit=limit, search=search, topic=topic, sort=sort
+        )
+    except ValueError:
+        return jsonify({"ok": False, "msg": "Bad cursor."}), 400
 
-    return render_template("story/index.html", stories=stories, success=success, water=water)
+    html = "".join(render_template("story/_story_card.html", story=s) for s in stories)
+    return jsonify({"ok": True, "html": html, "count": len(stories), "next_cursor": next_cursor})
 
 
 @story_bp.route("/manage")
@@ -350,11 +402,12 @@ def api_check_image():
     file = request.files.get("photo")
     if not file: return jsonify({"safe": False})
     
-    tmp = os.path.join(UPLOAD_FOLDER, f"__tmp_{os.urandom(4).hex()}")
-    file.save(tmp)
-    status = sightengine_image_check(tmp)
-    try: os.remove(tmp)
-    except: pass
+    try:
+        staged = stage_upload(file)
+    except UploadError as e:
+        return jsonify({"safe": False, "msg": str(e)})
+    status = sightengine_image_check(staged.tmp_path)
+    staged.discard()
     
     return jsonify({"safe": status != "rejected"})
 
@@ -397,12 +450,10 @@ def create():
 
             
             img_name = existing["image_path"] if existing else None
+            removed_image = None
 
             if remove_image and img_name:
-                try:
-                    os.remove(os.path.join(UPLOAD_FOLDER, img_name))
-                except:
-                    pass
+                removed_image = img_name  # deleted once the draft no longer points at it
                 img_name = None
 
             photo = request.files.get("photo")
@@ -416,21 +467,17 @@ def create():
                         draft_id=draft_id
                     )
 
-                tmp = os.path.join(UPLOAD_FOLDER, f"__tmp_{os.urandom(4).hex()}")
-                photo.save(tmp)
+                try:
+                    staged = stage_upload(photo)
+                except UploadError as e:
+                    return render_template("story/create.html", errors={"photo": str(e)}, form_data=request.form, draft_id=draft_id)
 
-                img_status = sightengine_image_check(tmp)
+                img_status = sightengine_image_check(staged.tmp_path)
 
-                if img_status == "approved":
-                  
-                    img_name = f"{os.urandom(4).hex()}_{secure_filename(photo.filename)}"
-                    os.rename(tmp, os.path.join(UPLOAD_FOLDER, img_name))
+                if img_status != "rejected":
+                    img_name = commit_upload(staged)
                 else:
-        
-                    try:
-                        os.remove(tmp)
-                    except:
-                        pass
+                    staged.discard()
                     flash("⚠️ Photo was not approved, so it was not saved with your draft.", "warning")
 
 
@@ -445,6 +492,7 @@ def create():
                 )
             else:
                 db_helper.create_draft(uid, title, content, topic, img_name)
+            remove_upload(removed_image)
 
             return redirect(url_for("story.manage", tab="drafts"))
 
@@ -454,11 +502,11 @@ def create():
 
         errors = {}
 
-        e = check_local_validation(title, 5)
-        if e: errors["title"] = e
-
-        e = check_local_validation(content, 20)
-        if e: errors["content"] = e
+        # local checks only - the remote check runs on the moderation queue
+        checked = moderate_many({"title": (title, 5), "content": (content, 20)}, remote=False)
+        for name, res in checked.items():
+            if not res["ok"]:
+                errors[name] = res["msg"]
 
         if not topic:
             errors["topic"] = "Choose a topic."
@@ -466,67 +514,34 @@ def create():
         if errors:
             return render_template("story/create.html", errors=errors, form_data=request.form)
 
-        # 2. Text AI Check
-        t_status = sightengine_text_check(title)
-        c_status = sightengine_text_check(content)
-
-        if "rejected" in (t_status, c_status):
-            errors["content"] = "Explicit content detected, please change."
-            return render_template("story/create.html", errors=errors, form_data=request.form)
-        final_status = "approved"
-
-        # 3. Image Logic
+        # 2. Image: saved now, checked by the moderation queue with the text
         img_name = None
-        water = 3 
         photo = request.files.get("photo")
-        remove_image = request.form.get("remove_image") == "1"
-
-        tmp = None
 
         if photo and photo.filename:
-            tmp = os.path.join(UPLOAD_FOLDER, f"__tmp_{os.urandom(4).hex()}")
-            photo.save(tmp)
-            img_status = sightengine_image_check(tmp)
-
-            if img_status == "rejected":
-                try: os.remove(tmp)
-                except: pass
-                img_name = None
-                water = 3 # Text only
-            else:
-                img_name = f"{os.urandom(4).hex()}_{secure_filename(photo.filename)}"
-                os.rename(tmp, os.path.join(UPLOAD_FOLDER, img_name))
-                water = 5 
+            try:
+                img_name = save_upload(photo)
+            except UploadError as e:
+                return render_template("story/create.html", errors={"photo": str(e)}, form_data=request.form)
 
-        # 4. Save
-        me = db_helper.get_user_by_id(session.get("user_id", 1))
+        # 3. Save as pending - hidden from the feed until the queue approves it
+        uid = session.get("user_id", 1)
+        me = db_helper.get_user_by_id(uid)
         role_visibility = (me["role"] or "Youth").lower()
 
-        db_helper.create_story(
-            session.get("user_id", 1), title, content, topic, role_visibility, img_name, final_status
+        story_id = db_helper.create_story(
+            uid, title, content, topic, role_visibility, img_name, "pending"
         )
 
-        # 5. Success
-        db_helper.add_water_reward(session.get("user_id", 1), water)
-        # ✅ Log water earned (shows in Water History)
-        try:
-            db_helper.log_garden_history(
-                user_id=session.get("user_id", 1),
-                category="water",
-                title=f'Earned water from story "{title}" (+{water} water)',
-                amount=int(water)
-            )
-        except Exception:
-            pass
-        
-        draft_id = request.form.get("draft_id")
-        if draft_id:
-            try:
-                db_helper.delete_draft(int(draft_id), session.get("user_id", 1))
-            except Exception as e:
-                print("Draft delete failed:", e)
+        # 4. Sightengine text + image checks, water reward and draft cleanup
+        #    happen in the background (_moderate_story)
+        moderation_queue.submit(
+            _moderate_story, story_id, uid, title, content, img_name, request.form.get("draft_id")
+        )
 
-        return redirect(url_for("story.index", success="True", water=water))
+        # water shown is what they'll get if the photo passes too
+        water = 5 if img_name else 3
+        return redirect(url_for("story.index", success="pending", water=water))
 
 
     return render_template("story/create.html", errors={}, form_data={})
@@ -552,23 +567,18 @@ def view_story(story_id):
         flash("You can only view stories from the other generation.", "danger")
         return redirect(url_for("story.index"))
 
-    comments = db_helper.get_story_comments(story_id)
+    comments = db_helper.get_story_comments(story_id, uid)
 
 
+    # like_count comes with the story row (stories.like_count)
     conn = db_helper.get_connection()
     try:
-        row = conn.execute(
-            "SELECT COUNT(*) AS c FROM story_likes WHERE story_id = ?",
-            (story_id,)
-        ).fetchone()
-        like_count = row["c"] if hasattr(row, "keys") else row[0]
-
         existing = conn.execute(
             "SELECT 1 FROM story_likes WHERE story_id = ? AND user_id = ?",
             (story_id, uid)
         ).fetchone()
 
-        story["like_count"] = int(like_count)
+        story["like_count"] = int(story.get("like_count") or 0)
         story["user_liked"] = bool(existing)
     finally:
         conn.close()
@@ -629,13 +639,25 @@ def delete_draft(draft_id):
     if not reason:
         return jsonify({"ok": False, "msg": "Reason is required."})
 
+    draft = db_helper.get_draft_by_id(draft_id)
     ok = db_helper.delete_draft(draft_id, uid)
+    if draft:
+        remove_upload(draft["image_path"])  # only goes if nothing else uses it
     return jsonify({"ok": bool(ok)})
 
 
 @story_bp.route("/api/banned-words")
 def api_banned_words():
-    return jsonify({"words": sorted(list(STRICT_BANNED))})
+    """
+    The live banned-word list for client-side checks. The JSON body is built
+    once per dictionary version; clients revalidate with If-None-Match and
+    get a 304 while the list is unchanged.
+    """
+    snap = BANNED_WORDS.current()
+    resp = Response(snap.payload, mimetype="application/json")
+    resp.set_etag(snap.etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
 # ============================================================
 # DELETE ROUTES
@@ -649,7 +671,8 @@ def delete_story(story_id):
 
 
     if story and story['user_id'] == uid:
-        db_helper.delete_story(story_id)
+        if db_helper.delete_story(story_id):
+            remove_upload(story["image_path"])
         flash("Story deleted successfully.", "success")
     else:
         flash("You cannot delete this story.", "danger")
@@ -672,67 +695,22 @@ def report_story(story_id):
         return jsonify({"ok": False, "msg": local_error})
 
    
-    ai_status = sightengine_text_check(reason)
-    if ai_status == "rejected":
-        return jsonify({"ok": False, "msg": "Please keep the report reason professional."})
-
-   
-    success = db_helper.report_story(story_id, uid, reason)
+    # Sightengine check on the reason, then the report itself, in the background
+    moderation_queue.submit(_moderate_story_report, story_id, uid, reason)
     
-    return jsonify({"ok": success})
+    return jsonify({"ok": True, "queued": True})
 
 @story_bp.route("/like/<int:story_id>", methods=["POST"])
 def like_story(story_id):
     uid = session.get("user_id", 1)
-    conn = db_helper.get_connection()
-    try:
-     
-        existing = conn.execute("SELECT id FROM story_likes WHERE story_id = ? AND user_id = ?", (story_id, uid)).fetchone()
-        
-        if existing:
-            
-            conn.execute("DELETE FROM story_likes WHERE story_id = ? AND user_id = ?", (story_id, uid))
-        else:
-            
-            conn.execute("INSERT INTO story_likes (story_id, user_id) VALUES (?, ?)", (story_id, uid))
-            
-        conn.commit()
-    finally:
-        conn.close()
+    db_helper.toggle_like(story_id, uid)
     return redirect(url_for('story.index'))
 
 @story_bp.route("/<int:story_id>/like-toggle", methods=["POST"])
 def like_toggle(story_id):
     uid = session.get("user_id", 1)
-    conn = db_helper.get_connection()
     try:
-        existing = conn.execute(
-            "SELECT id FROM story_likes WHERE story_id = ? AND user_id = ?",
-            (story_id, uid)
-        ).fetchone()
-
-        if existing:
-            conn.execute(
-                "DELETE FROM story_likes WHERE story_id = ? AND user_id = ?",
-                (story_id, uid)
-            )
-            liked_now = False
-        else:
-            conn.execute(
-                "INSERT INTO story_likes (story_id, user_id) VALUES (?, ?)",
-                (story_id, uid)
-            )
-            liked_now = True
-
-        conn.commit()
-
-        
-        row = conn.execute(
-            "SELECT COUNT(*) AS c FROM story_likes WHERE story_id = ?",
-            (story_id,)
-        ).fetchone()
-
-        like_count = row["c"] if isinstance(row, dict) else row[0]
+        liked_now, like_count = db_helper.toggle_like(story_id, uid)
 
         return jsonify({
             "ok": True,
@@ -742,8 +720,6 @@ def like_toggle(story_id):
     except Exception as e:
         print("like-toggle error:", e)
         return jsonify({"ok": False}), 500
-    finally:
-        conn.close()
 
 
 @story_bp.route("/profile/<int:user_id>")
@@ -775,14 +751,6 @@ def add_comment(story_id):
         flash(err, "danger")
         return redirect(url_for("story.view_story", story_id=story_id))
 
-    # 2) Sightengine AI check
-    if sightengine_text_check(content) == "rejected":
-        msg = "Explicit content detected, please change."
-        if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-            return jsonify({"ok": False, "msg": msg})
-        flash(msg, "danger")
-        return redirect(url_for("story.view_story", story_id=story_id))
-
     # 3) Anti-double-submit guard (optional but good)
     conn = db_helper.get_connection()
     try:
@@ -802,10 +770,14 @@ def add_comment(story_id):
     finally:
         conn.close()
 
-    db_helper.add_comment(story_id, uid, content)
+    # 2) Sightengine AI check runs in the background; the comment shows
+    #    to everyone once it's approved (to the author straight away)
+    comment_id = db_helper.add_comment(story_id, uid, content, status="pending")
+    if comment_id:
+        moderation_queue.submit(_moderate_comment, comment_id, uid, content)
 
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return jsonify({"ok": True})
+        return jsonify({"ok": True, "pending": True, "comment_id": comment_id})
 
     return redirect(url_for("story.view_story", story_id=story_id))
 
@@ -833,17 +805,10 @@ def report_comment(comment_id):
     if err:
         return jsonify({"ok": False, "msg": err})
 
-    if sightengine_text_check(reason) == "rejected":
-        return jsonify({"ok": False, "msg": "Please keep the report reason professional."})
-
-    result = db_helper.report_comment(comment_id, uid, reason)
-
-    if isinstance(result, tuple):
-        ok, msg = result
-    else:
-        ok, msg = bool(result), ("Reported." if result else "Failed to report.")
+    # Sightengine check on the reason, then the report itself, in the background
+    moderation_queue.submit(_moderate_comment_report, comment_id, uid, reason)
 
-    return jsonify({"ok": ok, "msg": msg})
+    return jsonify({"ok": True, "queued": True, "msg": "Reported."})
 
 
 @story_bp.route("/comment/delete/<int:comment_id>", methods=["POST"])
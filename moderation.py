@@ -0,0 +1,355 @@
+"""
+Sightengine checks + the background moderation queue.
+
+Publishing a story, posting a comment or filing a report no longer waits on
+Sightengine: the route runs the (cheap) local checks, stores the content as
+'pending' and submits a job here. Worker threads run the remote checks with
+retries, flip the status and tell the author over their socket room.
+
+Verdicts: 'approved' / 'rejected' from Sightengine; 'unchecked' when no
+API keys are configured (the local checks are all there is, content goes
+live); 'pending' when Sightengine gave no answer after every retry (the
+content waits for an admin).
+
+SIGHTENGINE_API_URL can point at a local stub server for testing, and
+MODERATION_WORKERS=0 runs every job inline (no threads).
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SIGHTENGINE_USER = os.getenv("SIGHTENGINE_API_USER")
+SIGHTENGINE_SECRET = os.getenv("SIGHTENGINE_API_SECRET")
+SIGHTENGINE_API_URL = os.getenv("SIGHTENGINE_API_URL", "https://api.sightengine.com/1.0").rstrip("/")
+
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", "4"))
+MODERATION_MAX_ATTEMPTS = int(os.getenv("MODERATION_MAX_ATTEMPTS", "3"))
+MODERATION_RETRY_BACKOFF = float(os.getenv("MODERATION_RETRY_BACKOFF", "1.0"))
+
+# verdict cache: in-process LRU, plus the moderation_cache table for remote verdicts
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "4096"))
+MODERATION_CACHE_TTL = float(os.getenv("MODERATION_CACHE_TTL", str(24 * 3600)))
+MODERATION_CACHE_DB = os.getenv("MODERATION_CACHE_DB", "1") == "1"
+
+
+class ModerationRetry(Exception):
+    """The remote check could not give an answer (timeout, 5xx, quota) - try again."""
+
+
+# ============================================================
+# VERDICT CACHE
+# ============================================================
+def normalize_text(text):
+    """Collapse whitespace + lowercase, so re-sent copies of a text share one key."""
+    return " ".join((text or "").split()).lower()
+
+
+def content_key(namespace, text):
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+
+class VerdictCache:
+    """
+    Bounded LRU + TTL cache of moderation verdicts, keyed by content hash.
+    `store` is an optional second tier (anything with get_cached_verdict /
+    put_cached_verdict, i.e. DatabaseHelper) shared by every worker process
+    and kept across restarts. Verdicts may be None ("no problem").
+    """
+
+    def __init__(self, max_entries=MODERATION_CACHE_SIZE, ttl=MODERATION_CACHE_TTL, store=None):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.store = store
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, verdict)
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(found, verdict)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+
+        if self.store is not None:
+            try:
+                row = self.store.get_cached_verdict(key, now)
+            except Exception as e:
+                print("⚠️ verdict cache store read error:", e)
+                row = None
+            if row is not None:
+                verdict, expires_at = row
+                self._remember(key, verdict, expires_at)
+                with self._lock:
+                    self.store_hits += 1
+                return True, verdict
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, verdict):
+        expires_at = time.time() + self.ttl
+        self._remember(key, verdict, expires_at)
+        if self.store is not None:
+            try:
+                self.store.put_cached_verdict(key, verdict, expires_at)
+            except Exception as e:
+                print("⚠️ verdict cache store write error:", e)
+
+    def _remember(self, key, verdict, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        found, verdict = self.get(key)
+        if found:
+            return verdict
+        verdict = compute()
+        self.put(key, verdict)
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# ============================================================
+# SIGHTENGINE API
+# ============================================================
+def sightengine_configured():
+    return bool(SIGHTENGINE_USER and SIGHTENGINE_SECRET)
+
+
+def sightengine_text_check(text: str, raise_errors=False) -> str:
+    """
+    Sightengine text verdict, cached by normalized text. Only definite
+    answers are cached; 'pending' (API trouble) is asked again.
+    'unchecked' without API keys.
+    """
+    if not sightengine_configured():
+        return "unchecked"
+
+    key = content_key("sightengine-text", normalize_text(text))
+    found, verdict = remote_verdicts.get(key)
+    if found:
+        return verdict
+
+    verdict = _sightengine_text_request(text, raise_errors)
+    if verdict in ("approved", "rejected"):
+        remote_verdicts.put(key, verdict)
+    return verdict
+
+
+def sightengine_text_check_many(texts, raise_errors=False):
+    """
+    One Sightengine call for several texts (joined by blank lines). Only if
+    that combined text is rejected are the texts checked one by one, to find
+    which one it was. Returns a verdict per text, in order.
+    """
+    texts = list(texts)
+    if len(texts) <= 1:
+        return [sightengine_text_check(t, raise_errors) for t in texts]
+    combined = sightengine_text_check("\n\n".join(texts), raise_errors)
+    if combined != "rejected":
+        return [combined] * len(texts)
+    return [sightengine_text_check(t, raise_errors) for t in texts]
+
+
+def _sightengine_text_request(text, raise_errors=False):
+    try:
+        r = requests.post(
+            f"{SIGHTENGINE_API_URL}/text/check.json",
+            data={
+                "text": text,
+                "lang": "en",
+                "mode": "standard",
+                "api_user": SIGHTENGINE_USER,
+                "api_secret": SIGHTENGINE_SECRET
+            },
+            timeout=3
+        )
+        data = r.json()
+
+        # If API returns failure/quota/etc → pending (NOT approved)
+        if data.get("status") == "failure":
+            print(f"⚠️ API failure ({data.get('error')}) -> Pending Admin Review")
+            if raise_errors:
+                raise ModerationRetry(f"text check failure: {data.get('error')}")
+            return "pending"
+
+        # Reject if clearly bad
+        if data.get("sexual", 0) > 0.8 or data.get("hate", 0) > 0.8 or data.get("profanity", 0) > 0.9:
+            return "rejected"
+
+        return "approved"
+
+    except ModerationRetry:
+        raise
+    except Exception as e:
+        # Timeout/connection error → pending (NOT approved)
+        if raise_errors:
+            raise ModerationRetry(f"text check error: {e}") from e
+        print(f"⚠️ Text API exception -> Pending Admin Review: {e}")
+        return "pending"
+
+
+def sightengine_image_check(path: str, raise_errors=False) -> str:
+    if not sightengine_configured():
+        return "unchecked"
+    try:
+        with open(path, "rb") as f:
+            r = requests.post(
+                f"{SIGHTENGINE_API_URL}/check.json",
+                files={"media": f},
+                data={ "models": "nudity,wad", "api_user": SIGHTENGINE_USER, "api_secret": SIGHTENGINE_SECRET },
+                timeout=5
+            )
+        data = r.json()
+
+        if data.get("status") == "failure":
+            if raise_errors:
+                raise ModerationRetry(f"image check failure: {data.get('error')}")
+            return "pending"
+
+        nudity = data.get("nudity", {})
+        if (float(nudity.get("raw", 0)) > 0.6 or
+            float(nudity.get("partial", 0)) > 0.7 or
+            float(nudity.get("sexual_activity", 0)) > 0.6):
+            return "rejected"
+
+        return "approved"
+    except ModerationRetry:
+        raise
+    except Exception as e:
+        if raise_errors:
+            raise ModerationRetry(f"image check error: {e}") from e
+        return "pending"
+
+
+# ============================================================
+# QUEUE
+# ============================================================
+class ModerationQueue:
+    """
+    Thread pool for moderation jobs. A job is any callable; inside it, wrap
+    each remote check in `queue.call(...)` to get retries with backoff.
+    `notifier(user_id, event, payload)` is set by init_moderation() once the
+    socket server exists; until then notifications are dropped.
+    """
+
+    def __init__(self, workers=MODERATION_WORKERS, max_attempts=MODERATION_MAX_ATTEMPTS,
+                 backoff=MODERATION_RETRY_BACKOFF):
+        self.workers = int(workers)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff = float(backoff)
+        self.notifier = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+
+    def _get_executor(self):
+        with self._lock:
+            # a forked worker can't use the parent's threads
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="moderation")
+                self._pending = set()
+            return self._executor
+
+    def submit(self, job, *args, **kwargs):
+        if self.workers <= 0:
+            self._run(job, args, kwargs)
+            return None
+        fut = self._get_executor().submit(self._run, job, args, kwargs)
+        with self._lock:
+            self._pending.add(fut)
+        fut.add_done_callback(self._forget)
+        return fut
+
+    def _forget(self, fut):
+        with self._lock:
+            self._pending.discard(fut)
+
+    def _run(self, job, args, kwargs):
+        try:
+            job(*args, **kwargs)
+        except Exception as e:
+            print(f"❌ Moderation job {getattr(job, '__name__', job)} failed: {e}")
+
+    def call(self, check, *args, fallback="pending"):
+        """
+        Run check(*args, raise_errors=True), retrying ModerationRetry with
+        exponential backoff. After the last attempt returns `fallback`
+        ('pending' - Sightengine gave no verdict, leave it for an admin).
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return check(*args, raise_errors=True)
+            except ModerationRetry as e:
+                if attempt == self.max_attempts:
+                    print(f"⚠️ {check.__name__} gave up after {attempt} attempts: {e}")
+                    return fallback
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+
+    def notify(self, user_id, event, payload):
+        if self.notifier is None or not user_id:
+            return
+        try:
+            self.notifier(int(user_id), event, payload)
+        except Exception as e:
+            print("⚠️ moderation notify error:", e)
+
+    def wait(self, timeout=None):
+        """Block until every submitted job has finished (tests / shutdown)."""
+        with self._lock:
+            pending = list(self._pending)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for fut in pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            fut.exception(timeout=remaining)
+
+
+moderation_queue = ModerationQueue()
+
+
+def _cache_store():
+    if not MODERATION_CACHE_DB:
+        return None
+    from database import db_helper
+    return db_helper
+
+
+# remote (paid) verdicts go through SQLite too; local ones are cheap enough for memory only
+remote_verdicts = VerdictCache(store=_cache_store())
+local_verdicts = VerdictCache()
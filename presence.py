@@ -0,0 +1,233 @@
+"""
+Who is online, for the messaging sidebar and delivery ticks.
+
+PresenceRegistry keeps uid -> {sids} and sid -> uid, so a second tab is a
+second session (closing one tab doesn't take you offline) and a disconnect
+is a dict lookup, not a scan. connect()/disconnect() say whether the user
+actually came online / went offline, so only those changes get broadcast.
+
+Backends:
+- MemoryPresenceBackend (default) - one process.
+- SQLitePresenceBackend - PRESENCE_BACKEND=sqlite, for several workers on
+  one machine. Sessions are rows in presence_sessions tagged with the
+  worker; every worker heartbeats presence_workers, and sessions of a
+  worker that stopped heartbeating (crashed) don't count as online.
+  Broadcasting between workers still needs a socketio message_queue.
+
+PresenceBroadcaster sends the changes, debounced, only to the rooms that
+can see that user (their DM partners and their region's community room).
+"""
+import os
+import socket
+import threading
+import time
+
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", "memory").lower()
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "15"))
+PRESENCE_DEBOUNCE_SECONDS = float(os.getenv("PRESENCE_DEBOUNCE_MS", "500")) / 1000.0
+
+
+class MemoryPresenceBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sids_by_uid = {}
+        self._uid_by_sid = {}
+
+    def add(self, uid, sid):
+        """Returns True if this is the user's first session."""
+        with self._lock:
+            old = self._uid_by_sid.get(sid)
+            if old is not None and old != uid:
+                self._drop(sid)
+            self._uid_by_sid[sid] = uid
+            sids = self._sids_by_uid.setdefault(uid, set())
+            first = not sids
+            sids.add(sid)
+            return first
+
+    def remove(self, sid):
+        """(uid, was_last_session); (None, False) for an unknown sid."""
+        with self._lock:
+            return self._drop(sid)
+
+    def _drop(self, sid):
+        uid = self._uid_by_sid.pop(sid, None)
+        if uid is None:
+            return None, False
+        sids = self._sids_by_uid.get(uid)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_uid[uid]
+                return uid, True
+        return uid, False
+
+    def is_online(self, uid):
+        return uid in self._sids_by_uid
+
+    def sids(self, uid):
+        with self._lock:
+            return set(self._sids_by_uid.get(uid, ()))
+
+    def online_ids(self):
+        with self._lock:
+            return list(self._sids_by_uid)
+
+
+class SQLitePresenceBackend:
+    """Shared between worker processes through the app database (see module docstring)."""
+
+    def __init__(self, db, heartbeat=PRESENCE_HEARTBEAT_SECONDS):
+        self.db = db
+        self.heartbeat = float(heartbeat)
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._pid = None
+        self._thread = None
+
+    def _alive_after(self):
+        return time.time() - 3 * self.heartbeat
+
+    def _ensure_worker(self):
+        """Register this process (again, after a fork) and start its heartbeat."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.worker = f"{socket.gethostname()}:{self._pid}"
+        self.db.presence_register_worker(self.worker, time.time())
+        self._thread = threading.Thread(target=self._beat, name="presence-heartbeat", daemon=True)
+        self._thread.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                now = time.time()
+                # rows of workers gone for an hour are deleted, not just ignored
+                self.db.presence_heartbeat(self.worker, now, now - 3600)
+            except Exception as e:
+                print("⚠️ presence heartbeat failed:", e)
+
+    def add(self, uid, sid):
+        self._ensure_worker()
+        return self.db.presence_add(self.worker, uid, sid, self._alive_after())
+
+    def remove(self, sid):
+        self._ensure_worker()
+        return self.db.presence_remove(self.worker, sid, self._alive_after())
+
+    def is_online(self, uid):
+        self._ensure_worker()
+        return self.db.presence_is_online(uid, self._alive_after())
+
+    def sids(self, uid):
+        self._ensure_worker()
+        return set(self.db.presence_sids(uid, self._alive_after()))
+
+    def online_ids(self):
+        self._ensure_worker()
+        return self.db.presence_online_ids(self._alive_after())
+
+
+class PresenceRegistry:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def connect(self, uid, sid):
+        """Returns True when the user just came online (their first session)."""
+        return self.backend.add(int(uid), sid)
+
+    def disconnect(self, sid):
+        """Returns the uid if that was their last session (they went offline), else None."""
+        uid, last = self.backend.remove(sid)
+        return uid if last else None
+
+    def is_online(self, uid):
+        return self.backend.is_online(int(uid))
+
+    def sids(self, uid):
+        return self.backend.sids(int(uid))
+
+    def online_ids(self):
+        return self.backend.online_ids()
+
+
+class PresenceBroadcaster:
+    """
+    Collects online/offline changes and sends one presence_delta
+    {"online": [...], "offline": [...]} per room every `debounce` seconds.
+    Someone who drops and comes back inside the window (a reconnect storm
+    after a deploy) produces no message at all.
+
+    rooms_for(uid) -> the rooms allowed to see uid
+    emit(room, payload) -> sends the delta
+    debounce <= 0 sends every change straight away.
+    """
+
+    def __init__(self, rooms_for, emit, debounce=PRESENCE_DEBOUNCE_SECONDS):
+        self.rooms_for = rooms_for
+        self.emit = emit
+        self.debounce = float(debounce)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}  # uid -> (online before this window, online now)
+        self._thread = None
+        self._pid = None
+
+    def changed(self, uid, online):
+        with self._lock:
+            before = self._pending.get(uid, (not online, None))[0]
+            self._pending[uid] = (before, bool(online))
+        if self.debounce <= 0:
+            self.flush()
+            return
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="presence-broadcast", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.debounce)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        deltas = {}
+        for uid, (before, now) in pending.items():
+            if before == now:
+                continue  # flapped back within the window
+            try:
+                rooms = self.rooms_for(uid)
+            except Exception as e:
+                print("⚠️ presence audience lookup failed:", e)
+                continue
+            for room in rooms:
+                delta = deltas.setdefault(room, {"online": [], "offline": []})
+                delta["online" if now else "offline"].append(uid)
+        for room, delta in deltas.items():
+            try:
+                self.emit(room, delta)
+            except Exception as e:
+                print("⚠️ presence emit failed:", e)
+        return len(deltas)
+
+
+def make_backend(name=PRESENCE_BACKEND):
+    if name == "sqlite":
+        from database import db_helper
+        return SQLitePresenceBackend(db_helper)
+    if name != "memory":
+        print(f"⚠️ Unknown PRESENCE_BACKEND '{name}', using memory")
+    return MemoryPresenceBackend()
+
+
+presence = PresenceRegistry(make_backend())
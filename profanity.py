@@ -0,0 +1,293 @@
+"""
+Profanity matching for stories, comments and reports.
+
+The word lists live here and ProfanityMatcher compiles them once:
+- whole-word banned list  -> one trie regex over whole tokens
+- harmful phrases         -> one combined regex
+- obfuscation patterns    -> one combined regex over whole tokens
+- BAD_ROOTS containment   -> one trie regex, then a check of the token it hit
+
+Each check is a single scan of the text inside re, no matter how many words
+are banned - no per-token Python loop. Verdicts are the same as the old
+per-token loops in features/story.py (benchmarks/bench_profanity.py checks).
+
+BannedWordsDictionary keeps a matcher per version of banned_words.txt and
+swaps in a new one when the file changes.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+# ============================================================
+# WORD LISTS
+# ============================================================
+# 1. BANNED WORDS (Strict list) - whole words only
+STRICT_BANNED = {
+    "fk", "fuk", "fck",
+    "fuck", "shit", "bitch", "asshole", "dick", "pussy", "cunt",
+    "nigger", "faggot",
+    "cb", "knn", "ccb", "kanina",
+    "ass", "sex", "porn", "bastard", "ccb", "knnn","kns", "ccbknn",
+    "stupid", "dumb"
+}
+
+# --- EXTRA PROFANITY / HARASSMENT DETECTION (handles obfuscation like fking, f*ck, fucckk) ---
+LEET_MAP = str.maketrans({
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t",
+    "@": "a", "$": "s"
+})
+
+BAD_PHRASE_PATTERNS = [
+    r"\bgo\s+and\s+die\b",
+    r"\bkill\s+yourself\b",
+    r"\bkys\b",
+    r"\bgo\s+die\b",
+]
+
+BAD_ROOTS = {
+    "fuck", "shit", "bitch", "asshole", "dick", "pussy", "cunt",
+    "nigger", "faggot",
+    "kanina", "knn", "ccb", "cb",
+    "porn", "sex" , "fucking", "fking", "fk" ,
+}
+
+# whole-token obfuscations: fking/fkng/fck/fuk/fucckk/fuuuck
+# ('ass' is only bad as a standalone word, so it lives here and not in BAD_ROOTS)
+OBFUSCATION_PATTERNS = [
+    r"ass",
+    r"f+u*c+k+(?:i+n+g+)?",
+    r"f+k+(?:i+n+g+)?",
+    r"sh+i+t+",
+    r"bi+t+ch+",
+]
+
+# a root only counts inside tokens up to this long ('fuuuckyou' yes, a 40-char smash no)
+MAX_ROOT_TOKEN_LEN = 30
+
+TOKEN_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789")
+_SEPARATOR_RE = re.compile(r"[^a-z0-9]")
+
+
+def load_banned_words_file(path: str):
+    """
+    Loads extra banned words from a txt file.
+    - Ignores empty lines and lines starting with #.
+    - Returns a set of lowercase words.
+    """
+    out = set()
+    try:
+        if not path or not os.path.exists(path):
+            return out
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                w = (line or "").strip().lower()
+                if not w or w.startswith("#"):
+                    continue
+                out.add(w)
+    except Exception as e:
+        print("⚠️ banned words file load error:", e)
+    return out
+
+
+# ============================================================
+# TRIE -> REGEX
+# ============================================================
+def build_trie_pattern(words, shortest=False):
+    """
+    Fold words into a trie and emit it as one regex, e.g.
+    {"fk", "fuck", "fucking"} -> f(?:k|uck(?:ing)?)
+    Each position costs one walk down the trie (in C, inside re) instead of
+    one try per word. shortest=True stops at the first word end, which is all
+    a "does it contain any of these" check needs.
+    Returns None for an empty word list.
+    """
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def walk(node):
+        if "" in node and shortest:
+            return ""
+        alts = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return walk(trie) if trie else None
+
+
+def _token_words(words):
+    """Only [a-z0-9] words can ever equal / sit inside a token."""
+    return {w for w in words if w and set(w) <= TOKEN_CHARS}
+
+
+# ============================================================
+# MATCHER
+# ============================================================
+class ProfanityMatcher:
+    """Compiled once from the word lists; safe to share between threads."""
+
+    def __init__(self, strict_words, roots=BAD_ROOTS, phrase_patterns=BAD_PHRASE_PATTERNS,
+                 obfuscation_patterns=OBFUSCATION_PATTERNS, max_root_token_len=MAX_ROOT_TOKEN_LEN):
+        self.strict_words = frozenset(strict_words)
+        self.roots = frozenset(roots)
+        self.max_root_token_len = max_root_token_len
+
+        # whole token (bounded by non [a-z0-9] or the ends) equal to a banned word
+        words = build_trie_pattern(_token_words(self.strict_words))
+        self._word_re = re.compile(rf"(?<![a-z0-9])(?:{words})(?![a-z0-9])") if words else None
+        self._phrase_re = re.compile("|".join(f"(?:{p})" for p in phrase_patterns))
+        # whole token matching one obfuscation pattern
+        self._obfuscation_re = re.compile(
+            r"(?<![a-z0-9])(?:" + "|".join(f"(?:{p})" for p in obfuscation_patterns) + r")(?![a-z0-9])"
+        )
+        # any root anywhere; _has_root() checks the token it landed in
+        roots = build_trie_pattern(_token_words(self.roots), shortest=True)
+        self._root_re = re.compile(roots) if roots else None
+
+    def contains_bad_word(self, text: str) -> bool:
+        """
+        Checks for whole words only.
+        'Assignment' -> Safe. 'You are an ass' -> Caught.
+        """
+        if not text or self._word_re is None:
+            return False
+        return self._word_re.search(text.lower()) is not None
+
+    def contains_bad_content(self, text: str) -> bool:
+        """Catches profanities/harassment even when obfuscated."""
+        if not text:
+            return False
+
+        low = text.lower()
+
+        # 1) Harmful phrases
+        if self._phrase_re.search(low):
+            return True
+
+        # 2) Token-based detection on the leetspeak-normalized text
+        norm = low.translate(LEET_MAP)
+        if self._obfuscation_re.search(norm):
+            return True
+        return self._has_root(norm)
+
+    def _has_root(self, norm: str) -> bool:
+        """
+        Is any BAD_ROOTS word inside a token of at most max_root_token_len
+        chars (or exactly equal to a longer token)? Roots are [a-z0-9] only,
+        so a match never spans two tokens. After a hit in a too-long token
+        the search resumes past that token, so each token is looked at once.
+        """
+        if self._root_re is None:
+            return False
+        pos = 0
+        while True:
+            m = self._root_re.search(norm, pos)
+            if m is None:
+                return False
+            start, end = m.start(), m.end()
+            while start and norm[start - 1] in TOKEN_CHARS:
+                start -= 1
+            sep = _SEPARATOR_RE.search(norm, end)
+            end = sep.start() if sep else len(norm)
+            if end - start <= self.max_root_token_len or norm[start:end] in self.roots:
+                return True
+            pos = end
+
+
+# ============================================================
+# HOT-RELOADING DICTIONARY
+# ============================================================
+class DictionarySnapshot:
+    """One immutable version of the banned-word list + everything built from it."""
+
+    def __init__(self, version, mtime, words, matcher):
+        self.version = version
+        self.mtime = mtime
+        self.words = frozenset(words)
+        self.matcher = matcher
+        # /api/banned-words body, built once per version
+        self.payload = json.dumps({"words": sorted(self.words)}).encode("utf-8")
+        self.etag = hashlib.sha1(self.payload).hexdigest()
+
+
+class BannedWordsDictionary:
+    """
+    The banned-word list with banned_words.txt merged in, reloaded when the
+    file changes. A daemon thread polls the file's mtime every
+    `check_interval` seconds and builds the new matcher off the request path;
+    requests just read `self.snapshot`, which is swapped in one assignment,
+    so a request always sees a whole old or a whole new version.
+    """
+
+    def __init__(self, path, base_words=STRICT_BANNED, check_interval=2.0, **matcher_kwargs):
+        self.path = path
+        self.base_words = frozenset(base_words)
+        self.check_interval = float(check_interval)
+        self.matcher_kwargs = matcher_kwargs
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.snapshot = self._build(version=1, mtime=self._mtime())
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def _build(self, version, mtime):
+        words = self.base_words | load_banned_words_file(self.path)
+        return DictionarySnapshot(version, mtime, words, ProfanityMatcher(words, **self.matcher_kwargs))
+
+    def reload_if_changed(self):
+        """Rebuild + swap when the file's mtime moved. Returns True if it reloaded."""
+        mtime = self._mtime()
+        if mtime == self.snapshot.mtime:
+            return False
+        with self._reload_lock:
+            current = self.snapshot
+            if mtime == current.mtime:
+                return False
+            try:
+                self.snapshot = self._build(current.version + 1, mtime)
+            except Exception as e:
+                # keep serving the old list rather than an empty one
+                print("⚠️ banned words reload failed:", e)
+                return False
+        print(f"🔄 Banned words reloaded (v{self.snapshot.version}, {len(self.snapshot.words)} words)")
+        return True
+
+    def start(self):
+        if self.check_interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="banned-words-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def current(self):
+        """The live snapshot; (re)starts the watcher after a fork."""
+        if self._pid != os.getpid():
+            self.start()
+        return self.snapshot
+
+    @property
+    def matcher(self):
+        return self.current().matcher
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.reload_if_changed()
@@ -0,0 +1,68 @@
+"""
+Shared pytest setup.
+
+The app modules read their config from the environment when they are
+imported (database.db_helper is created at import time), so it is set
+here first: DB_PATH points at a throwaway file and the 'test' storage
+profile has no checkpoint thread.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="legacygarden-tests-")
+os.environ["DB_PATH"] = os.path.join(_TMP, "app.db")
+os.environ["DB_STORAGE_PROFILE"] = "test"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def helper(tmp_path):
+    """A DatabaseHelper on its own fresh, fully migrated database file."""
+    from database import DatabaseHelper
+    h = DatabaseHelper(db_path=str(tmp_path / "test.db"), storage_profile="test")
+    yield h
+    h.pool.close_all()
+
+
+def add_user(conn, username, role="youth", region="North"):
+    """Insert a user + profile the way signup does. Returns the user id."""
+    uid = conn.execute(
+        "INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, "x", role)
+    ).lastrowid
+    conn.execute("INSERT INTO profiles (user_id, name, region) VALUES (?, ?, ?)", (uid, username, region))
+    return uid
+
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "baseline_schema.sql")
+
+
+def make_baseline_db(path, duplicate_likes=False):
+    """
+    A database as the pre-migration app left it, with a little data.
+    duplicate_likes: story_likes as databases older than its UNIQUE
+    constraint have it, holding a repeated like.
+    """
+    with open(BASELINE_SCHEMA, encoding="utf-8") as f:
+        schema = f.read()
+    if duplicate_likes:
+        schema = schema.replace(",\n                UNIQUE(story_id, user_id)", "")
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    conn.executemany("INSERT INTO users (id, username, password, role) VALUES (?, ?, ?, ?)",
+                     [(1, "ana", "x", "youth"), (2, "ben", "x", "senior")])
+    conn.executemany("INSERT INTO profiles (user_id, name, region) VALUES (?, ?, ?)",
+                     [(1, "Ana", "North"), (2, "Ben", "North")])
+    conn.execute("INSERT INTO stories (id, user_id, title, content, status) VALUES (1, 1, 't', 'c', 'approved')")
+    likes = [(1, 2), (1, 1)] + ([(1, 2)] if duplicate_likes else [])
+    conn.executemany("INSERT INTO story_likes (story_id, user_id) VALUES (?, ?)", likes)
+    conn.execute("INSERT INTO story_comments (story_id, user_id, content) VALUES (1, 2, 'nice')")
+    conn.execute("INSERT INTO messages (sender_id, receiver_id, message_text) VALUES (1, 2, 'hi')")
+    conn.commit()
+    conn.close()
@@ -0,0 +1,217 @@
+-- Schema of a legacygarden.db created by the app before versioned migrations
+-- (the baseline DatabaseHelper.init_database). Used to test upgrades.
+
+CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password TEXT,
+                role TEXT,
+                points INTEGER DEFAULT 0
+            );
+
+CREATE TABLE story_drafts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                title TEXT,
+                content TEXT,
+                topic TEXT,
+                image_path TEXT,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                name TEXT,
+                region TEXT,
+                email TEXT,
+                bio TEXT, profile_pic TEXT, show_email INTEGER DEFAULT 1, show_region INTEGER DEFAULT 1, community_visible INTEGER DEFAULT 1, notify_messages INTEGER DEFAULT 1, notify_updates INTEGER DEFAULT 1, notify_events INTEGER DEFAULT 1, notify_comm INTEGER DEFAULT 1, notify_inapp INTEGER DEFAULT 1, guidelines_accepted INTEGER DEFAULT 0, guidelines_accepted_at TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE stories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT,
+                content TEXT,
+                topic TEXT,
+                role_visibility TEXT,
+                image_path TEXT,
+                status TEXT DEFAULT 'approved',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE story_likes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                story_id INTEGER,
+                user_id INTEGER,
+                FOREIGN KEY(story_id) REFERENCES stories(id),
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                UNIQUE(story_id, user_id)
+            );
+
+CREATE TABLE story_comments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                story_id INTEGER,
+                user_id INTEGER,
+                content TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(story_id) REFERENCES stories(id),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE inventory_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,              -- 'seed_tree' | 'seed_flower' | 'water' | 'points'
+    delta INTEGER NOT NULL,          -- +10, -5, etc
+    source TEXT NOT NULL,            -- 'Watered plant', 'Harvested tree', 'Streak reward', etc
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+);
+
+CREATE TABLE comment_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                comment_id INTEGER NOT NULL,
+                reporter_user_id INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+
+CREATE TABLE reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                story_id INTEGER,
+                user_id INTEGER,
+                reason TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(story_id) REFERENCES stories(id),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE user_inventory (
+                user_id INTEGER PRIMARY KEY,
+                seed_tree INTEGER DEFAULT 3,
+                seed_flower INTEGER DEFAULT 3,
+                water INTEGER DEFAULT 10,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE plots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                plot_number INTEGER NOT NULL,
+                plant_type TEXT,
+                growth_stage INTEGER DEFAULT 0,
+                last_watered_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE rewards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                cost INTEGER NOT NULL,
+                image_filename TEXT NOT NULL
+            );
+
+CREATE TABLE user_rewards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                reward_id INTEGER,
+                redeemed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                used_at TIMESTAMP,
+                qr_code_filename TEXT,
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                FOREIGN KEY (reward_id) REFERENCES rewards(id)
+            );
+
+CREATE TABLE garden_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        category TEXT NOT NULL,      -- flower / tree / water / points
+        title TEXT NOT NULL,         -- human readable message
+        amount INTEGER DEFAULT 0,    -- + / - change (optional)
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+
+CREATE TABLE messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender_id INTEGER,
+                receiver_id INTEGER,
+                region_name TEXT, 
+                message_text TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, message_type TEXT DEFAULT 'text', media_path TEXT, audio_path TEXT, file_name TEXT, delivered_at TEXT, read_at TEXT,
+                FOREIGN KEY(sender_id) REFERENCES users(id)
+            );
+
+CREATE TABLE notices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                message TEXT,
+                region TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            , emoji TEXT);
+
+CREATE TABLE weekly_achievements (
+                week_start TEXT PRIMARY KEY,
+                most_active_region TEXT,
+                participation_region TEXT,
+                best_harvest_region TEXT,
+                generated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+
+CREATE TABLE community_tree_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            region TEXT,
+            action TEXT,              -- 'harvest_tree' or 'harvest_flower'
+            points INTEGER DEFAULT 0,  -- 10 tree, 5 flower
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+
+CREATE TABLE events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        short_description TEXT,
+        full_description TEXT,
+        registration_start TEXT,
+        registration_end TEXT,
+        event_date TEXT,
+        event_time TEXT,
+        venue TEXT,
+        image_filename TEXT,
+        status TEXT DEFAULT 'approved',
+        report_reason TEXT,
+        created_by INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(created_by) REFERENCES users(id)
+    );
+
+CREATE TABLE user_streaks (
+                user_id INTEGER PRIMARY KEY,
+                daily_game_streak INTEGER DEFAULT 0,
+                winning_streak INTEGER DEFAULT 0,
+                last_play_date TEXT,
+                seed_claimed INTEGER DEFAULT 0, week_start_date TEXT, last_reset_date TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            );
+
+CREATE TABLE game_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                player1_id INTEGER NOT NULL,
+                player2_id INTEGER NOT NULL,
+                game_type TEXT NOT NULL,
+                winner_id INTEGER,
+                played_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(player1_id) REFERENCES users(id),
+                FOREIGN KEY(player2_id) REFERENCES users(id),
+                FOREIGN KEY(winner_id) REFERENCES users(id)
+            );
+
+CREATE INDEX idx_garden_history_user_time
+        ON garden_history(user_id, created_at);
+
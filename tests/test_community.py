@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import add_user
+
+WEEK = "2026-10-12"
+
+
+@pytest.fixture
+def community(helper):
+    helper.community.ttl = 3600  # only invalidation can refresh it
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana", "youth", "North")
+    moved = helper.move_region_member(conn, None, None, "North", "youth")
+    conn.commit()
+    conn.close()
+    assert moved == ["North"]
+    return helper, ana
+
+
+def move(db, uid, old, new, role="youth"):
+    """What edit_profile does: update, bump region_stats, commit, invalidate."""
+    conn = db.get_connection()
+    conn.execute("UPDATE profiles SET region = ? WHERE user_id = ?", (new, uid))
+    moved = db.move_region_member(conn, old, role, new, role)
+    conn.commit()
+    conn.close()
+    for region in moved:
+        db.community.invalidate(region)
+    return moved
+
+
+def test_region_change_shows_up_in_both_snapshots(community):
+    db, ana = community
+    assert db.get_community_snapshot("North", WEEK).total_members == 1
+    assert db.get_community_snapshot("East", WEEK).total_members == 0  # both cached now
+
+    assert move(db, ana, "North", "East") == ["North", "East"]
+    assert db.get_community_snapshot("North", WEEK).total_members == 0
+    assert db.get_community_snapshot("East", WEEK).total_members == 1
+
+
+def test_no_move_touches_nothing(community):
+    db, ana = community
+    conn = db.get_connection()
+    assert db.move_region_member(conn, "North", "Youth", "North", "youth") == []
+    assert db.move_region_member(conn, "North", "youth", None, None) == ["North"]  # deleted account
+    conn.rollback()
+    conn.close()
@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import add_user
+
+
+@pytest.fixture
+def feed(helper):
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana", "youth")
+    ben = add_user(conn, "ben", "senior")
+    ids = []
+    for i in range(12):
+        topic = "School" if i % 3 == 0 else "Life Lessons"
+        title = f"story {i}" + (" about 100% effort" if i == 7 else "")
+        ids.append(conn.execute(
+            "INSERT INTO stories (user_id, title, content, topic, status, like_count) VALUES (?, ?, ?, ?, 'approved', ?)",
+            (ben, title, "Kampong garden" if i % 2 else "city life", topic, i % 4)
+        ).lastrowid)
+    conn.commit()
+    conn.close()
+    return helper, ana, ids
+
+
+def walk(db, uid, **filters):
+    """Every page of the feed, following next_cursor, as a list of ids."""
+    seen, cursor = [], None
+    while True:
+        page, cursor = db.get_story_feed_page("youth", uid, cursor=cursor, limit=5, **filters)
+        seen += [s["id"] for s in page]
+        if cursor is None:
+            return seen
+
+
+def test_sorts_page_through_everything_once(feed):
+    db, ana, ids = feed
+    assert walk(db, ana) == sorted(ids, reverse=True)
+    assert walk(db, ana, sort="oldest") == sorted(ids)
+
+    popular = walk(db, ana, sort="popular")
+    likes = {sid: i % 4 for i, sid in enumerate(ids)}
+    assert popular == sorted(ids, key=lambda sid: (likes[sid], sid), reverse=True)
+
+
+def test_search_and_topic_cover_stories_not_loaded_yet(feed):
+    db, ana, ids = feed
+    # the matches are spread over several pages of the unfiltered feed
+    assert walk(db, ana, topic="School") == [ids[i] for i in (9, 6, 3, 0)]
+    assert walk(db, ana, search="KAMPONG") == [ids[i] for i in range(11, 0, -2)]
+    assert walk(db, ana, search="kampong", topic="School", sort="oldest") == [ids[3], ids[9]]
+
+
+def test_search_treats_wildcards_literally(feed):
+    db, ana, ids = feed
+    assert walk(db, ana, search="100%") == [ids[7]]
+    assert walk(db, ana, search="_") == []
+
+
+def test_bad_popular_cursor_is_rejected(feed):
+    db, ana, _ = feed
+    with pytest.raises(ValueError):
+        db.get_story_feed_page("youth", ana, cursor="oops", sort="popular")
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+
+from conftest import add_user, make_baseline_db
+from database import DatabaseHelper
+
+
+def like_state(db, story_id):
+    conn = db.get_connection()
+    try:
+        rows = conn.execute(
+            "SELECT user_id, COUNT(*) AS n FROM story_likes WHERE story_id = ? GROUP BY user_id", (story_id,)
+        ).fetchall()
+        count = conn.execute("SELECT like_count FROM stories WHERE id = ?", (story_id,)).fetchone()[0]
+        return {r["user_id"]: r["n"] for r in rows}, count
+    finally:
+        conn.close()
+
+
+def test_toggle_like_likes_then_unlikes(helper):
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana")
+    conn.commit()
+    conn.close()
+    story_id = helper.create_story(ana, "t", "c", "life", "all", None)
+
+    assert helper.toggle_like(story_id, ana) == (True, 1)
+    assert helper.toggle_like(story_id, ana) == (False, 0)
+    assert like_state(helper, story_id) == ({}, 0)
+
+
+def test_concurrent_toggles_never_duplicate(helper):
+    conn = helper.get_connection()
+    users = [add_user(conn, f"u{i}") for i in range(6)]
+    conn.commit()
+    conn.close()
+    story_id = helper.create_story(users[0], "t", "c", "life", "all", None)
+
+    tabs, clicks = 3, 7  # 21 toggles per user: odd, so everyone ends up liking it
+    start = threading.Barrier(len(users) * tabs)
+    errors = []
+
+    def click(uid):
+        start.wait()
+        try:
+            for _ in range(clicks):
+                helper.toggle_like(story_id, uid)
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    # several tabs per user hammering the same button
+    threads = [threading.Thread(target=click, args=(uid,)) for uid in users for _ in range(tabs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    likes, count = like_state(helper, story_id)
+    assert likes == {uid: 1 for uid in users}
+    assert count == len(users)
+
+
+def test_migration_removes_duplicate_likes_and_fixes_counts(tmp_path):
+    path = str(tmp_path / "old.db")
+    make_baseline_db(path, duplicate_likes=True)
+    raw = sqlite3.connect(path)
+    assert raw.execute("SELECT COUNT(*) FROM story_likes WHERE story_id = 1 AND user_id = 2").fetchone()[0] == 2
+    raw.close()
+    db = DatabaseHelper(db_path=path, storage_profile="test")
+    try:
+        assert like_state(db, 1) == ({1: 1, 2: 1}, 2)
+        # and the unique index now guards it
+        assert db.toggle_like(1, 2) == (False, 1)
+        assert db.toggle_like(1, 2) == (True, 2)
+        assert like_state(db, 1) == ({1: 1, 2: 1}, 2)
+    finally:
+        db.pool.close_all()
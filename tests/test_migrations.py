@@ -0,0 +1,87 @@
+import pytest
+
+from conftest import make_baseline_db
+from database import LATEST_SCHEMA_VERSION, DatabaseHelper
+
+
+def schema_of(helper):
+    """{table: sorted columns}, {index: (table, columns, unique)} - ignores column order."""
+    conn = helper.get_connection()
+    try:
+        tables = {}
+        indexes = {}
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ):
+            cols = conn.execute(f"PRAGMA table_info({name})").fetchall()
+            tables[name] = sorted(
+                (c["name"], c["type"].upper(), c["notnull"], c["dflt_value"], c["pk"]) for c in cols
+            )
+            for idx in conn.execute(f"PRAGMA index_list({name})").fetchall():
+                if idx["origin"] == "pk":
+                    continue
+                cols = [r["name"] for r in conn.execute(f"PRAGMA index_xinfo({idx['name']})") if r["key"]]
+                key = idx["name"] if idx["origin"] == "c" else (name, "autoindex", tuple(cols))
+                indexes[key] = (name, tuple(cols), idx["unique"])
+        return tables, indexes
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def upgraded(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    make_baseline_db(path)
+    h = DatabaseHelper(db_path=path, storage_profile="test")
+    yield h
+    h.pool.close_all()
+
+
+def test_fresh_and_upgraded_databases_reach_the_same_schema(helper, upgraded):
+    assert helper.get_schema_version() == LATEST_SCHEMA_VERSION
+    assert upgraded.get_schema_version() == LATEST_SCHEMA_VERSION
+
+    fresh_tables, fresh_indexes = schema_of(helper)
+    old_tables, old_indexes = schema_of(upgraded)
+    assert old_tables.keys() == fresh_tables.keys()
+    for table in fresh_tables:
+        assert old_tables[table] == fresh_tables[table], table
+    assert old_indexes == fresh_indexes
+
+
+def test_upgrade_keeps_data_and_backfills_derived_tables(upgraded):
+    conn = upgraded.get_connection()
+    try:
+        story = conn.execute("SELECT like_count, comment_count FROM stories WHERE id = 1").fetchone()
+        assert tuple(story) == (2, 1)
+        assert conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0] == 1
+        assert conn.execute("SELECT total_members FROM region_stats WHERE region = 'North'").fetchone()[0] == 2
+        # the story and the comment count in North, this week, once each
+        assert tuple(conn.execute("SELECT activity_counted, activity_region FROM stories").fetchone()) == (1, "North")
+        assert tuple(conn.execute("SELECT activity_counted, activity_region FROM story_comments").fetchone()) == (1, "North")
+        assert tuple(conn.execute("SELECT actions, unique_users FROM region_week_activity").fetchone()) == (2, 2)
+    finally:
+        conn.close()
+
+
+def test_migrations_are_applied_once(upgraded):
+    path = upgraded.pool.db_path
+    again = DatabaseHelper(db_path=path, storage_profile="test")
+    try:
+        conn = again.get_connection()
+        versions = [r[0] for r in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+        conn.close()
+        assert versions == list(range(1, LATEST_SCHEMA_VERSION + 1))
+    finally:
+        again.pool.close_all()
+
+
+def test_warm_start_is_a_single_query(helper):
+    conn = helper.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    conn.close()  # back to the pool; this thread gets it again
+
+    helper.init_database()
+    conn.set_trace_callback(None)
+    assert statements == ["SELECT MAX(version) FROM schema_version"]
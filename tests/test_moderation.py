@@ -0,0 +1,224 @@
+"""
+The moderation queue against a stub Sightengine server (SIGHTENGINE_API_URL
+pointed at a local http.server), with jobs run on the real worker threads.
+"""
+import io
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import moderation
+import uploads
+from conftest import add_user
+from features import story
+
+PIL = pytest.importorskip("PIL.Image")
+
+BAD = "zzbadzz"  # text containing this is rejected by the stub
+
+
+class StubSightengine(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.endswith("/text/check.json"):
+            text = parse_qs(body.decode())["text"][0]
+            self.server.calls.append(("text", text))
+            status, payload = self.server.text(text)
+        else:
+            self.server.calls.append(("image", None))
+            status, payload = self.server.image()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if payload is not None else "text/html")
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode() if payload is not None else b"<h1>502 Bad Gateway</h1>")
+
+    def log_message(self, *args):
+        pass
+
+
+def text_verdict(text):
+    return 200, {"status": "success", "profanity": 0.95 if BAD in text else 0.0}
+
+
+def clean_image():
+    return 200, {"status": "success", "nudity": {"raw": 0.01, "partial": 0.01}}
+
+
+@pytest.fixture
+def sightengine(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSightengine)
+    server.calls = []
+    server.text = text_verdict
+    server.image = clean_image
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(moderation, "SIGHTENGINE_API_URL", f"http://127.0.0.1:{server.server_port}/1.0")
+    monkeypatch.setattr(moderation, "SIGHTENGINE_USER", "test-user")
+    monkeypatch.setattr(moderation, "SIGHTENGINE_SECRET", "test-secret")
+    monkeypatch.setattr(moderation.moderation_queue, "backoff", 0.0)
+    monkeypatch.setattr(moderation.moderation_queue, "max_attempts", 3)
+    monkeypatch.setattr(moderation.remote_verdicts, "store", None)
+    moderation.remote_verdicts.clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app_db(helper, tmp_path, monkeypatch):
+    """features.story and uploads.py on the test database and a temp upload dir."""
+    root = tmp_path / "uploads"
+    (root / uploads.BLOB_DIR).mkdir(parents=True)
+    monkeypatch.setattr(uploads, "UPLOAD_ROOT", str(root))
+    monkeypatch.setattr(uploads, "db_helper", helper)
+    monkeypatch.setattr(uploads.variant_worker, "workers", 0)
+    monkeypatch.setattr(story, "db_helper", helper)
+
+    notes = []
+    monkeypatch.setattr(moderation.moderation_queue, "notifier", lambda uid, event, payload: notes.append(payload))
+
+    conn = helper.get_connection()
+    uid = add_user(conn, "ana")
+    conn.commit()
+    conn.close()
+    return helper, uid, notes
+
+
+def publish(db, uid, title, content, image=None):
+    """
+    What the create route does: save as pending, then queue the checks.
+    Returns the story id and the water it earned.
+    """
+    before = water_of(db, uid)
+    story_id = db.create_story(uid, title, content, "life", "youth", image, "pending")
+    moderation.moderation_queue.submit(story._moderate_story, story_id, uid, title, content, image)
+    moderation.moderation_queue.wait(timeout=30)
+    return story_id, water_of(db, uid) - before
+
+
+def comment(db, story_id, uid, content):
+    """What the comment route does: save as pending, then queue the check."""
+    comment_id = db.add_comment(story_id, uid, content, status="pending")
+    moderation.moderation_queue.submit(story._moderate_comment, comment_id, uid, content)
+    moderation.moderation_queue.wait(timeout=30)
+    return comment_id
+
+
+def comment_status(db, comment_id):
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT status FROM story_comments WHERE id = ?", (comment_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def water_of(db, uid):
+    inv = db.get_user_inventory(uid)
+    return inv["water"] if inv else 0
+
+
+def photo():
+    buf = io.BytesIO()
+    PIL.new("RGB", (1200, 800), "orange").save(buf, "PNG")
+    buf.seek(0)
+    return uploads.save_upload(FileStorage(stream=buf, filename="photo.png"))
+
+
+def test_pending_story_is_approved_with_water(sightengine, app_db):
+    db, uid, notes = app_db
+    name = photo()
+    story_id, water = publish(db, uid, "My garden", "we grew chilli and pandan together", name)
+
+    s = db.get_story_by_id(story_id)
+    assert s["status"] == "approved"
+    assert s["image_path"] == name
+    assert water == 5
+    assert notes[-1]["status"] == "approved" and notes[-1]["water"] == 5
+    assert [kind for kind, _ in sightengine.calls] == ["text", "image"]  # title + content in one call
+
+
+def test_rejected_story_gets_no_water(sightengine, app_db):
+    db, uid, notes = app_db
+    story_id, water = publish(db, uid, "My garden", f"some {BAD} words")
+
+    assert db.get_story_by_id(story_id)["status"] == "rejected"
+    assert water == 0
+    assert notes[-1]["status"] == "rejected"
+
+
+def test_rejected_image_is_cleared_and_deleted(sightengine, app_db):
+    db, uid, notes = app_db
+    sightengine.image = lambda: (200, {"status": "success", "nudity": {"raw": 0.97}})
+    name = photo()
+    files = [uploads.upload_path(n) for n in [name, *db.get_upload_variants(uploads._sha_of(name)).values()]]
+    assert all(os.path.exists(f) for f in files)
+
+    story_id, water = publish(db, uid, "My garden", "we grew chilli and pandan together", name)
+
+    s = db.get_story_by_id(story_id)
+    assert s["status"] == "approved"
+    assert s["image_path"] is None
+    assert not any(os.path.exists(f) for f in files)
+    assert water == 3
+    assert notes[-1]["image_removed"] is True
+
+
+def test_server_errors_are_retried_then_left_pending(sightengine, app_db):
+    db, uid, notes = app_db
+    sightengine.text = lambda text: (502, None)
+    story_id, water = publish(db, uid, "My garden", "we grew chilli and pandan together")
+
+    assert [kind for kind, _ in sightengine.calls] == ["text"] * 3
+    assert db.get_story_by_id(story_id)["status"] == "pending"
+    assert water == 0
+    assert notes[-1]["status"] == "pending"
+
+    # the admin approves it: the promised water is paid, once
+    before = water_of(db, uid)
+    assert db.approve_story(story_id)
+    assert db.approve_story(story_id)
+    assert water_of(db, uid) - before == 3
+    assert db.get_story_by_id(story_id)["water_owed"] == 0
+
+
+def test_comment_is_left_for_an_admin_when_retries_run_out(sightengine, app_db):
+    db, uid, notes = app_db
+    story_id, _ = publish(db, uid, "My garden", "we grew chilli and pandan together")
+    sightengine.text = lambda text: (502, None)
+
+    comment_id = comment(db, story_id, uid, "lovely garden")
+
+    assert comment_status(db, comment_id) == "pending"
+    assert notes[-1] == {"kind": "comment", "id": comment_id, "status": "pending",
+                         "msg": "Your comment is waiting for an admin to review it."}
+
+
+def test_without_api_keys_local_checks_decide(sightengine, app_db, monkeypatch):
+    db, uid, notes = app_db
+    monkeypatch.setattr(moderation, "SIGHTENGINE_USER", None)
+    monkeypatch.setattr(moderation, "SIGHTENGINE_SECRET", None)
+    assert moderation.sightengine_text_check("hello") == "unchecked"
+
+    story_id, water = publish(db, uid, "My garden", "we grew chilli and pandan together", photo())
+    assert db.get_story_by_id(story_id)["status"] == "approved"
+    assert water == 5
+
+    comment_id = comment(db, story_id, uid, "lovely garden")
+    assert comment_status(db, comment_id) == "approved"
+    assert sightengine.calls == []
+
+
+def test_retry_recovers_after_one_failure(sightengine, app_db):
+    db, uid, _ = app_db
+    answers = iter([(503, None)])
+    sightengine.text = lambda text: next(answers, None) or text_verdict(text)
+    story_id, water = publish(db, uid, "My garden", "we grew chilli and pandan together")
+
+    assert len(sightengine.calls) == 2
+    assert db.get_story_by_id(story_id)["status"] == "approved"
+    assert water == 3
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+WEEK = "2026-10-12"
+
+
+@pytest.fixture
+def writer(helper):
+    w = helper.notice_writer
+    w.delay = 3600  # the background flush never fires during a test
+    return w
+
+
+def stored(db):
+    conn = db.get_connection()
+    try:
+        return [r["message"] for r in conn.execute("SELECT message FROM notices ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_flushes_when_the_buffer_is_full(helper, writer):
+    writer.max_pending = 3
+    writer.add("ana", "North", "one", "🌱")
+    writer.add("ana", "North", "two", "🌱")
+    assert writer.pending() == 2
+    assert stored(helper) == []
+
+    writer.add("ana", "North", "three", "🌱")
+    assert writer.pending() == 0
+    assert stored(helper) == ["one", "two", "three"]
+    assert writer.last_id == 3
+
+
+def test_buffered_notices_are_written_at_exit(tmp_path):
+    db_path = str(tmp_path / "exit.db")
+    script = (
+        "from database import DatabaseHelper\n"
+        f"db = DatabaseHelper(db_path={db_path!r}, storage_profile='test')\n"
+        "db.notice_writer.delay = 3600\n"
+        "db.add_notice('ana', 'North', 'bye', '🌱')\n"
+        "assert db.notice_writer.pending() == 1\n"
+    )
+    env = dict(os.environ, DB_PATH=db_path)
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True, timeout=60)
+
+    from database import DatabaseHelper
+    db = DatabaseHelper(db_path=db_path, storage_profile="test")
+    try:
+        assert stored(db) == ["bye"]
+    finally:
+        db.pool.close_all()
+
+
+def test_community_sees_a_notice_written_by_another_worker(helper, writer):
+    from database import DatabaseHelper
+    other = DatabaseHelper(db_path=helper.pool.db_path, storage_profile="test")
+    try:
+        other.community.ttl = 3600  # only a reload can show the new notice
+        assert other.get_community_snapshot("North", WEEK).notices == []
+
+        # the posting worker: what the after_request hook does
+        writer.add("ana", "North", "hello", "🌱")
+        writer.flush()
+        upto = writer.last_id
+
+        assert other.get_community_snapshot("North", WEEK).notices == []  # stale for everyone else
+        snap = other.get_community_snapshot("North", WEEK, notices_upto=upto)
+        assert [n["message"] for n in snap.notices] == ["hello"]
+        assert snap.notices_upto == upto
+    finally:
+        other.pool.close_all()
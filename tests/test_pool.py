@@ -0,0 +1,112 @@
+import os
+import threading
+
+import pytest
+
+from database import ConnectionPool, STORAGE_PROFILES
+
+
+@pytest.fixture
+def pool(tmp_path):
+    p = ConnectionPool(str(tmp_path / "pool.db"), max_size=2, idle_timeout=300, profile=STORAGE_PROFILES["test"])
+    yield p
+    p.close_all()
+
+
+def test_released_connection_is_reused(pool):
+    conn = pool.acquire()
+    conn.close()
+    assert pool.acquire() is conn
+
+
+def test_close_rolls_back_uncommitted_work(pool):
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.close()
+    conn = pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    conn.close()
+
+
+def test_double_close_returns_connection_once(pool):
+    conn = pool.acquire()
+    conn.close()
+    conn.close()
+    assert len(pool._idle) == 1
+
+
+def test_each_thread_gets_back_its_own_connection(pool):
+    a = pool.acquire()
+    b = pool.acquire()
+    assert a is not b  # both checked out at once
+
+    got = {}
+    ready = threading.Barrier(2)
+
+    def worker(name):
+        conn = pool.acquire()
+        ready.wait()  # both threads hold a connection
+        conn.close()
+        ready.wait()  # both have released theirs
+        again = pool.acquire()
+        got[name] = (conn, again)
+        again.close()
+
+    a.close()
+    b.close()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in ("t1", "t2")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for first, again in got.values():
+        assert first is again
+    assert got["t1"][0] is not got["t2"][0]
+
+
+def test_idle_connections_are_capped(pool):
+    conns = [pool.acquire() for _ in range(4)]
+    for c in conns:
+        c.close()
+    assert len(pool._idle) == pool.max_size
+
+
+def test_expired_connections_are_dropped(pool):
+    pool.idle_timeout = 0.01
+    conn = pool.acquire()
+    conn.close()
+    conn._released_at -= 1
+    assert pool.acquire() is not conn
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_pool_is_not_shared_after_fork(pool):
+    idle = pool.acquire()
+    idle.close()                 # sits in the parent's idle list
+    held = pool.acquire()        # checked out across the fork
+    held.execute("SELECT 1")
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        ok = True
+        try:
+            conn = pool.acquire()
+            ok &= conn is not idle and conn is not held
+            conn.close()
+            held.close()  # inherited handle: discarded, not pooled
+            ok &= all(c is not held for c in pool._idle)
+        except Exception:
+            ok = False
+        os.write(w, b"1" if ok else b"0")
+        os._exit(0)
+    os.close(w)
+    result = os.read(r, 1)
+    os.close(r)
+    os.waitpid(pid, 0)
+    assert result == b"1"
+    # the parent's pool is untouched
+    held.close()
+    assert pool.acquire() is held
@@ -0,0 +1,115 @@
+"""
+The compiled ProfanityMatcher must give the same verdicts as the old
+per-token loops it replaced (features/story.py before the matcher).
+"""
+import os
+import random
+import re
+
+import pytest
+
+from conftest import ROOT
+from profanity import (
+    BAD_PHRASE_PATTERNS, BAD_ROOTS, LEET_MAP, STRICT_BANNED, ProfanityMatcher, load_banned_words_file,
+)
+
+WORDS = STRICT_BANNED | load_banned_words_file(os.path.join(ROOT, "banned_words.txt"))
+MATCHER = ProfanityMatcher(WORDS)
+
+
+# ------------------------------------------------------------
+# the old implementation
+# ------------------------------------------------------------
+def _tokenize_normalized(text):
+    if not text:
+        return []
+    lowered = text.lower().translate(LEET_MAP)
+    tokens = re.split(r"[^a-z0-9]+", lowered)
+    return [t for t in tokens if t]
+
+
+def old_contains_bad_content(text):
+    if not text:
+        return False
+    low = text.lower()
+    for pat in BAD_PHRASE_PATTERNS:
+        if re.search(pat, low):
+            return True
+    for t in _tokenize_normalized(text):
+        if t == "ass":
+            return True
+        if t in BAD_ROOTS:
+            return True
+        if re.fullmatch(r"f+u*c+k+(i+n+g+)?", t):
+            return True
+        if re.fullmatch(r"f+k+(i+n+g+)?", t):
+            return True
+        if re.fullmatch(r"sh+i+t+", t):
+            return True
+        if re.fullmatch(r"bi+t+ch+", t):
+            return True
+        for root in BAD_ROOTS:
+            if root in t and len(t) <= 30:
+                return True
+    return False
+
+
+def old_contains_bad_word(text):
+    tokens = re.split(r'[^a-zA-Z0-9]+', text.lower())
+    for t in tokens:
+        if t in WORDS:
+            return True
+    return False
+
+
+# ------------------------------------------------------------
+# corpus
+# ------------------------------------------------------------
+CLEAN = (
+    "my grandmother taught me to plant chilli and pandan in the kampong garden "
+    "we would wake up early before school and water everything together "
+    "assignment classic bass cocktail therapist analysis "
+    "i still remember the smell of rain on the zinc roof and the sound of the radio"
+).split()
+NOISE = ["fuuuck", "f*ck", "sh1t", "$ex", "biiitch", "fkn", "fking", "@ss", "ass", "go and die",
+         "kys", "kill   yourself", "knn", "CB", "f u c k", "fuck" * 9, "x" * 31 + "cb", "porn",
+         "dickens", "cocky", "scunthorpe", "f" + "u" * 40 + "ck", "y" * 40 + " fk", "Dick",
+         "shiitake", "class", "g0 die", "2 girls 1 cup", "", "   ", "!!!"]
+
+
+def fuzz_corpus(n, rng):
+    out = []
+    for _ in range(n):
+        words = [rng.choice(CLEAN) for _ in range(rng.randint(1, 20))]
+        if rng.random() < 0.5:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(NOISE))
+        sep = rng.choice([" ", " ", "-", ".", "_", "!!", "\n"])
+        out.append(sep.join(words))
+    return out
+
+
+def verdicts_old(text):
+    return old_contains_bad_word(text), old_contains_bad_content(text)
+
+
+def verdicts_new(text):
+    return MATCHER.contains_bad_word(text), MATCHER.contains_bad_content(text)
+
+
+@pytest.mark.parametrize("text", NOISE + CLEAN)
+def test_edge_cases_match_old_loops(text):
+    assert verdicts_new(text) == verdicts_old(text)
+
+
+def test_fuzzed_corpus_matches_old_loops():
+    corpus = fuzz_corpus(5000, random.Random(7))
+    mismatches = [t for t in corpus if verdicts_new(t) != verdicts_old(t)]
+    assert mismatches == []
+
+
+def test_known_verdicts():
+    assert MATCHER.contains_bad_content("fuuuck this")
+    assert MATCHER.contains_bad_content("you @ss")
+    assert MATCHER.contains_bad_content("scunthorpe")  # substring roots, same as before
+    assert not MATCHER.contains_bad_content("water the pandan before school")
+    assert not MATCHER.contains_bad_word("my grandmother's garden")
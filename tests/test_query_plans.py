@@ -0,0 +1,150 @@
+"""
+Every statement the hot DatabaseHelper methods run must use an index.
+
+The methods are called for real against a small, freshly migrated
+database while a trace callback records the SQL they execute (with the
+parameters filled in); each recorded statement then goes through
+EXPLAIN QUERY PLAN. Rewriting a WHERE clause or dropping an index makes
+the offending method show up here.
+"""
+from datetime import datetime
+
+import pytest
+
+from conftest import add_user
+
+MONDAY = datetime(2026, 10, 12)
+
+
+def full_scans(conn, sql):
+    """EXPLAIN QUERY PLAN lines that walk a whole table instead of an index."""
+    scans = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall():
+        detail = row[3]
+        # scanning a subquery result / constant row is not a table scan
+        if detail.startswith("SCAN ") and not detail.startswith(("SCAN (", "SCAN CONSTANT ROW")):
+            scans.append(detail)
+    return scans
+
+
+@pytest.fixture
+def traced(helper, monkeypatch):
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana", "youth", "North")
+    ben = add_user(conn, "ben", "senior", "North")
+    conn.commit()
+    conn.close()
+
+    statements = []
+    acquire = helper.get_connection
+
+    def get_connection():
+        c = acquire()
+        c.set_trace_callback(statements.append)
+        return c
+
+    monkeypatch.setattr(helper, "get_connection", get_connection)
+    return helper, ana, ben, statements
+
+
+def hot_calls(db, ana, ben):
+    """The methods behind the story feed, community page, DMs, garden and moderation."""
+    story_id = db.create_story(ana, "t", "c", "life", "all", None)
+    yield "create_story"
+    db.get_story_feed_page("senior", ben)
+    db.get_story_feed_page("youth", ana, cursor=story_id + 1)
+    db.get_story_feed_page("youth", ana, cursor=0, sort="oldest", topic="life")
+    db.get_story_feed_page("youth", ana, cursor=f"5:{story_id + 1}", sort="popular", search="garden")
+    yield "get_story_feed_page"
+    db.get_user_stories(ana)
+    db.get_user_drafts(ana)
+    db.get_admin_stories()
+    yield "story pages"
+    db.toggle_like(story_id, ben)
+    db.toggle_like(story_id, ben)
+    yield "toggle_like"
+    db.add_comment(story_id, ben, "nice")
+    db.get_story_comments(story_id, ben)
+    yield "comments"
+
+    db.get_profile_by_user_id(ana)
+    db.add_notice("ana", "North", "hi")
+    db.add_tree_stat(ana, "North", "harvest_tree", 5)
+    db.get_community_snapshot("North", MONDAY.strftime("%Y-%m-%d"))
+    db.get_region_member_counts("North")
+    db.get_region_tree_totals("North")
+    db.get_region_notices("North", limit=3)
+    db.get_latest_notice_timestamp("North")
+    db.get_latest_notice_timestamp_in_range(MONDAY, MONDAY.replace(day=19))
+    db.get_region_message_counts(MONDAY, MONDAY.replace(day=19))
+    yield "community page"
+    db.compute_weekly_winners(MONDAY)
+    db.get_weekly_achievements(MONDAY.strftime("%Y-%m-%d"))
+    yield "weekly achievements"
+
+    msg_id = db.save_message(ana, ben, "hello")
+    db.save_region_message(ana, "North", "hi all")
+    db.get_region_messages("North")
+    yield "save messages"
+    db.get_chat_history(ana, ben)
+    db.get_chat_history(ana, ben, before_id=msg_id)
+    db.get_dm_sidebar(ben, "youth")
+    db.get_unread_counts(ben)
+    db.get_unread_count(ben, ana)
+    db.get_unread_ids(ana, ben)
+    db.get_read_upto(ben, ana)
+    yield "dm reads"
+    db.receipts.delivered(msg_id)
+    db.receipts.read(ana, ben, msg_id)
+    db.receipts.flush()
+    db.mark_read_for_chat(ana, ben)
+    db.mark_read(ana, ben)
+    yield "read receipts"
+    db.get_dm_partner_ids(ana)
+    db.get_region_user_ids("North")
+    yield "presence audiences"
+
+    db.get_user_plots(ana)
+    db.get_garden_history(ana)
+    db.get_user_rewards(ana)
+    db.record_game_match(ana, ben, "hangman", ana)
+    db.get_user_game_history(ana)
+    yield "garden and games"
+    db.put_cached_verdict("k", "approved", 1e12)
+    db.get_cached_verdict("k", 0)
+    yield "verdict cache"
+    sha = "ab" * 32
+    db.record_upload_blob(sha, f"blobs/ab/{sha}.png", "png", 1)
+    db.get_upload_variants(sha)
+    db.release_upload(sha, f"blobs/ab/{sha}.png", lambda files: None)
+    yield "upload blobs"
+
+    comment_id = db.add_comment(story_id, ana, "pending one", status="pending")
+    db.set_comment_status(comment_id, "approved")
+    db.set_comment_status(comment_id, "rejected")
+    db.report_story(story_id, ben, "spam")
+    db.approve_story(story_id)
+    db.delete_story(story_id)
+    yield "moderation and deletes"
+
+
+def test_hot_queries_use_indexes(traced):
+    db, ana, ben, statements = traced
+    problems = {}
+    for name in hot_calls(db, ana, ben):
+        ran, statements[:] = list(statements), []
+        conn = db.pool.acquire()
+        try:
+            for sql in ran:
+                scans = full_scans(conn, sql)
+                if scans:
+                    problems.setdefault(name, []).append((" ".join(sql.split()), scans))
+        finally:
+            conn.close()
+    assert problems == {}
+
+
+def test_trace_sees_the_queries(traced):
+    db, ana, _, statements = traced
+    db.get_profile_by_user_id(ana)
+    assert any("FROM profiles WHERE user_id" in s for s in statements)
@@ -0,0 +1,125 @@
+import pytest
+
+from conftest import add_user
+from database import ReceiptWriter
+
+
+@pytest.fixture
+def chat(helper):
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana")
+    ben = add_user(conn, "ben")
+    conn.commit()
+    conn.close()
+    # flushed by hand in these tests
+    writer = ReceiptWriter(helper, delay=3600, max_pending=1000)
+    return helper, writer, ana, ben
+
+
+def message_row(db, msg_id):
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT delivered_at, read_at FROM messages WHERE id = ?", (msg_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_repeated_receipts_are_coalesced(chat):
+    db, writer, ana, ben = chat
+    m1 = db.save_message(ana, ben, "one")
+    m2 = db.save_message(ana, ben, "two")
+
+    writer.delivered(m1, "2026-10-12 10:00:00")
+    writer.delivered(m1, "2026-10-12 10:00:05")
+    writer.read(ana, ben, m2, "2026-10-12 10:01:00")
+    writer.read(ana, ben, m1, "2026-10-12 10:02:00")  # older id doesn't lower the mark
+    assert writer.pending() == 2
+
+    assert writer.flush() == 2
+    assert writer.pending() == 0
+    assert message_row(db, m1)["delivered_at"] == "2026-10-12 10:00:00"
+    assert message_row(db, m2)["read_at"] is not None
+    assert db.get_read_upto(ben, ana) == m2
+
+
+def test_read_only_covers_messages_up_to_the_seen_id(chat):
+    db, writer, ana, ben = chat
+    m1 = db.save_message(ana, ben, "one")
+    m2 = db.save_message(ana, ben, "two")
+    assert db.get_unread_count(ben, ana) == 2
+
+    writer.read(ana, ben, m2)
+    assert db.get_unread_count(ben, ana) == 0  # badge clears straight away
+    m3 = db.save_message(ana, ben, "arrived while the receipt was buffered")
+
+    writer.flush()
+    assert message_row(db, m1)["read_at"] is not None
+    assert message_row(db, m2)["read_at"] is not None
+    assert message_row(db, m3)["read_at"] is None
+    assert db.get_read_upto(ben, ana) == m2
+    # the flush writes the exact count back: m3 is still unread
+    assert db.get_unread_count(ben, ana) == 1
+    assert db.get_unread_counts(ben) == {ana: 1}
+
+
+def test_failed_flush_keeps_the_receipts(chat, monkeypatch):
+    db, writer, ana, ben = chat
+    m1 = db.save_message(ana, ben, "one")
+    writer.delivered(m1)
+    writer.read(ana, ben, m1)
+
+    def broken(delivered, read):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(writer, "_write", broken)
+    assert writer.flush() == 0
+    assert writer.pending() == 2
+
+    monkeypatch.undo()
+    assert writer.flush() == 2
+    assert message_row(db, m1)["read_at"] is not None
+
+
+@pytest.fixture
+def sockets(helper, monkeypatch):
+    """The messaging socket handlers on a bare app, on the test database."""
+    from flask import Flask
+    from flask_socketio import SocketIO
+
+    from features import messaging
+
+    monkeypatch.setattr(messaging, "db_helper", helper)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    socketio = SocketIO(app, async_mode="threading")
+    messaging.init_messaging(socketio)
+
+    def connect(uid):
+        http = app.test_client()
+        with http.session_transaction() as s:
+            s["user_id"] = uid
+        return socketio.test_client(app, flask_test_client=http)
+
+    return connect
+
+
+def dm_reads(client):
+    return [e["args"][0] for e in client.get_received() if e["name"] == "dm_read"]
+
+
+def test_dm_read_payload_is_upto_from_both_handlers(chat, sockets):
+    db, _, ana, ben = chat
+    db.save_message(ana, ben, "one")
+    m2 = db.save_message(ana, ben, "two")
+    sender, reader = sockets(ana), sockets(ben)
+    sender.emit("dm_join", {"other_id": ben})
+    sender.get_received()
+
+    # opening the chat marks everything read
+    reader.emit("dm_join", {"other_id": ana})
+    assert dm_reads(sender) == [{"reader_id": ben, "upto": m2}]
+
+    # a message read while the chat is open
+    m3 = db.save_message(ana, ben, "three")
+    reader.emit("dm_mark_read", {"sender_id": ana, "msg_id": m3})
+    assert dm_reads(sender) == [{"reader_id": ben, "upto": m3}]
@@ -0,0 +1,124 @@
+"""
+The weekly region rollups kept up to date as things happen must match a
+rebuild from scratch, whatever order approvals, deletes and region moves
+come in.
+"""
+import pytest
+
+from conftest import add_user
+
+
+def snapshot(db):
+    conn = db.get_connection()
+    try:
+        return (
+            sorted(tuple(r) for r in conn.execute("SELECT * FROM region_week_activity")),
+            sorted(tuple(r) for r in conn.execute("SELECT * FROM region_week_users")),
+        )
+    finally:
+        conn.close()
+
+
+def this_week(db, region):
+    conn = db.get_connection()
+    try:
+        row = conn.execute("""
+            SELECT actions, unique_users, harvests FROM region_week_activity
+            WHERE week_start = date('now', '-6 days', 'weekday 1') AND region = ?
+        """, (region,)).fetchone()
+        return tuple(row) if row else (0, 0, 0)
+    finally:
+        conn.close()
+
+
+def move_region(db, uid, region):
+    conn = db.get_connection()
+    conn.execute("UPDATE profiles SET region = ? WHERE user_id = ?", (region, uid))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def people(helper):
+    conn = helper.get_connection()
+    ana = add_user(conn, "ana", "youth", "North")
+    ben = add_user(conn, "ben", "senior", "North")
+    cai = add_user(conn, "cai", "youth", "East")
+    conn.commit()
+    conn.close()
+    return helper, ana, ben, cai
+
+
+def test_incremental_matches_rebuild(people):
+    db, ana, ben, cai = people
+    kept = db.create_story(ana, "kept", "text", "life", "youth", None)
+    gone = db.create_story(ben, "gone", "text", "life", "senior", None)
+    pending = db.create_story(cai, "pending", "text", "life", "youth", None, "pending")
+
+    c1 = db.add_comment(kept, ben, "nice")
+    c2 = db.add_comment(kept, cai, "later", status="pending")
+    db.add_comment(gone, cai, "on a story that goes away")
+    db.set_comment_status(c2, "approved")
+    db.set_comment_status(c2, "rejected")
+    db.set_comment_status(c2, "approved")   # re-approved: still one activity
+    db.delete_comment(c1, ben)
+
+    db.set_story_moderation(pending, "approved")
+    db.report_story(pending, ana, "spam")   # back to pending: taken out
+    db.approve_story(pending)                # and counted again, once
+    db.delete_story(gone)
+
+    move_region(db, ana, "East")
+    db.record_game_match(ana, ben, "hangman", ana)
+    db.add_tree_stat(ben, "North", "harvest_tree", 5)
+    db.save_region_message(cai, "East", "hi")
+
+    incremental = snapshot(db)
+    db.rebuild_region_rollups()
+    assert snapshot(db) == incremental
+
+
+def test_activity_stays_in_the_region_it_happened_in(people):
+    db, ana, _, _ = people
+    story = db.create_story(ana, "north story", "text", "life", "youth", None)
+    move_region(db, ana, "East")
+    db.rebuild_region_rollups()
+    assert this_week(db, "North") == (1, 1, 0)
+    assert this_week(db, "East") == (0, 0, 0)
+
+    # taking it back goes to North too, where it was counted
+    db.delete_story(story)
+    assert this_week(db, "North") == (0, 0, 0)
+
+
+def test_deletes_and_reapprovals_are_symmetric(people):
+    db, ana, ben, _ = people
+    story = db.create_story(ana, "s", "text", "life", "youth", None)
+    comment = db.add_comment(story, ben, "first", status="pending")
+    assert this_week(db, "North") == (1, 1, 0)
+
+    db.set_comment_status(comment, "approved")
+    db.set_comment_status(comment, "approved")
+    assert this_week(db, "North") == (2, 2, 0)
+
+    db.set_comment_status(comment, "rejected")
+    assert this_week(db, "North") == (1, 1, 0)   # ben's only activity gone: one user less
+
+    db.set_comment_status(comment, "approved")
+    db.delete_story(story)                       # story and its comment
+    assert this_week(db, "North") == (0, 0, 0)
+
+
+def test_weekly_winners_read_the_rollups(people):
+    db, ana, ben, cai = people
+    db.add_tree_stat(cai, "East", "harvest_flower", 3)
+    db.create_story(ana, "a", "text", "life", "youth", None)
+    db.create_story(ben, "b", "text", "life", "senior", None)
+
+    conn = db.get_connection()
+    monday = conn.execute("SELECT date('now', '-6 days', 'weekday 1')").fetchone()[0]
+    conn.close()
+    from datetime import datetime
+    assert db.compute_weekly_winners(datetime.strptime(monday, "%Y-%m-%d")) == (
+        "North Region", "North Region", "East Region"
+    )
@@ -0,0 +1,153 @@
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import uploads
+from conftest import add_user
+
+PIL = pytest.importorskip("PIL.Image")
+
+
+def png_bytes(color):
+    buf = io.BytesIO()
+    PIL.new("RGB", (1800, 900), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def store(helper, tmp_path, monkeypatch):
+    """uploads.py writing into a temp dir, on the test database, variants built inline."""
+    root = tmp_path / "uploads"
+    (root / uploads.BLOB_DIR).mkdir(parents=True)
+    monkeypatch.setattr(uploads, "UPLOAD_ROOT", str(root))
+    monkeypatch.setattr(uploads, "db_helper", helper)
+    monkeypatch.setattr(uploads.variant_worker, "workers", 0)
+    uploads._variant_cache.clear()
+
+    conn = helper.get_connection()
+    uid = add_user(conn, "ana")
+    conn.commit()
+    conn.close()
+    return helper, uid
+
+
+def upload(data, filename="photo.png"):
+    return uploads.save_upload(FileStorage(stream=io.BytesIO(data), filename=filename))
+
+
+def files_of(name, db):
+    variants = db.get_upload_variants(uploads._sha_of(name))
+    return [uploads.upload_path(n) for n in [name, *variants.values()]]
+
+
+def blob_row(db, name):
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT 1 FROM upload_blobs WHERE rel_path = ?", (name,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_shared_blob_is_deleted_with_its_last_reference(store):
+    db, uid = store
+    name = upload(png_bytes("green"))
+    assert upload(png_bytes("green"), "same.png") == name  # stored once
+    paths = files_of(name, db)
+    assert len(paths) == 4  # original + thumb/card/large
+
+    first = db.create_story(uid, "a", "text", "garden", "youth", name)
+    second = db.create_story(uid, "b", "text", "garden", "youth", name)
+
+    db.delete_story(first)
+    uploads.remove_upload(name)
+    assert all(os.path.exists(p) for p in paths)
+
+    db.delete_story(second)
+    uploads.remove_upload(name)
+    assert not any(os.path.exists(p) for p in paths)
+    assert blob_row(db, name) is None
+
+
+def test_rejected_image_is_deleted_even_if_referenced(store):
+    db, uid = store
+    name = upload(png_bytes("red"))
+    paths = files_of(name, db)
+    other = db.create_story(uid, "other", "text", "garden", "youth", name)
+    story = db.create_story(uid, "new", "text", "garden", "youth", name, "pending")
+
+    db.set_story_moderation(story, "approved", clear_image=True)
+    uploads.remove_upload(name, force=True)
+    assert not any(os.path.exists(p) for p in paths)
+    assert blob_row(db, name) is None
+    assert db.get_story_by_id(other)["image_path"] == name
+
+
+def test_draft_image_removed_and_chat_copy_kept(store):
+    db, uid = store
+    name = upload(png_bytes("blue"))
+    paths = files_of(name, db)
+    db.create_draft(uid, "draft", "text", "garden", name)
+    draft = db.get_user_drafts(uid)[0]["id"]
+    msg = db.save_message(uid, uid, "", message_type="image", media_path="uploads/" + name)
+
+    # "remove image" on the draft: the chat message still shows it
+    db.update_draft(draft, uid, "draft", "text", "garden", None)
+    uploads.remove_upload(name)
+    assert all(os.path.exists(p) for p in paths)
+
+    conn = db.get_connection()
+    conn.execute("DELETE FROM messages WHERE id = ?", (msg,))
+    conn.commit()
+    conn.close()
+    uploads.remove_upload(name)
+    assert not any(os.path.exists(p) for p in paths)
+
+
+def test_reupload_after_delete_restores_the_blob(store):
+    db, uid = store
+    name = upload(png_bytes("yellow"))
+    uploads.remove_upload(name)
+    assert not os.path.exists(uploads.upload_path(name))
+
+    assert upload(png_bytes("yellow")) == name
+    assert os.path.exists(uploads.upload_path(name))
+    assert blob_row(db, name) is not None
+    assert db.get_upload_variants(uploads._sha_of(name))
+
+
+def test_chat_upload_has_its_variants_straight_away(store, monkeypatch):
+    db, _ = store
+    monkeypatch.setattr(uploads.variant_worker, "workers", 2)  # the pool would build them later
+    name = uploads.save_upload(
+        FileStorage(stream=io.BytesIO(png_bytes("purple")), filename="chat.png"), wait_for_variants=True
+    )
+    variants = db.get_upload_variants(uploads._sha_of(name))
+    assert set(variants) == set(uploads.VARIANTS)
+    assert os.path.exists(uploads.upload_path(variants["card"]))
+
+
+def test_default_avatar_survives_a_new_upload_after_remove_photo(store):
+    db, uid = store
+    default = uploads.upload_path("profile_pic.png")
+    with open(default, "wb") as f:
+        f.write(png_bytes("white"))
+
+    def set_pic(name):
+        """What remove_photo / edit_profile do: repoint the row, then release the old file."""
+        conn = db.get_connection()
+        old = conn.execute("SELECT profile_pic FROM profiles WHERE user_id = ?", (uid,)).fetchone()[0]
+        conn.execute("UPDATE profiles SET profile_pic = ? WHERE user_id = ?", (name, uid))
+        conn.commit()
+        conn.close()
+        uploads.remove_upload(old)
+
+    set_pic(upload(png_bytes("red")))
+    set_pic("profile_pic.png")         # remove photo
+    set_pic(upload(png_bytes("blue")))  # new picture replaces the default
+    assert os.path.exists(default)
+
+    uploads.remove_upload("logo.jpeg", force=True)  # not even forced
+    uploads.remove_upload("profile_pic.png", force=True)
+    assert os.path.exists(default)
@@ -0,0 +1,281 @@
+"""
+One upload path for story photos, profile pictures, event images and chat images.
+
+- The request body is streamed to a temp file in chunks while it is hashed,
+  never read into memory whole.
+- Files are named by their sha256 (static/uploads/blobs/ab/abcd...ef.jpg),
+  so the same picture uploaded twice is stored once. Each blob gets a row
+  in upload_blobs. remove_upload() deletes a blob (and its variants) once
+  nothing references it any more.
+- A background worker writes smaller WebP (JPEG if WebP isn't available)
+  variants with Pillow. Without Pillow installed there are no variants and
+  everything is served at full size, like before.
+- Templates call upload_url(name, "card") and get the variant when it's
+  ready, the original otherwise. Old, non-blob file names still work.
+
+The stored name is relative to static/uploads, same as the old file names,
+so the existing image_path / profile_pic / image_filename columns don't change.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import url_for
+from werkzeug.utils import secure_filename
+
+from database import db_helper
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional - no variants without it
+    Image = None
+
+UPLOAD_ROOT = os.path.join("static", "uploads")
+BLOB_DIR = "blobs"
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_VARIANT_WORKERS = int(os.getenv("UPLOAD_VARIANT_WORKERS", "2"))
+
+# files shipped in static/uploads that rows point at as placeholders
+# (profiles.profile_pic after "remove photo", the default image) - never user-owned
+SHARED_DEFAULTS = {"profile_pic.png", "logo.jpeg"}
+
+IMAGE_EXTS = {"png", "jpg", "jpeg", "webp", "gif"}
+EXT_ALIASES = {"jpeg": "jpg"}
+
+# name -> longest side in px
+VARIANTS = {
+    "thumb": 160,   # avatars, manage page thumbnails
+    "card": 720,    # story feed cards, chat bubbles
+    "large": 1600,  # story page hero image
+}
+
+os.makedirs(os.path.join(UPLOAD_ROOT, BLOB_DIR), exist_ok=True)
+
+
+class UploadError(Exception):
+    """Bad upload (wrong type, too big, empty) - message is safe to show the user."""
+
+
+class StagedUpload:
+    """An upload streamed to a temp file and hashed, not yet in the blob store."""
+
+    def __init__(self, tmp_path, sha256, size, ext):
+        self.tmp_path = tmp_path
+        self.sha256 = sha256
+        self.size = size
+        self.ext = ext
+
+    def discard(self):
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def _ext_of(filename):
+    name = secure_filename(filename or "")
+    if "." not in name:
+        return ""
+    ext = name.rsplit(".", 1)[-1].lower()
+    return EXT_ALIASES.get(ext, ext)
+
+
+def blob_name(sha256, ext, variant=None):
+    """Path under static/uploads for a blob (or one of its variants)."""
+    base = f"{BLOB_DIR}/{sha256[:2]}/{sha256}"
+    return f"{base}_{variant}.{ext}" if variant else f"{base}.{ext}"
+
+
+def _sha_of(name):
+    """sha256 of a blob name, None for legacy file names."""
+    if not name or not name.startswith(BLOB_DIR + "/"):
+        return None
+    stem = name.rsplit("/", 1)[-1].split(".", 1)[0]
+    return stem if len(stem) == 64 else None
+
+
+def stage_upload(file, allowed_exts=IMAGE_EXTS, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream a werkzeug FileStorage to a temp file, hashing as it goes."""
+    if not file or not file.filename:
+        raise UploadError("No file.")
+    ext = _ext_of(file.filename)
+    if allowed_exts and ext not in {EXT_ALIASES.get(e, e) for e in allowed_exts}:
+        raise UploadError("Invalid file type.")
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix="__upload_", dir=UPLOAD_ROOT)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError(f"File too large (max {max_bytes // (1024 * 1024)} MB).")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError("Empty file.")
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return StagedUpload(tmp_path, digest.hexdigest(), size, ext)
+
+
+def commit_upload(staged, make_variants=True, wait_for_variants=False):
+    """
+    Move a staged upload into the blob store. Returns its stored name.
+    wait_for_variants builds the variants before returning (chat images,
+    whose URL is sent out straight away).
+    """
+    name = blob_name(staged.sha256, staged.ext)
+    path = os.path.join(UPLOAD_ROOT, name)
+    # row first, then the file: a remove_upload() of the same bytes that is
+    # deleting the old copy right now finishes before the row is written,
+    # and the file is put back after it
+    db_helper.record_upload_blob(staged.sha256, name, staged.ext, staged.size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(staged.tmp_path, path)  # same bytes if it was already stored
+
+    if make_variants and staged.ext in IMAGE_EXTS:
+        if wait_for_variants:
+            if Image is not None:
+                variant_worker.build(staged.sha256, name)
+        else:
+            variant_worker.submit(staged.sha256, name)
+    return name
+
+
+def save_upload(file, allowed_exts=IMAGE_EXTS, make_variants=True, wait_for_variants=False):
+    """stage_upload + commit_upload in one go. Returns the stored name."""
+    return commit_upload(stage_upload(file, allowed_exts), make_variants=make_variants,
+                         wait_for_variants=wait_for_variants)
+
+
+def upload_path(name):
+    """Filesystem path for a stored name."""
+    return os.path.join(UPLOAD_ROOT, name)
+
+
+def remove_upload(name, force=False):
+    """
+    Call after a row stopped pointing at an uploaded file. Blobs are shared
+    by everyone who uploaded the same bytes, so the file and its variants
+    are only deleted once no story, draft, profile, event or message uses
+    it; force=True deletes it regardless (a rejected image). The shared
+    placeholders in SHARED_DEFAULTS are never deleted.
+    """
+    if not name or name in SHARED_DEFAULTS:
+        return
+    sha = _sha_of(name)
+    try:
+        if db_helper.release_upload(sha, name, _delete_files, force=force) and sha:
+            _variant_cache.pop(sha, None)
+    except Exception as e:
+        print(f"⚠️ could not release upload {name}: {e}")
+
+
+def _delete_files(names):
+    for n in names:
+        try:
+            os.remove(upload_path(n))
+        except OSError:
+            pass
+
+
+# ============================================================
+# VARIANTS
+# ============================================================
+class VariantWorker:
+    """Background thread pool that writes the resized variants of a blob."""
+
+    def __init__(self, workers=UPLOAD_VARIANT_WORKERS):
+        self.workers = int(workers)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def submit(self, sha256, name):
+        if Image is None:
+            return None
+        if self.workers <= 0:
+            return self.build(sha256, name)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload-variants")
+            executor = self._executor
+        return executor.submit(self.build, sha256, name)
+
+    def build(self, sha256, name):
+        if db_helper.get_upload_variants(sha256):
+            return None  # already done for this blob
+        made = {}
+        try:
+            with Image.open(upload_path(name)) as im:
+                if getattr(im, "is_animated", False):
+                    return None  # keep GIF animations as they are
+                im = ImageOps.exif_transpose(im)
+                for variant, max_side in VARIANTS.items():
+                    if max(im.size) <= max_side and variant != "thumb":
+                        continue  # no upscaling; the original is small enough
+                    copy = im.copy()
+                    copy.thumbnail((max_side, max_side))
+                    made[variant] = self._save(copy, sha256, variant)
+        except Exception as e:
+            print(f"⚠️ upload variants failed for {name}: {e}")
+            return None
+        if made:
+            db_helper.set_upload_variants(sha256, made)
+            _variant_cache.pop(sha256, None)
+        return made
+
+    def _save(self, im, sha256, variant):
+        try:
+            out = blob_name(sha256, "webp", variant)
+            im.save(upload_path(out), "WEBP", quality=80, method=4)
+        except Exception:
+            # Pillow built without WebP
+            out = blob_name(sha256, "jpg", variant)
+            im.convert("RGB").save(upload_path(out), "JPEG", quality=82, optimize=True, progressive=True)
+        return out
+
+
+variant_worker = VariantWorker()
+
+# sha256 -> (checked_at, {variant: name}); misses are re-checked after a while
+_variant_cache = {}
+VARIANT_CACHE_MISS_SECONDS = 30
+
+
+def _variants_for(sha256):
+    now = time.monotonic()
+    hit = _variant_cache.get(sha256)
+    if hit is not None and (hit[1] or now - hit[0] < VARIANT_CACHE_MISS_SECONDS):
+        return hit[1]
+    variants = db_helper.get_upload_variants(sha256)
+    _variant_cache[sha256] = (now, variants)
+    return variants
+
+
+def upload_url(name, variant=None, default="logo.jpeg"):
+    """
+    URL for an uploaded file (name relative to static/uploads).
+    {{ upload_url(story.image_path, 'card') }} gives the 720px variant when
+    it exists and falls back to the original, then to `default`.
+    """
+    name = (name or "").strip() or default
+    if variant:
+        sha = _sha_of(name)
+        if sha:
+            name = _variants_for(sha).get(variant, name)
+    return url_for("static", filename="uploads/" + name)